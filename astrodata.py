@@ -4,13 +4,48 @@
 from __future__ import unicode_literals
 import calendar
 import datetime
+import math
+import multiprocessing
 import ephem
+import numpy
 
+import cache
 import climate
+import spans
 
-# compute sun data once when file is loaded/imported
-s = ephem.Sun()
-s.compute()
+# use a constant non-leap year. constant because it doesn't matter outside
+# of leap or non-leap, non-leap since I suspect any monthly numbers
+# are given for non-leap Februarys
+YEAR = 2013
+
+# zenith angle of the sun's centre at sunrise and sunset: 90° plus
+# 34' of atmospheric refraction plus 16' for the sun's radius (sunrise
+# is when the upper edge appears). same convention as ephem's defaults.
+SUNRISE_ZENITH = 90.833
+
+# methods month_daylight() can use
+METHODS = ['ephem', 'analytic', 'table']
+
+# latitude spacing, in degrees, of the monthly daylight table
+# used by month_daylight(method = 'table')
+TABLE_STEP = 0.1
+
+# built on first use by get_daylight_table()
+daylight_table = None
+
+# observers resolved from place names, which may have taken a
+# Wikipedia lookup, and month_daylight() results. month_daylight()
+# results are keyed by coordinates rounded to DAYLIGHT_CACHE_DIGITS
+# decimal places of a degree (3 is about 100 m).
+observers = cache.LRUCache(1000)
+month_daylights = cache.LRUCache(10000)
+year_daylights = cache.LRUCache(1000)
+DAYLIGHT_CACHE_DIGITS = 3
+
+# seconds a failed place name lookup is remembered for. failures may be
+# temporary (Wikipedia or the network being down), so are tried again
+# after a while rather than never.
+FAILED_LOOKUP_TTL = 300
 
 def process_location(location):
     if not isinstance(location, ephem.Observer):
@@ -21,13 +56,28 @@ def process_location(location):
             location.lat = str(ll[0])
             location.lon = str(ll[1])
         else:
-            try:
-                location = ephem.city(unicode(location))
-            except:
-                try:
-                    location = get_location_from_wikipedia(unicode(location))
-                except:
-                    location = False
+            name = unicode(location)
+            location = observers.get(name)
+
+            if location is None:
+                with spans.span('astro.location', name):
+                    try:
+                        location = ephem.city(name)
+                    except:
+                        try:
+                            location = get_location_from_wikipedia(name)
+                        except:
+                            location = False
+
+                if location is False:
+                    observers.set(name, location, FAILED_LOOKUP_TTL)
+                else:
+                    observers.set(name, location)
+
+            if location is not False:
+                # callers set the observer's date, so don't hand out
+                # the cached one
+                location = location.copy()
 
     return location
 
@@ -50,9 +100,167 @@ def get_location_from_wikipedia(name):
 
     return location
 
+def location_lat_lon(location):
+    # latitude and longitude in degrees, from anything process_location
+    # understands, or None if it's a place that can't be found
+    location = process_location(location)
+    if location is False:
+        return None
+
+    # ephem stores angles in radians
+    return math.degrees(location.lat), math.degrees(location.lon)
+
+def solar_position(julian_day):
+    # sun's apparent declination in radians, and the equation of time
+    # in minutes, for an array of julian days. from the NOAA solar
+    # calculator (after Meeus, Astronomical Algorithms).
+    t = (julian_day - 2451545.0) / 36525.0  # julian centuries since J2000
+
+    mean_longitude = numpy.radians(280.46646
+        + t * (36000.76983 + t * 0.0003032))
+    mean_anomaly = numpy.radians(357.52911 + t * (35999.05029
+        - 0.0001537 * t))
+    eccentricity = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)
+
+    equation_of_centre = (numpy.sin(mean_anomaly)
+        * (1.914602 - t * (0.004817 + 0.000014 * t))
+        + numpy.sin(2 * mean_anomaly) * (0.019993 - 0.000101 * t)
+        + numpy.sin(3 * mean_anomaly) * 0.000289)
+
+    omega = numpy.radians(125.04 - 1934.136 * t)
+    apparent_longitude = mean_longitude + numpy.radians(equation_of_centre
+        - 0.00569 - 0.00478 * numpy.sin(omega))
+
+    obliquity = numpy.radians(23 + (26 + (21.448 - t * (46.815
+        + t * (0.00059 - t * 0.001813))) / 60) / 60
+        + 0.00256 * numpy.cos(omega))
+
+    declination = numpy.arcsin(numpy.sin(obliquity)
+        * numpy.sin(apparent_longitude))
+
+    y = numpy.tan(obliquity / 2) ** 2
+    equation_of_time = 4 * numpy.degrees(
+        y * numpy.sin(2 * mean_longitude)
+        - 2 * eccentricity * numpy.sin(mean_anomaly)
+        + 4 * eccentricity * y * numpy.sin(mean_anomaly)
+            * numpy.cos(2 * mean_longitude)
+        - 0.5 * y * y * numpy.sin(4 * mean_longitude)
+        - 1.25 * eccentricity * eccentricity * numpy.sin(2 * mean_anomaly))
+
+    return declination, equation_of_time
+
+def solar_declination(julian_day):
+    return solar_position(julian_day)[0]
+
+def sunrise_hour_angle(lat, declination):
+    # hour angle of sunrise/sunset in degrees. at the poles themselves
+    # the formula divides by zero; a hair off the pole gives the same answer
+    lat = numpy.radians(numpy.clip(lat, -89.999, 89.999))
+
+    cos_hour_angle = (math.cos(math.radians(SUNRISE_ZENITH))
+        / (numpy.cos(lat) * numpy.cos(declination))
+        - numpy.tan(lat) * numpy.tan(declination))
+
+    # below -1: sun is above the horizon all day (polar day),
+    # above 1: sun never gets up to the horizon (polar night)
+    return numpy.degrees(numpy.arccos(numpy.clip(cos_hour_angle, -1, 1)))
+
+def analytic_year_sun(lat, lon = 0, year = YEAR, utc_offset = None):
+    """ The sun's daily course for every day of year at lat, lon,
+    computed in one vectorized pass from NOAA solar position formulas
+    rather than ephem rise/set searches.
+    https://gml.noaa.gov/grad/solcalc/calcdetails.html
+    Returns a dict of numpy arrays with one value per day:
+    - sunrise, solar_noon, sunset: clock time in hours, at utc_offset
+      hours from UTC (by default, local mean time: lon/15 hours).
+      sunrise and sunset are NaN on days the sun doesn't rise or set.
+    - max_elevation: sun's elevation at solar noon in degrees, negative
+      if it stays below the horizon
+    - daylight: hours from sunrise to sunset; days when the sun doesn't
+      set get 24 hours, days when it doesn't rise get 0
+    lat can also be a column of latitudes (shape (n, 1)), giving one
+    row of days per latitude. """
+
+    if utc_offset is None:
+        utc_offset = lon / 15.0
+
+    days_in_year = 366 if calendar.isleap(year) else 365
+
+    # julian day of each local noon (which is lon/15 hours off UTC noon)
+    first_noon = datetime.date(year, 1, 1).toordinal() + 1721425.0
+    noon = first_noon + numpy.arange(days_in_year) - lon / 360.0
+
+    declination, equation_of_time = solar_position(noon)
+    solar_noon = 12 - lon / 15.0 - equation_of_time / 60.0 + utc_offset
+
+    # the sun moves up to 0.4° in declination over a day, so find
+    # sunrise and sunset roughly from the noon declination, then
+    # compute each again with the declination at that time
+    hour_angle = sunrise_hour_angle(lat, declination)
+
+    rise_hour_angle = sunrise_hour_angle(lat,
+        solar_declination(noon - hour_angle / 360.0))
+    set_hour_angle = sunrise_hour_angle(lat,
+        solar_declination(noon + hour_angle / 360.0))
+
+    # sun covers 15° of hour angle per hour
+    sunrise = solar_noon - rise_hour_angle / 15.0
+    sunset = solar_noon + set_hour_angle / 15.0
+
+    # hour angles of 0 and 180° are polar night and day
+    sunrise[(rise_hour_angle == 0) | (rise_hour_angle == 180)] = numpy.nan
+    sunset[(set_hour_angle == 0) | (set_hour_angle == 180)] = numpy.nan
+
+    return {
+        'sunrise': sunrise,
+        'solar_noon': solar_noon + numpy.zeros_like(sunrise),
+        'sunset': sunset,
+        'max_elevation': 90 - numpy.abs(lat - numpy.degrees(declination)),
+        'daylight': (rise_hour_angle + set_hour_angle) / 15.0
+    }
+
+def analytic_year_daylight(lat, lon = 0, year = YEAR):
+    """ Hours of daylight for every day of year at latitude lat, as a
+    numpy array; see analytic_year_sun. """
+
+    return analytic_year_sun(lat, lon, year)['daylight']
+
+def month_start_days(year = YEAR):
+    # day of year (counting from 0) each month starts on
+    return [datetime.date(year, month, 1).timetuple().tm_yday - 1
+        for month in range(1, 13)]
+
+def get_daylight_table():
+    """ Table of hours of daylight in each month (columns) at sea level
+    for latitudes from -90° to 90° every TABLE_STEP degrees (rows).
+    Built from analytic_year_daylight in one pass on first use,
+    which takes a fraction of a second. """
+
+    global daylight_table
+
+    if daylight_table is None:
+        latitudes = numpy.linspace(-90, 90, int(round(180 / TABLE_STEP)) + 1)
+
+        # longitude changes day lengths by seconds at most, so use 0
+        daily = analytic_year_daylight(latitudes[:, numpy.newaxis])
+        daylight_table = numpy.add.reduceat(daily, month_start_days(), axis = 1)
+
+    return daylight_table
+
+def table_month_daylight(lat, month):
+    """ Hours of daylight in month at latitude lat, interpolated
+    linearly from the daylight table. """
+
+    table = get_daylight_table()
+
+    position = (lat + 90) / TABLE_STEP
+    row = max(0, min(int(position), len(table) - 2))
+    fraction = position - row
+
+    return (table[row][month - 1] * (1 - fraction)
+        + table[row + 1][month - 1] * fraction)
+
 def day_duration(location, date = False):
-    # GLOBAL USED: s
-    
     location = process_location(location)
 
     if date == False:
@@ -60,20 +268,115 @@ def day_duration(location, date = False):
     else:
         location.date = date
 
-    daylight = abs(location.next_setting(s, date) - 
-        location.previous_rising(s, date))
+    sun = ephem.Sun()
+
+    try:
+        daylight = abs(location.next_setting(sun) -
+            location.previous_rising(sun))
+    except ephem.AlwaysUpError:
+        daylight = 1
+    except ephem.NeverUpError:
+        daylight = 0
 
     if daylight > 1:
         daylight -= 1
 
     return datetime.timedelta(daylight)
-    
-def month_daylight(location, month, exact = False):
+
+def year_daylight(location, year = YEAR):
+    """ Daylight for every day of year, from ephem rise and set times.
+    Walks the year once, starting each search from the previous sunset.
+    Returns a dict of numpy arrays, one value per day:
+    - daylight: hours from sunrise to sunset; 24 on days the sun doesn't
+      set, 0 on days it doesn't rise
+    - sunrise, sunset: in hours after local mean midnight (so 12 is
+      when the sun is due south, give or take the equation of time),
+      NaN on days with no sunrise or sunset """
+
+    location = process_location(location)
+    lat, lon = location_lat_lon(location)
+
+    key = (round(lat, DAYLIGHT_CACHE_DIGITS), round(lon, DAYLIGHT_CACHE_DIGITS),
+        location.elevation, year)
+    result = year_daylights.get(key)
+    if result is not None:
+        return result
+
+    # a sun of our own, so concurrent walks don't compute over each other
+    sun = ephem.Sun()
+
+    days_in_year = 366 if calendar.isleap(year) else 365
+    daylight = numpy.zeros(days_in_year)
+    sunrise = numpy.empty(days_in_year)
+    sunset = numpy.empty(days_in_year)
+    sunrise.fill(numpy.nan)
+    sunset.fill(numpy.nan)
+
+    # ephem dates are in days, in UTC
+    first_midnight = ephem.Date(datetime.datetime(year, 1, 1)) - lon / 360.0
+    previous_setting = first_midnight
+
+    for day in range(days_in_year):
+        midnight = first_midnight + day
+
+        try:
+            rising = location.next_rising(sun,
+                start = max(previous_setting, midnight))
+
+            if rising >= midnight + 1:
+                # no sunrise today, sun is already up or stays down
+                location.date = midnight + 0.5
+                sun.compute(location)
+                daylight[day] = 24 if sun.alt > 0 else 0
+                continue
+
+            setting = location.next_setting(sun, start = rising)
+        except ephem.AlwaysUpError:
+            daylight[day] = 24
+            continue
+        except ephem.NeverUpError:
+            continue
+
+        daylight[day] = (setting - rising) * 24
+        sunrise[day] = (rising - midnight) * 24
+        sunset[day] = (setting - midnight) * 24
+
+        previous_setting = setting
+
+    result = {'daylight': daylight, 'sunrise': sunrise, 'sunset': sunset}
+    year_daylights.set(key, result)
+
+    return result
+
+def monthly_daylight(location, method = 'ephem'):
+    """ Hours of daylight in each month, as a list of 12 floats.
+    Like calling month_daylight(location, month, exact = True, method)
+    for each month, but in one pass over the year. """
+
+    if method not in METHODS:
+        raise ValueError('unknown method: %s' % method)
+
+    location = process_location(location)
+
+    with spans.span('astro.daylight', method):
+        if method == 'table':
+            lat, lon = location_lat_lon(location)
+            return [float(table_month_daylight(lat, month))
+                for month in range(1, 13)]
+
+        if method == 'analytic':
+            daylight = analytic_year_daylight(*location_lat_lon(location))
+        else:
+            daylight = year_daylight(location)['daylight']
+
+        return [float(hours) for hours in
+            numpy.add.reduceat(daylight, month_start_days())]
+
+def month_daylight(location, month, exact = False, method = 'ephem'):
     # Specify exact = True to request an exact measurement, that is,
     # duration of each day calculated individually then summed.
-    # As calculating a day's data takes ephem a considerable amount of time, 
-    # doing something like calculating exact daylight over the entire year
-    # can take 1 or 2 seconds.
+    # This walks the whole year with year_daylight() (some 50 ms), after
+    # which exact results for the location's other months are free.
     # exact = False speeds this up by only checking between 3 and 8 days
     # during the month (depending on location's latitude - at locations closer
     # to equator, day lengths change less dramatically) and taking a mean of 
@@ -81,24 +384,56 @@ def month_daylight(location, month, exact = False):
     # are within 66 minutes / 0.6% throughout the year, and right at equator 
     # Singapore monthly numbers are always within 2 minutes / 0.0061%.
     # However, specify exact = True if you want to be sure.
+    #
+    # method = 'analytic' computes every day of the month from the NOAA
+    # solar position formulas instead (see analytic_year_daylight). This
+    # takes well under a millisecond regardless of exact, is within a
+    # couple of minutes a day of ephem, and works at any latitude.
+    #
+    # method = 'table' looks the month up in a precomputed table by
+    # latitude (see get_daylight_table), which is the fastest. Compared to
+    # exact = True, results are within 1% (2.5 hours a month) up to 65°
+    # latitude; interpolating between table rows accounts for at most
+    # 0.7 hours of that. Elevation is not taken into account, but neither
+    # is it by ephem: it only changes ephem's day lengths by milliseconds.
+
+    # Days when the sun doesn't set at all (roughly 66° latitude and up)
+    # count as 24 hours, days when it doesn't rise as 0.
 
-    # TODO: this function currently fails for locations where there is at least
-    # one day when the sun doesn't set at all. This is roughly 66° latitude
-    # and up. Need to handle this somehow - perhaps catch the exception 
-    # and return 24 hours?
+    if method not in METHODS:
+        raise ValueError('unknown method: %s' % method)
 
-    # use a constant non-leap year. constant because it doesn't matter outside
-    # of leap or non-leap, non-leap since I suspect any monthly numbers 
-    # are given for non-leap Februarys
-    year = 2013
+    year = YEAR
     
     location = process_location(location)
+
+    lat, lon = location_lat_lon(location)
+    # exact only makes a difference to the ephem method
+    key = (round(lat, DAYLIGHT_CACHE_DIGITS), round(lon, DAYLIGHT_CACHE_DIGITS),
+        location.elevation, month, exact and method == 'ephem', method)
+
+    total_duration = month_daylights.get(key)
+    if total_duration is not None:
+        return total_duration
     
     month_days = calendar.monthrange(year, month)[1]
 
     total_duration = datetime.timedelta(0)
 
-    if not exact:
+    if method == 'analytic':
+        daylight = analytic_year_daylight(lat, lon, year)
+
+        first_day = month_start_days(year)[month - 1]
+        hours = daylight[first_day:first_day + month_days].sum()
+
+        total_duration = datetime.timedelta(hours = float(hours))
+
+    elif method == 'table':
+        hours = table_month_daylight(lat, month)
+
+        total_duration = datetime.timedelta(hours = float(hours))
+
+    elif not exact:
         # TODO: maybe also use different day number multiplier 
         # for different months if I can find a consistent pattern
         # of which months are most frequently off
@@ -121,12 +456,96 @@ def month_daylight(location, month, exact = False):
 
         total_duration = (total_duration / len(days)) * month_days
     else:
-        for i in range(month_days):
-            day = datetime.date(year, month, i+1)
-            total_duration += day_duration(location, day)
-        
+        daylight = year_daylight(location, year)['daylight']
+
+        first_day = month_start_days(year)[month - 1]
+        hours = daylight[first_day:first_day + month_days].sum()
+
+        total_duration = datetime.timedelta(hours = float(hours))
+
+    month_daylights.set(key, total_duration)
+
     return total_duration
 
+def location_months_daylight(work):
+    # one process pool work unit: exact daylight for some months at a
+    # location. takes and returns plain values, since observers don't
+    # pickle
+    lat, lon, elevation, months = work
+
+    location = ephem.Observer()
+    location.lat = str(lat)
+    location.lon = str(lon)
+    location.elevation = elevation
+
+    return [month_daylight(location, month, exact = True) for month in months]
+
+def parallel_month_daylight(locations, months = range(1, 13),
+        processes = None):
+    """ Exact daylight (as month_daylight(location, month, exact = True))
+    for each of months at each of locations, computed in a pool of
+    processes, one per CPU by default. Returns a list with, for each
+    location in order, a list of timedeltas in the order of months,
+    or None if the location couldn't be found.
+    A location's months share one walk over the year, so work is split
+    up by location rather than by month. Results are kept in the
+    month_daylight() cache, and already cached ones aren't recomputed.
+    Locations are resolved here rather than in the pool processes, so
+    any Wikipedia lookups are made (and cached) only once. """
+
+    work = []
+    results = []
+
+    for location in locations:
+        location = process_location(location)
+        if location is False:
+            results.append(None)
+            continue
+
+        lat, lon = location_lat_lon(location)
+        keys = [(round(lat, DAYLIGHT_CACHE_DIGITS),
+            round(lon, DAYLIGHT_CACHE_DIGITS), location.elevation, month,
+            True, 'ephem') for month in months]
+
+        daylight = [month_daylights.get(key) for key in keys]
+        if None in daylight:
+            work.append((lat, lon, location.elevation, list(months)))
+
+        results.append((keys, daylight))
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if processes > 1 and len(work) > 1:
+        pool = multiprocessing.Pool(min(processes, len(work)))
+        try:
+            # one location at a time, so slow (polar) locations
+            # don't hold up a whole chunk
+            computed = pool.map(location_months_daylight, work, 1)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        computed = [location_months_daylight(unit) for unit in work]
+
+    computed = iter(computed)
+    for i,result in enumerate(results):
+        if result is None:
+            continue
+
+        keys, daylight = result
+        if None in daylight:
+            daylight = next(computed)
+            for key,duration in zip(keys, daylight):
+                month_daylights.set(key, duration)
+
+        results[i] = daylight
+
+    return results
+
 if __name__ == '__main__':
     cities = climate.get_cities()
     
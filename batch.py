@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+""" Look up climate data for a list of places in one process.
+
+usage: batch.py [-w workers] [-u] [file]
+
+Reads place names, one per line, from file or stdin and writes one JSON
+object per place to stdout (JSONL), in input order, or in order of
+completion with -u. Places that fail produce a record with an "error"
+key instead of stopping the batch, and places without a page a record
+with "page_error" true. The exit status is 1 if any place failed either
+way. Input is only read as fast as results
+are written, so a slow reader on stdout holds back the lookups too. """
+
+from __future__ import unicode_literals
+import codecs
+import json
+import sys
+
+import climate
+import workers
+
+DEFAULT_WORKERS = 8
+
+def read_places(f):
+    # readline rather than iterating, which reads ahead in big blocks
+    for line in iter(f.readline, b''):
+        place = line.decode('utf-8').strip()
+
+        # skip blank lines and comments
+        if len(place) > 0 and not place.startswith('#'):
+            yield place
+
+def error_record(place, error):
+    return json.dumps({'query': place, 'page_error': True,
+        'error': '%s: %s' % (error.__class__.__name__, error)},
+        sort_keys = True)
+
+def run(places, out, num_workers = DEFAULT_WORKERS, ordered = True):
+    """ Write a JSON line to out for each place. Returns the number of
+    places that had an error or no page (page_error). """
+
+    errors = 0
+
+    results = workers.imap(climate.get_climate_data, places,
+        workers = num_workers, ordered = ordered)
+
+    for place,job in results:
+        try:
+            record = job.result()
+            line = climate.data_as_json(record, place)
+            if record['page_error']:
+                errors += 1
+        except Exception as e:
+            line = error_record(place, e)
+            errors += 1
+
+        out.write(line + '\n')
+        out.flush()
+
+    return errors
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    num_workers = DEFAULT_WORKERS
+    if '-w' in args:
+        index = args.index('-w')
+        num_workers = int(args[index + 1])
+        del args[index:index + 2]
+
+    ordered = '-u' not in args
+    if not ordered:
+        args.remove('-u')
+
+    if len(args) > 0:
+        f = open(args[0], 'r')
+    else:
+        f = sys.stdin
+
+    out = codecs.getwriter('utf-8')(sys.stdout)
+
+    errors = run(read_places(f), out, num_workers, ordered)
+
+    if errors > 0:
+        sys.exit(1)
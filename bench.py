@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+""" Benchmarks of page parsing, formatting and daylight calculations,
+run offline over the API responses in bench_fixtures, so the numbers are
+repeatable and can be compared from one change to the next.
+
+usage: bench.py [options] [benchmark name prefixes]
+    --save          save the results as the baseline
+    --compare       compare the results with the baseline, exiting with
+                    status 1 if anything got more than TOLERANCE slower
+    --baseline FILE baseline file, instead of BASELINE
+    -n REPEAT       times to run each benchmark, the fastest counts
+    --record        download the fixtures' pages again from Wikipedia
+                    (needs network access), then exit
+
+Each fixture is a JSON file with the place to look up, the API
+responses of the pages that takes, by page name, and when they were
+recorded from Wikipedia. The fixtures in the repository were written by
+hand to have each of these shapes, and are marked as not recorded
+(recorded is null); run --record once, with network access, and commit
+the results to time real pages instead:
+    large       a long article with the weatherbox near the end
+    comments    a weatherbox with a comment on every line
+    cached      a weatherbox in a separate template, included through
+                its /cached subpage
+    percentsun  sunshine as a percentage of daylight, so daylight hours
+                are worked out with astrodata
+    units       a weatherbox in °F and inches, converted for display
+
+Page JSON is also timed for each fixture as a whole page and as fetched
+with climate.FETCH_SECTIONS, from a fake_api.py server, along with the
+bytes each way takes.
+
+Results are printed and also written to OUTPUT. Times are per call, in
+ms; the fastest of REPEAT runs is the number to go by, as the others are
+slowed down by whatever else the machine was doing. Baselines are only
+comparable on the same machine, and with the same fixtures: baselines
+keep when each fixture was recorded. """
+
+from __future__ import unicode_literals
+import codecs
+import glob
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import urllib
+
+import cache
+import climate
+import throttle
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'bench_fixtures')
+BASELINE = 'bench_baseline.json'
+OUTPUT = 'bench_output.txt'
+
+REPEAT = 5
+# each run calls the benchmark enough times to take at least this long
+MIN_RUN_TIME = 0.1
+
+# this much slower than the baseline counts as a regression
+TOLERANCE = 1.25
+
+# units to convert the fixtures' data to when formatting
+DISPLAY_UNITS = ['F', 'inch']
+
+def load_fixtures(directory = FIXTURE_DIR):
+    fixtures = {}
+
+    for file_name in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        f = codecs.open(file_name, 'r', 'utf-8')
+        fixtures[os.path.basename(file_name)[:-5]] = json.load(f)
+        f.close()
+
+    return fixtures
+
+def save_fixture(directory, name, fixture):
+    f = codecs.open(os.path.join(directory, name + '.json'), 'w', 'utf-8')
+    f.write(json.dumps(fixture, ensure_ascii = False, indent = 1,
+        sort_keys = True) + '\n')
+    f.close()
+
+def install(fixtures):
+    # write every fixture page into a new cache directory, and only
+    # read from there. returns the directory, for removing afterwards.
+    cache.CACHE_DIR = tempfile.mkdtemp()
+    cache.OFFLINE = True
+    cache.memory.clear()
+
+    for fixture in fixtures.values():
+        for page_name,response in fixture['pages'].items():
+            f = open(cache.get_file_name(page_name), 'w')
+            f.write(json.dumps(response).encode('utf-8'))
+            f.close()
+
+    return cache.CACHE_DIR
+
+def page_text(fixture, page_name):
+    response = fixture['pages'][page_name]
+    return response['query']['pages'].values()[0]['revisions'][0]['*']
+
+def fetch_responses(fixtures):
+    """ For each fixture, by name: the API response for its place's
+    whole page, the response climate.fetch_sections() makes of its lead
+    and climate sections, and the bytes fetch_sections() downloaded. """
+
+    # imported here, as fake_api imports this module
+    import fake_api
+
+    app = fake_api.FakeAPI()
+    app.add_fixtures(fixtures)
+    httpd, url = fake_api.start(app)
+
+    api = climate.API
+    offline = cache.OFFLINE
+    climate.use_api(url)
+    cache.OFFLINE = False
+
+    responses = {}
+    try:
+        for name,fixture in sorted(fixtures.items()):
+            place = fixture['place']
+            page_url = climate.API_URL \
+                % urllib.quote_plus(place.encode('utf-8'))
+
+            full = throttle.fetch(page_url)
+
+            app.bytes = 0
+            sections = climate.fetch_sections(place, page_url)
+
+            responses[name] = (full, sections, app.bytes)
+    finally:
+        climate.use_api(api)
+        cache.OFFLINE = offline
+        httpd.shutdown()
+        httpd.server_close()
+
+    return responses
+
+def format_sizes(responses):
+    # lines comparing the bytes of whole pages and of sections
+    lines = ['%-50s %10s %10s %10s' % ('page bytes', 'whole page',
+        'sections', 'stored')]
+
+    for name,(full,sections,downloaded) in sorted(responses.items()):
+        if 'sections' not in json.loads(sections):
+            note = ' (whole page: no weatherbox in a climate section)'
+        else:
+            note = ' (%.0f%% less)' % (100 - 100.0 * downloaded / len(full))
+        lines.append('%-50s %10d %10d %10d%s' % (name, len(full), downloaded,
+            len(sections), note))
+
+    return lines
+
+def benchmarks(fixtures, responses = None):
+    """ (name, function) pairs, named like "parse_infobox/large".
+    responses: fetch_responses(fixtures), to time page JSON too. """
+
+    # imported here like climate does, as only percentsun needs it
+    import astrodata
+
+    result = []
+
+    for name,fixture in sorted(fixtures.items()):
+        place = fixture['place']
+
+        data = climate.get_climate_data(place)
+        if data['page_error'] or not climate.has_printable_data(data):
+            raise ValueError('no climate data in fixture %s: %s'
+                % (name, data['title']))
+
+        # the page the weatherbox is on
+        pages = [page_name for page_name in fixture['pages']
+            if 'Weather box' in page_text(fixture, page_name)]
+        text = page_text(fixture, pages[0])
+        weatherbox = climate.find_template(text, 'Weather box')
+
+        def get_climate_data(place = place):
+            # as a first lookup: read from the file, not memory
+            cache.memory.clear()
+            return climate.get_climate_data(place)
+
+        converted = climate.convert_data(data, DISPLAY_UNITS)
+
+        # each call below formats the same records, which is only the
+        # same work every time if formatting leaves them as they were
+        for record in [data, converted]:
+            if climate.format_data_as_text(record) \
+                    != climate.format_data_as_text(record):
+                raise ValueError('formatting changed fixture %s' % name)
+
+        result += [
+            ('find_template/' + name,
+                lambda text = text: climate.find_template(text, 'Weather box')),
+            ('remove_comments/' + name,
+                lambda weatherbox = weatherbox:
+                    climate.remove_comments(weatherbox)),
+            ('parse_infobox/' + name,
+                lambda weatherbox = weatherbox:
+                    climate.parse_infobox(weatherbox)),
+            ('get_climate_data/' + name, get_climate_data),
+            ('format_data_as_text/' + name,
+                lambda data = data: climate.format_data_as_text(data)),
+            ('format_data_as_text/' + name + '/converted',
+                lambda converted = converted:
+                    climate.format_data_as_text(converted))]
+
+        if responses is not None:
+            full, sections, downloaded = responses[name]
+            result += [('page.json/' + name,
+                    lambda full = full: json.loads(full)),
+                ('page.json/' + name + '/sections',
+                    lambda sections = sections: json.loads(sections))]
+
+        if data.get('observer'):
+            location = data['observer']
+
+            for method,exact in [('ephem', True), ('ephem', False),
+                    ('analytic', False), ('table', False)]:
+                def month_daylight(method = method, exact = exact):
+                    # otherwise only the first call would work anything out
+                    astrodata.month_daylights.clear()
+                    astrodata.year_daylights.clear()
+                    return astrodata.month_daylight(location, 6,
+                        exact = exact, method = method)
+
+                result.append(('month_daylight/%s/%s%s' % (name, method,
+                    '/exact' if exact else ''), month_daylight))
+
+    return result
+
+def measure(func, repeat = REPEAT):
+    """ Fastest and median time per call in ms, over repeat runs. """
+
+    # calls per run: enough for a run to take MIN_RUN_TIME
+    loops = 1
+    while True:
+        seconds = timeit.timeit(func, number = loops)
+        if seconds >= MIN_RUN_TIME:
+            break
+        loops *= 10 if seconds < MIN_RUN_TIME / 10 else 2
+
+    times = sorted(timeit.repeat(func, number = loops, repeat = repeat))
+    times = [seconds / loops * 1000.0 for seconds in times]
+
+    return times[0], times[len(times) // 2]
+
+def compare(results, baseline):
+    """ Lines comparing results with baseline results, and the names of
+    the benchmarks that got more than TOLERANCE slower. """
+
+    lines = []
+    slower = []
+
+    for name,best,median in results:
+        if name not in baseline:
+            lines.append('%-50s %10.4f      (new)' % (name, best))
+            continue
+
+        ratio = best / baseline[name]
+        if ratio > TOLERANCE:
+            note = 'SLOWER'
+            slower.append(name)
+        elif ratio < 1 / TOLERANCE:
+            note = 'faster'
+        else:
+            note = ''
+
+        lines.append(('%-50s %10.4f %10.4f %6.2fx %s' % (name, best,
+            baseline[name], ratio, note)).rstrip())
+
+    return lines, slower
+
+def load_baseline(path):
+    f = open(path, 'r')
+    baseline = json.load(f)
+    f.close()
+
+    return baseline
+
+def fixture_dates(fixtures):
+    # when each fixture was recorded, None for the hand-written ones
+    return dict((name, fixture.get('recorded'))
+        for name,fixture in fixtures.items())
+
+def save_baseline(path, results, fixtures):
+    baseline = {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'fixtures': fixture_dates(fixtures),
+        'results': dict((name, best) for name,best,median in results)}
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd,temp_file_name = tempfile.mkstemp(dir = directory)
+    f = os.fdopen(fd, 'w')
+    f.write(json.dumps(baseline, indent = 1, sort_keys = True) + b'\n')
+    f.close()
+
+    os.chmod(temp_file_name, 0o644)
+    os.rename(temp_file_name, path)
+
+def record(fixtures, directory = FIXTURE_DIR):
+    # replace each fixture's pages with what Wikipedia has now
+    for name,fixture in sorted(fixtures.items()):
+        for page_name in fixture['pages']:
+            url = climate.API_URL \
+                % urllib.quote_plus(page_name.encode('utf-8'))
+            fixture['pages'][page_name] = json.loads(throttle.fetch(url))
+
+        fixture['recorded'] = time.strftime('%Y-%m-%d')
+        save_fixture(directory, name, fixture)
+        print 'recorded %s: %s' % (name, ', '.join(fixture['pages']))
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    def option(flag, default = None):
+        # value of flag, removing both from args
+        if flag not in args:
+            return default
+
+        index = args.index(flag)
+        value = args[index + 1]
+        del args[index:index + 2]
+        return value
+
+    def switch(flag):
+        if flag not in args:
+            return False
+
+        args.remove(flag)
+        return True
+
+    baseline_path = option('--baseline', BASELINE)
+    repeat = int(option('-n', REPEAT))
+    save = switch('--save')
+    check = switch('--compare')
+
+    fixtures = load_fixtures()
+
+    if switch('--record'):
+        record(fixtures)
+        sys.exit(0)
+
+    cache_dir = install(fixtures)
+    try:
+        responses = fetch_responses(fixtures)
+        results = []
+        output = codecs.open(OUTPUT, 'w', 'utf-8')
+
+        synthetic = sorted(name for name,recorded
+            in fixture_dates(fixtures).items() if recorded is None)
+        notes = []
+        if synthetic:
+            notes.append('hand-written fixtures, not recorded from '
+                'Wikipedia: %s' % ', '.join(synthetic))
+
+        for line in notes + format_sizes(responses) + ['']:
+            print line
+            output.write(line + '\n')
+
+        header = '%-50s %10s %10s' % ('benchmark, ms per call', 'fastest',
+            'median')
+        print header
+        output.write(header + '\n')
+
+        for name,func in benchmarks(fixtures, responses):
+            if args and not any(name.startswith(prefix) for prefix in args):
+                continue
+
+            best,median = measure(func, repeat)
+            results.append((name, best, median))
+
+            line = '%-50s %10.4f %10.4f' % (name, best, median)
+            print line
+            output.write(line + '\n')
+            # see results as they come, even through a pipe
+            sys.stdout.flush()
+
+        slower = []
+        if check:
+            baseline = load_baseline(baseline_path)
+            lines, slower = compare(results, baseline['results'])
+
+            header = '\ncompared with %s (%s, python %s):\n%-50s %10s %10s' \
+                % (baseline_path, baseline['date'], baseline['python'],
+                'benchmark, ms per call', 'now', 'baseline')
+            print header
+            output.write(header + '\n')
+            if baseline.get('fixtures') != fixture_dates(fixtures):
+                lines.insert(0, 'the baseline was made with other fixtures, '
+                    'so it may not be comparable')
+            for line in lines:
+                print line
+                output.write(line + '\n')
+
+        output.close()
+
+        if save:
+            save_baseline(baseline_path, results, fixtures)
+            print '\nsaved baseline to %s' % baseline_path
+    finally:
+        shutil.rmtree(cache_dir)
+
+    if slower:
+        print '\n%d benchmarks more than %.0f%% slower than the baseline' % (
+            len(slower), (TOLERANCE - 1) * 100)
+        sys.exit(1)
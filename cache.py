@@ -4,18 +4,90 @@
 from __future__ import unicode_literals
 import os
 import glob
-import urllib2
+import tempfile
+import threading
 import simplejson as json
+from collections import OrderedDict
 from datetime import datetime
 from datetime import timedelta
 import time
 
-timer = []
+import metrics
+import spans
+import throttle
 
 CACHE_PERIOD_DAYS = 7
 CACHE_DIR  = 'cache_data'
 CACHE_FILE = 'climate.py_cache_%s'
 
+# number of pages kept in memory on top of the files in CACHE_DIR.
+# mostly matters for long-running processes (supybot, server.py),
+# which then don't re-read files for popular pages.
+MEMORY_CACHE_SIZE = 200
+
+# when True, only already cached pages are available: nothing is
+# downloaded, and cached files are used regardless of age. used to run
+# against recorded pages without a network connection.
+OFFLINE = False
+
+class NotCached(IOError):
+    """ Raised in OFFLINE mode for pages that are not in the cache. """
+    pass
+
+class LRUCache(object):
+    """ Thread-safe mapping that holds at most size entries, dropping the
+    least recently used ones when full. Entries can also be given a time
+    to live in seconds, after which they are treated as missing. """
+
+    def __init__(self, size = 1000, ttl = None):
+        self.size = size
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default = None):
+        with self.lock:
+            if key not in self.data:
+                return default
+
+            value,expires = self.data.pop(key)
+            if expires is not None and expires < time.time():
+                return default
+
+            # re-insert to mark as most recently used
+            self.data[key] = (value, expires)
+            return value
+
+    def set(self, key, value, ttl = None):
+        if ttl is None:
+            ttl = self.ttl
+
+        expires = None
+        if ttl is not None:
+            expires = time.time() + ttl
+
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = (value, expires)
+
+            while len(self.data) > self.size:
+                self.data.popitem(last = False)
+
+    def pop(self, key, default = None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            return self.data.pop(key)[0]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+memory = LRUCache(MEMORY_CACHE_SIZE)
+
 def get_file_name(page_name):
     return os.path.join(CACHE_DIR, CACHE_FILE % page_name)
 
@@ -31,6 +103,14 @@ def get_age(page_name):
 
     return age
 
+def get_mtime(page_name):
+    # when the page's file was last written, or None if there isn't one.
+    # changes whenever the page is downloaded again.
+    try:
+        return os.path.getmtime(get_file_name(page_name))
+    except OSError:
+        return None
+
 def exists(page_name):
     result = False
 
@@ -40,41 +120,79 @@ def exists(page_name):
 
     return result
 
+def is_cached(page_name):
+    # whether get_URL would answer without a download
+    return memory.get(page_name) is not None or exists(page_name)
+
 def get_URL(url, page_name, force_download = False):
-    htime1 = time.time()
+    return get_page(page_name, lambda: throttle.fetch(url), force_download)
+
+def get_page(page_name, fetch, force_download = False):
+    """ page_name's text, from memory or its file if cached, or else
+    from fetch(), and then cached. """
 
     text = None
 
     cached_data_file_name = get_file_name(page_name)
 
-    if exists(page_name) and not force_download:
-        f = open(cached_data_file_name, 'r')
-        text = f.read()
-        f.close()
+    if not force_download:
+        text = memory.get(page_name)
+
+        if text is not None:
+            metrics.count('cache.memory_hit', detail = page_name)
+            return text
 
-        timer.append(['%s: file load time, ms' % page_name,
-            (time.time()-htime1)*1000.0])
+    if (exists(page_name) or OFFLINE) and not force_download \
+        and os.path.exists(cached_data_file_name):
+        with spans.span('cache.file_load', page_name):
+            f = open(cached_data_file_name, 'r')
+            text = f.read()
+            f.close()
 
-        timer.append(['%s: using cached data, age in days' % page_name,
-            get_age(page_name).days])
+        age = get_age(page_name)
+
+        metrics.count('cache.file_hit', detail = page_name)
+
+        # keep in memory only for as long as the file would be used
+        remaining = timedelta(days = CACHE_PERIOD_DAYS) - age
+        if OFFLINE:
+            memory.set(page_name, text)
+        elif remaining.total_seconds() > 0:
+            memory.set(page_name, text, remaining.total_seconds())
 
     if text is None:
-        text = urllib2.urlopen(url).read()
+        metrics.count('cache.miss', detail = page_name)
+
+        if OFFLINE:
+            raise NotCached(page_name)
+
+        # e.g. throttle.fetch, rate limited and retried; raises if the
+        # page can't be had
+        with spans.span('fetch', page_name):
+            text = fetch()
 
         if os.path.exists(CACHE_DIR) == False:
             os.makedirs(CACHE_DIR)
 
-        # save text for future use
-        f = open(cached_data_file_name, 'w')
-        print >> f, text
-        f.close()
+        # save text for future use. write to a temporary file first so
+        # that other threads or processes never read a partial file.
+        with spans.span('cache.file_save', page_name):
+            fd,temp_file_name = tempfile.mkstemp(dir = CACHE_DIR)
+            f = os.fdopen(fd, 'w')
+            print >> f, text
+            f.close()
+            # mkstemp makes files only we can read
+            os.chmod(temp_file_name, 0o644)
+            os.rename(temp_file_name, cached_data_file_name)
 
-        timer.append(['%s: http get and file save, ms' % page_name,
-            (time.time()-htime1)*1000.0])
+        memory.set(page_name, text, timedelta(days = CACHE_PERIOD_DAYS)
+            .total_seconds())
 
     return text
 
 def clear(page_name):
+    memory.pop(page_name)
+
     to_be_removed = get_file_name(page_name)
 
     if os.path.exists(to_be_removed):
@@ -83,6 +201,8 @@ def clear(page_name):
     return [ to_be_removed ]
 
 def clear_all():
+    memory.clear()
+
     cached_data_files = glob.glob(get_file_name('*'))
 
     for fl in cached_data_files:
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+""" Keep cached pages up to date by following Wikipedia's recent changes,
+rather than only downloading them again once they're CACHE_PERIOD_DAYS old.
+
+usage: changefeed.py [--file changes] [--interval seconds] [--refresh]
+    [--cache-days days]
+
+Every interval seconds, a Poller reads the changes made since it last
+looked, and clears the cached pages among them (or with --refresh,
+downloads them again straight away). A change to a weatherbox template,
+like "Template:New York City weatherbox", also clears the cached pages
+that include it, as their data comes from it. Pages that aren't cached
+are ignored, so following the whole of Wikipedia's changes costs one
+request per RECENT_CHANGES_LIMIT changes.
+
+Changes come from:
+    APIFeed     the API's list=recentchanges (climate.API, so a
+                fake_api.py can stand in for Wikipedia)
+    FileFeed    a file of JSON lines, one per change, like
+                {"title": "Toronto", "timestamp": "2015-06-01T12:00:00Z"}
+                e.g. for tests, or replaying changes
+
+How far through the feed it got is saved in STATE_FILE, so changes made
+while it wasn't running are caught up with when it starts again. If
+that's more than CATCH_UP_HOURS ago (or it has never run), there would be
+too many changes to read, so it asks for the latest revision of every
+cached page instead, a batch at a time, and clears those that have
+changed since they were downloaded.
+
+With a poller running, pages can be cached for far longer, e.g.
+cache.CACHE_PERIOD_DAYS = 90, as they're cleared when they change. Run
+from the command line, it polls until interrupted, printing what it
+clears; --cache-days only affects which pages count as cached. """
+
+from __future__ import unicode_literals
+import calendar
+import codecs
+import glob
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib
+
+import cache
+import climate
+import metrics
+import throttle
+
+DEFAULT_INTERVAL = 60
+
+# where the poller got to in the feed, in cache.CACHE_DIR
+STATE_FILE = 'changefeed_state.json'
+
+# only pages and templates: other namespaces never hold climate data
+RECENT_CHANGES_QUERY = '?action=query&list=recentchanges&rcprop=title|timestamp|ids&rctype=edit|new|log&rcnamespace=0|10&rcdir=newer&rclimit=%d&format=json&maxlag=%d'
+RECENT_CHANGES_LIMIT = 500
+
+# requests per poll, at most: the rest of the changes wait for the next
+MAX_REQUESTS = 20
+
+LATEST_QUERY = '?action=query&prop=revisions&rvprop=timestamp&titles=%%s&format=json&maxlag=%d' % throttle.MAXLAG
+
+CATCH_UP_HOURS = 6
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+def parse_timestamp(timestamp):
+    # seconds since the epoch of an API timestamp, which is in UTC
+    return calendar.timegm(time.strptime(timestamp, TIMESTAMP_FORMAT))
+
+def format_timestamp(seconds):
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(seconds))
+
+class APIFeed(object):
+    """ Changes from the API's list=recentchanges. """
+
+    def __init__(self, api = None):
+        # None: whatever climate.API is at the time
+        self.api = api
+
+    def changes(self, since):
+        """ (timestamp, id, title) of the changes after since, a
+        (timestamp, id) pair, or of every recent change if None, oldest
+        first. """
+
+        url = (self.api or climate.API) + RECENT_CHANGES_QUERY % (
+            RECENT_CHANGES_LIMIT, throttle.MAXLAG)
+        if since is not None:
+            # rcstart includes changes at that time, seen or not
+            url += '&rcstart=' + urllib.quote(since[0])
+
+        result = []
+        params = ''
+        for i in range(MAX_REQUESTS):
+            response = json.loads(throttle.fetch(url + params))
+            if 'error' in response:
+                raise IOError('recent changes: %s' % response['error']['info'])
+
+            for change in response['query']['recentchanges']:
+                change = (change['timestamp'], change['rcid'], change['title'])
+                if since is None or change[:2] > tuple(since):
+                    result.append(change)
+
+            if 'continue' not in response:
+                break
+            params = '&rccontinue=' + urllib.quote(
+                response['continue']['rccontinue'].encode('utf-8'))
+
+        return result
+
+    def latest(self, titles):
+        """ Seconds since the epoch of the latest revision of each of
+        titles, by title; None for those that don't exist any more. """
+
+        url = (self.api or climate.API) + LATEST_QUERY
+        result = {}
+
+        titles = sorted(titles)
+        for i in range(0, len(titles), climate.TITLES_PER_QUERY):
+            batch = titles[i:i + climate.TITLES_PER_QUERY]
+            response = json.loads(throttle.fetch(url % urllib.quote_plus(
+                '|'.join(batch).encode('utf-8'))))
+
+            for page in response['query']['pages'].itervalues():
+                if 'revisions' in page:
+                    result[page['title']] = parse_timestamp(
+                        page['revisions'][0]['timestamp'])
+                else:
+                    result[page['title']] = None
+
+        return result
+
+class FileFeed(object):
+    """ Changes from a file of JSON lines with a title and timestamp
+    each, in the order they're in. Lines are numbered from 1, which
+    serves as the change's id. """
+
+    def __init__(self, path):
+        self.path = path
+
+    def changes(self, since):
+        result = []
+
+        f = codecs.open(self.path, 'r', 'utf-8')
+        for number,line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            change = json.loads(line)
+            if since is None or number > since[1]:
+                result.append((change['timestamp'], number, change['title']))
+        f.close()
+
+        return result
+
+    def latest(self, titles):
+        # a file holds all the changes there are, so there's nothing to
+        # catch up with
+        return None
+
+class CacheIndex(object):
+    """ Which cached pages hold which titles, and which cached pages
+    include which weatherbox templates. Only files written since the
+    last update() are read again. """
+
+    def __init__(self):
+        # page names by title, and article page names by template title
+        self.pages = {}
+        self.includes = {}
+        # (mtime, titles, template) by page name
+        self.files = {}
+
+    def read(self, file_name):
+        # the titles in a cached API response, and the weatherbox
+        # template it includes, if any
+        f = open(file_name, 'r')
+        try:
+            response = json.loads(f.read().decode('utf-8'))
+        except ValueError:
+            return [], None
+        finally:
+            f.close()
+
+        if 'parse' in response:
+            # a list of sections, see climate.get_sections
+            return [response['parse']['title']], None
+
+        titles = []
+        template = None
+        for page in response.get('query', {}).get('pages', {}).itervalues():
+            titles.append(page['title'])
+            if 'revisions' in page:
+                template = climate.weatherbox_template_name(
+                    page['revisions'][0]['*'])
+
+        return titles, template
+
+    def update(self):
+        prefix = cache.get_file_name('')
+        files = {}
+
+        for file_name in glob.glob(cache.get_file_name('*')):
+            page_name = file_name[len(prefix):]
+            try:
+                mtime = os.path.getmtime(file_name)
+            except OSError:
+                # removed since the glob
+                continue
+
+            known = self.files.get(page_name)
+            if known is not None and known[0] == mtime:
+                files[page_name] = known
+            else:
+                files[page_name] = (mtime,) + self.read(file_name)
+
+        pages = {}
+        includes = {}
+        for page_name,(mtime,titles,template) in files.items():
+            # the names pages were asked for are titles too, as the
+            # titles found may be redirect targets
+            for title in set(titles) | set([page_name.split('#')[0]]):
+                pages.setdefault(title, set()).add(page_name)
+            if template is not None:
+                includes.setdefault(template, set()).add(page_name)
+
+        self.files = files
+        self.pages = pages
+        self.includes = includes
+
+    def affected(self, title):
+        """ The cached pages to clear when title changes. """
+
+        return self.pages.get(title, set()) | self.includes.get(title, set())
+
+def load_state(path):
+    # (timestamp, id) of the last change seen, and when that was saved,
+    # or None if there's no state
+    try:
+        f = open(path, 'r')
+    except IOError:
+        return None
+
+    try:
+        state = json.load(f)
+        return (state['timestamp'], state['id']), state['saved']
+    except (ValueError, KeyError):
+        return None
+    finally:
+        f.close()
+
+def save_state(path, since):
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    fd,temp_file_name = tempfile.mkstemp(dir = directory)
+    f = os.fdopen(fd, 'w')
+    f.write(json.dumps({'timestamp': since[0], 'id': since[1],
+        'saved': time.time()}) + b'\n')
+    f.close()
+
+    os.chmod(temp_file_name, 0o644)
+    os.rename(temp_file_name, path)
+
+class Poller(object):
+    """ Clears (or with refresh, downloads again) cached pages that have
+    changed according to feed, every interval seconds in a background
+    thread once start()ed, or when poll() is called. """
+
+    def __init__(self, feed, interval = DEFAULT_INTERVAL, refresh = False,
+            state_file = None):
+        self.feed = feed
+        self.interval = interval
+        self.refresh = refresh
+        # None: STATE_FILE in cache.CACHE_DIR at the time
+        self.state_file = state_file
+
+        self.index = CacheIndex()
+        self.since = None
+        self.started = False
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def get_state_file(self):
+        return self.state_file or os.path.join(cache.CACHE_DIR, STATE_FILE)
+
+    def clear(self, page_names):
+        for page_name in page_names:
+            cache.clear(page_name)
+            metrics.count('changefeed.cleared', detail = page_name)
+
+        if self.refresh:
+            # articles, whose templates and sections come with them
+            for page_name in sorted(page_names):
+                if '#' not in page_name \
+                        and not page_name.startswith('Template:'):
+                    climate.get_climate_data(page_name)
+
+    def catch_up(self):
+        # clear the cached pages that changed after they were downloaded.
+        # returns whether the feed could tell.
+        self.index.update()
+        latest = self.feed.latest([title for title in self.index.pages
+            if '#' not in title])
+        if latest is None:
+            return False
+
+        changed = set()
+        for title,timestamp in latest.items():
+            for page_name in self.index.affected(title):
+                mtime = self.index.files[page_name][0]
+                # timestamps are to the second, so an edit in the second
+                # the page was downloaded might have been after it
+                if timestamp is None or timestamp >= int(mtime):
+                    changed.add(page_name)
+
+        self.clear(changed)
+        return True
+
+    def poll(self):
+        """ Clear the cached pages that have changed since the last poll.
+        Returns their page names. """
+
+        if not self.started:
+            state = load_state(self.get_state_file())
+            if state is not None:
+                self.since = state[0]
+
+            if state is None or state[1] < time.time() - CATCH_UP_HOURS * 3600:
+                now = format_timestamp(time.time())
+                if self.catch_up():
+                    self.since = (now, 0)
+
+            # not until caught up, which is tried again if it fails
+            self.started = True
+
+        changes = self.feed.changes(self.since)
+        if not changes:
+            if self.since is not None:
+                save_state(self.get_state_file(), self.since)
+            return set()
+
+        metrics.count('changefeed.changes', len(changes))
+
+        self.index.update()
+        changed = set()
+        for timestamp,change_id,title in changes:
+            changed |= self.index.affected(title)
+
+            # a new page for a name that was found to have none
+            resolution = climate.resolutions.get(title.lower())
+            if resolution is not None and resolution[0] is None:
+                climate.resolutions.pop(title.lower())
+
+        self.clear(changed)
+
+        # changes come oldest first
+        self.since = changes[-1][:2]
+        save_state(self.get_state_file(), self.since)
+
+        return changed
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                self.poll()
+            except Exception:
+                # e.g. Wikipedia can't be reached: try again next time
+                metrics.count('changefeed.error')
+            self.stopping.wait(self.interval)
+
+    def start(self):
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+def from_setting(setting, interval = DEFAULT_INTERVAL, refresh = False):
+    """ A Poller for setting: "api" to follow the API's recent changes,
+    or the path of a changes file. """
+
+    if setting == 'api':
+        feed = APIFeed()
+    else:
+        feed = FileFeed(setting)
+
+    return Poller(feed, interval, refresh)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    def option(flag, default = None):
+        if flag not in args:
+            return default
+
+        index = args.index(flag)
+        value = args[index + 1]
+        del args[index:index + 2]
+        return value
+
+    setting = option('--file', 'api')
+    interval = float(option('--interval', DEFAULT_INTERVAL))
+    cache.CACHE_PERIOD_DAYS = float(option('--cache-days',
+        cache.CACHE_PERIOD_DAYS))
+    refresh = '--refresh' in args
+
+    poller = from_setting(setting, interval, refresh)
+
+    try:
+        while True:
+            started = time.time()
+            for page_name in sorted(poller.poll()):
+                print '%s %s' % ('refreshed' if refresh else 'cleared',
+                    page_name.encode('utf-8'))
+            sys.stdout.flush()
+            time.sleep(max(0, interval - (time.time() - started)))
+    except KeyboardInterrupt:
+        pass
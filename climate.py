@@ -4,14 +4,18 @@
 from __future__ import unicode_literals
 import calendar
 import json
+import os
 import sys
+import threading
 from collections import OrderedDict
 import urllib
 
-import astrodata
 import cache
-
-timer = []
+import metrics
+import spans
+import throttle
+import units
+import workers
 
 # hardcode rather than using calendar.month_abbr to avoid 
 # potential locale problems - wikipedia always uses the English abbrs
@@ -35,28 +39,123 @@ ROWS_TO_PRINT = ['record high C', 'high C', 'low C', 'record low C', 'sun']
 
 MSG_LOCATION_NOT_FOUND  = ': location not found'
 MSG_NO_INFO_FOUND       = ': no information found'
-
-UNIT_CONVERSIONS = {
-    'F': {
-        'C': (lambda f: round((f - 32)*(5.0/9.0), 1))
-    },
-    'inch': {
-        'mm': (lambda x: round(x*25.4, 1)),
-        'cm': (lambda x: round(x*2.54, 1))
-    },
-    'mm': { 'cm': (lambda x: x*10) },
-    'cm': { 'mm': (lambda x: x/10.0) }
-    }
+MSG_FETCH_ERROR         = ': could not get page from Wikipedia (%s)'
 
 ABSOLUTE_ROWS = ['sun', 'snow days', 'snow cm', 'rain days', 'rain mm',
     'precipitation days', 'precipitation mm']
 
-API_URL = 'http://en.wikipedia.org/w/api.php?action=query&prop=revisions&titles=%s&redirects=true&rvprop=content&format=json'
+# the MediaWiki API pages come from. set CLIMATE_API_URL in the
+# environment, or call use_api(), to use another (e.g. fake_api.py)
+API = os.environ.get('CLIMATE_API_URL', 'http://en.wikipedia.org/w/api.php')
+
+PAGE_QUERY = '?action=query&prop=revisions&titles=%%s&redirects=true&rvprop=content&format=json&maxlag=%d' % throttle.MAXLAG
+API_URL = API + PAGE_QUERY
+
+# checks which of up to TITLES_PER_QUERY pages exist, without content
+TITLES_QUERY = '?action=query&titles=%%s&redirects=true&format=json&maxlag=%d' % throttle.MAXLAG
+TITLES_API_URL = API + TITLES_QUERY
+TITLES_PER_QUERY = 50
+
+# lists a page's sections, for FETCH_SECTIONS
+SECTIONS_QUERY = '?action=parse&page=%%s&prop=sections&redirects=true&format=json&maxlag=%d' % throttle.MAXLAG
+SECTIONS_API_URL = API + SECTIONS_QUERY
+
+def use_api(url):
+    """ Get pages from the MediaWiki API at url (ending in api.php). """
+
+    global API, API_URL, TITLES_API_URL, SECTIONS_API_URL
+
+    API = url
+    API_URL = url + PAGE_QUERY
+    TITLES_API_URL = url + TITLES_QUERY
+    SECTIONS_API_URL = url + SECTIONS_QUERY
+
+# download only the lead section (with the infobox) and the climate
+# section of articles, rather than whole articles, which can be hundreds
+# of KB. this takes three requests rather than one: the list of sections
+# (which is cached too, see get_sections), then each section. articles
+# without a climate section, or with no weatherbox in it, are downloaded
+# whole after all.
+FETCH_SECTIONS = False
+
+# how astrodata works out daylight hours for percentsun conversion:
+# 'table' is a lookup, accurate enough given that percentsun itself is
+# usually given to the nearest percent. 'ephem' walks the year with
+# ephem's rise and set searches (about 50 ms a place).
+DAYLIGHT_METHOD = 'table'
+
+# memory-mapped dataset of already parsed records (see dataset.py).
+# when loaded, get_climate_data() answers from it before going to Wikipedia.
+DATASET = None
+
+def use_dataset(path):
+    global DATASET
+
+    # imported here so numpy is only needed when a dataset is used
+    import dataset
+    DATASET = dataset.load_dataset(path)
+
+    return DATASET
+
+# shared pool for the *_async functions, started on first use.
+# functions run in it mustn't wait for other jobs in it, or they
+# could wait forever for a worker that's busy waiting too.
+FETCH_WORKERS = 8
+fetch_pool = None
+fetch_pool_lock = threading.Lock()
+
+# pages looked up at once in the whole process, over all queries and
+# requests (see lookup_climate_data), however many pools they're in
+fetch_slots = threading.BoundedSemaphore(FETCH_WORKERS)
+
+# what candidate city names in queries (lowercased) resolved to, as
+# (page name, has printable data, get_climate_data() record, page file
+# times, see page_mtimes), or (None, False, None, None) for no page. kept
+# for as long as pages are cached, and dropped when the page or its
+# weatherbox template is downloaded again.
+# records are shared between queries, so they mustn't be changed.
+RESOLUTIONS_SIZE = 2000
+resolutions = cache.LRUCache(RESOLUTIONS_SIZE,
+    cache.CACHE_PERIOD_DAYS * 24 * 3600)
+
+# local index of page titles (see gazetteer.py). when loaded,
+# parse_text_query() resolves names with it before asking Wikipedia.
+GAZETTEER = None
+
+def use_gazetteer(path):
+    global GAZETTEER
+
+    import gazetteer
+    GAZETTEER = gazetteer.load(path)
+
+    return GAZETTEER
 
 def get_page_source(page_name):
     url = API_URL % urllib.quote_plus(page_name.encode('utf-8'))
-    text = cache.get_URL(url, page_name)
-    data = json.loads(text)
+
+    with spans.span('page', page_name):
+        try:
+            if FETCH_SECTIONS and not page_name.startswith('Template:'):
+                text = cache.get_page(page_name,
+                    lambda: fetch_sections(page_name, url))
+            else:
+                text = cache.get_URL(url, page_name)
+        except cache.NotCached:
+            # offline, and we don't have this page
+            return unicode(page_name) + MSG_LOCATION_NOT_FOUND,False
+        except throttle.ERRORS + (OSError,) as e:
+            # Wikipedia can't be reached, or keeps erroring (see
+            # throttle.fetch, which already retried), or the page
+            # couldn't be saved (IOError is in throttle.ERRORS).
+            # anything else is a bug, so it's raised.
+            return unicode(page_name) + MSG_FETCH_ERROR % e,False
+
+        with spans.span('page.json', page_name):
+            try:
+                data = json.loads(text)
+            except ValueError as e:
+                # a broken response, or a corrupt cache file
+                return unicode(page_name) + MSG_FETCH_ERROR % e,False
 
     try:
         page = data['query']['pages'].itervalues().next()
@@ -72,6 +171,142 @@ def get_page_source(page_name):
     except:
         return unicode(page_name) + MSG_LOCATION_NOT_FOUND,False
 
+def get_sections(page_name):
+    # page_name's sections as the API lists them (dicts with a heading
+    # "line" and an "index" for rvsection), cached like pages are, or
+    # None if they can't be had
+    url = SECTIONS_API_URL % urllib.quote_plus(page_name.encode('utf-8'))
+
+    try:
+        text = cache.get_URL(url, page_name + '#sections')
+        return json.loads(text)['parse']['sections']
+    except Exception:
+        # missing page, API errors, network errors
+        return None
+
+def climate_section(sections):
+    # index of the section called Climate, or else the first with climate
+    # in its heading (e.g. "Geography and climate"), or None. sections
+    # from other pages (transcluded, with indexes like "T-1") can't be
+    # asked for by index, so aren't looked at.
+    candidates = [section for section in sections
+        if 'climate' in section['line'].lower() and section['index'].isdigit()]
+
+    for section in candidates:
+        if section['line'].strip().lower() == 'climate':
+            return section['index']
+
+    if candidates:
+        return candidates[0]['index']
+
+    return None
+
+def fetch_sections(page_name, url):
+    """ Fetch page_name's lead and climate sections, returning them as
+    an API response like that for url, the whole page: the lead and
+    climate section make up the page text, and the response's "sections"
+    are their indexes. If that can't be done, url is fetched instead. """
+
+    sections = get_sections(page_name)
+    index = climate_section(sections) if sections else None
+
+    if index is not None:
+        texts = []
+        for section in ['0', index]:
+            text = throttle.fetch(url + '&rvsection=' + section)
+            try:
+                response = json.loads(text)
+                page = response['query']['pages'].itervalues().next()
+                texts.append(page['revisions'][0]['*'])
+            except (ValueError, KeyError, StopIteration):
+                # e.g. the page has changed since its sections were listed
+                break
+
+        if len(texts) == 2 and ('weatherbox' in texts[1].lower()
+                or 'weather box' in texts[1].lower()):
+            page['revisions'][0]['*'] = '\n'.join(texts)
+            response['sections'] = ['0', index]
+            return json.dumps(response)
+
+    return throttle.fetch(url)
+
+def get_existing_pages(page_names):
+    """ Return the set of page_names that exist on Wikipedia, as pages
+    or redirects. Asks about TITLES_PER_QUERY names at a time rather
+    than fetching each page. Names that are already cached are assumed
+    to exist, so they're looked up as usual; when offline, only those
+    can be had, so no others do. If a query fails, all of its names are
+    assumed to exist. """
+
+    existing = set()
+    unknown = []
+
+    for page_name in page_names:
+        if cache.OFFLINE:
+            if cache.get_mtime(page_name) is not None:
+                existing.add(page_name)
+        elif cache.is_cached(page_name):
+            existing.add(page_name)
+        elif '|' not in page_name:
+            # "|" separates titles in the query, and can't be in one anyway
+            unknown.append(page_name)
+
+    for start in range(0, len(unknown), TITLES_PER_QUERY):
+        batch = unknown[start:start + TITLES_PER_QUERY]
+        url = TITLES_API_URL % urllib.quote_plus('|'.join(batch).encode('utf-8'))
+
+        try:
+            response = json.loads(throttle.fetch(url))
+        except Exception:
+            existing.update(batch)
+            continue
+
+        existing.update(parse_existing_pages(batch, response))
+
+    return existing
+
+def parse_existing_pages(page_names, response):
+    # page_names that a titles query response says exist, following
+    # the query's title normalization (e.g. first letter capitalized)
+    # and redirects
+    query = response.get('query', {})
+
+    renames = {}
+    for change in query.get('normalized', []) + query.get('redirects', []):
+        renames[change['from']] = change['to']
+
+    found = set(page['title'] for page in query.get('pages', {}).itervalues()
+        if 'missing' not in page and 'invalid' not in page)
+
+    existing = set()
+    for page_name in page_names:
+        title = page_name
+        seen = set()  # in case of redirect loops
+        while title in renames and title not in seen:
+            seen.add(title)
+            title = renames[title]
+
+        if title in found:
+            existing.add(page_name)
+
+    return existing
+
+def get_fetch_pool():
+    global fetch_pool
+
+    with fetch_pool_lock:
+        if fetch_pool is None:
+            fetch_pool = workers.Pool(FETCH_WORKERS)
+
+    return fetch_pool
+
+def get_page_source_async(page_name):
+    """ Start get_page_source(page_name) in the shared fetch pool.
+    Returns a workers.Job; job.result() waits for and returns what
+    get_page_source() would. """
+
+    return get_fetch_pool().submit(get_page_source, page_name)
+
 def find_template(data, templateName):
     if data is False:
         return ''
@@ -115,15 +350,7 @@ def find_template(data, templateName):
 def get_cities():
     cities = []
 
-    # cgi arguments commented out because i have no way of testing them 
-    # right now - don't want anything potentially shaky in live code
-    """arguments = cgi.FieldStorage()
-
-    if 'city' in arguments:
-        cities = [unicode(arguments['city'].value)]
-    elif 'cities' in arguments:
-        cities = unicode(arguments['cities'].value).split(';')
-    el"""
+    # for serving over HTTP, see server.py
     if len(sys.argv) > 1:
         cities = sys.argv[1:]
         
@@ -156,7 +383,8 @@ def parse_infobox(infobox):
     # wikipedians have increasingly used them within templates,
     # including spanning template sections, so we need to remove them 
     # before doing any processing.
-    infobox = remove_comments(infobox)
+    with spans.span('remove_comments'):
+        infobox = remove_comments(infobox)
 
     # Search through text to find things formatted like
     # [[Vancouver International Airport|YVR]]
@@ -297,6 +525,29 @@ def get_coordinates(place):
 
     return result
 
+def weatherbox_template_name(data):
+    # name of the separate weatherbox template a page includes, like
+    # "Template:New York City weatherbox", or None (see get_climate_data)
+    index2 = max(data.find('weatherbox}}'),
+        data.find('weatherbox/cached}}'),
+        data.find('weatherbox|collapsed=Y}}'))
+
+    if index2 == -1:
+        return None
+
+    index1 = data.rfind('{{', 0, index2)
+    return 'Template:' + data[index1+2:index2+10]
+
+def page_mtimes(page_name, record = None):
+    # cache file times of a page and of the separate weatherbox template
+    # its record was read from, if any (see cache.get_mtime). they change
+    # when either page is downloaded again.
+    names = [page_name]
+    if record is not None and record.get('template') is not None:
+        names.append(record['template'])
+
+    return tuple(cache.get_mtime(name) for name in names)
+
 def get_climate_data(place):
     def find_separate_weatherbox_template(data):
         if data is False:
@@ -312,15 +563,12 @@ def get_climate_data(place):
         # "Template:New York City weatherbox" instead. Not sure how 
         # common this is, but NYC is pretty major and handling it
         # is easy, so might as well.
-        index2 = max(data.find('weatherbox}}'),
-            data.find('weatherbox/cached}}'),
-            data.find('weatherbox|collapsed=Y}}'))
-
-        if index2 > -1:
-            # there is separate template - get it and process it
-            index1 = data.rfind('{{', 0, index2)
-            template_name = 'Template:' + data[index1+2:index2+10]
+        template_name = weatherbox_template_name(data)
 
+        if template_name is not None:
+            # there is separate template - get it and process it.
+            # noted, as the record changes when the template does
+            result['template'] = template_name
             weatherbox_title,data = get_page_source(template_name)
             if data is not False:
                 return find_template(data, 'Weather box')
@@ -344,15 +592,11 @@ def get_climate_data(place):
         # convert text month to number
         return MONTHS.index(month) + 1
 
-    def daily_to_monthly(daily, month):
-        month = month_number(month)
-
-        # use a non-leap year since I suspect monthly numbers are given
-        # for non-leap Februarys
-        days = calendar.monthrange(2013, month)[1]
-
-        return daily * days
-
+    if DATASET is not None:
+        import dataset
+        record = dataset.get_record(DATASET, place)
+        if record is not None:
+            return record
 
     result = {'page_error': False}
     for row_name in ROWS:
@@ -366,14 +610,22 @@ def get_climate_data(place):
         result['page_error'] = True
         return result
 
-    weatherbox = find_template(data, 'Weather box')
-    weatherbox_info = parse_infobox(weatherbox)
+    with spans.span('find_template', place):
+        weatherbox = find_template(data, 'Weather box')
+    with spans.span('parse_infobox', place):
+        weatherbox_info = parse_infobox(weatherbox)
 
     if len(weatherbox_info) == 0:
         # weatherbox not found directly on page
         # see there's a dedicated city weather template we can look at
-        weatherbox = find_separate_weatherbox_template(data).strip()
-        weatherbox_info = parse_infobox(weatherbox)
+        with spans.span('weatherbox_template', place):
+            weatherbox = find_separate_weatherbox_template(data).strip()
+            weatherbox_info = parse_infobox(weatherbox)
+
+    # collect each category's values in page order first,
+    # so that unit conversions can be done a whole row at a time
+    rows = OrderedDict()
+    row_months = {}
 
     for key in weatherbox_info:
         value = weatherbox_info[key]
@@ -388,67 +640,162 @@ def get_climate_data(place):
         month = key[:3]
         if month in MONTHS:
             category = key[3:].strip()  # take out the month to get data category
-            value = parse(value)  # parse value as number
-
-            # last token of category name is sometimes the unit
-            # (C, F, mm, inch, etc)
-            unit = category.rsplit(None, 1)[-1]
-
-            if category in result:
-                # straightforward putting the data in
-                result[category].append(value)
-
-            elif unit in UNIT_CONVERSIONS:
-                # try to convert units to known ones
-                for target_unit in UNIT_CONVERSIONS[unit]:
-                    # try to find a category we collect that 
-                    # we know how to convert into
-                    converted_category = category.replace(unit, target_unit)
-                    if converted_category in result:
-                        converted = UNIT_CONVERSIONS[unit][target_unit](value)
-                        result[converted_category].append(converted)
-                        break
-
-            elif category == 'd sun':
-                # special handling for daily sun hours
-                value = daily_to_monthly(value, month)
-                result['sun'].append(value)
-
-            # Process percentsun if present and we haven't found any other sun data.
-            # Assume specific hour count is more precise than "% sunshine", so only
-            # use percentsun if other data is not more available.
-            # TODO: if percentsun is ahead of sun in the template, this
-            # precautionary condition will still fail
-            elif category == 'percentsun' and len(result['sun']) == 0:
-                if 'observer' not in result:
-                    location = result['title']
-                   
-                    # will try to get lat,lng from wikipedia page if location
-                    # is not recognized by pyephem directly    
-                    result['observer'] = astrodata.process_location(location)
-
-                if result['observer'] != False:
-                    daylight = astrodata.month_daylight(
-                        result['observer'], month_number(month))
-                    sun = (daylight.total_seconds()  / 3600) * (value /100)
-                    sun = round(sun, 1)
-                    result['sun'].append(sun)
+
+            if category not in rows:
+                rows[category] = []
+                row_months[category] = []
+
+            rows[category].append(parse(value))  # parse value as number
+            row_months[category].append(month_number(month))
+
+    for category,values in rows.items():
+        # last token of category name is sometimes the unit
+        # (C, F, mm, inch, etc)
+        unit = units.row_unit(category)
+
+        if category in result:
+            # straightforward putting the data in
+            result[category] = values
+
+        elif unit is not None:
+            # try to find a category we collect that
+            # we know how to convert into
+            for converted_category in ROWS:
+                target_unit = units.row_unit(converted_category)
+
+                if target_unit is not None and target_unit != unit \
+                    and units.dimension(target_unit) == units.dimension(unit) \
+                    and category[:-len(unit)] == \
+                        converted_category[:-len(target_unit)] \
+                    and len(result[converted_category]) == 0:
+                    result[converted_category] = units.convert_row(
+                        values, unit, target_unit, digits = 1)
+                    break
+
+        elif category == 'd sun':
+            # special handling for daily sun hours
+            result['sun'] = units.convert_row(values, 'daily hours', 'hours',
+                digits = 1, months = row_months[category])
+
+    # Process percentsun if present and we haven't found any other sun data.
+    # Assume specific hour count is more precise than "% sunshine", so only
+    # use percentsun if other data is not more available.
+    if 'percentsun' in rows and len(result['sun']) == 0:
+        # imported here so ephem and numpy are only loaded for the
+        # few pages that need them
+        import astrodata
+
+        location = result['title']
+
+        with spans.span('astro', location):
+            # will try to get lat,lng from wikipedia page if location
+            # is not recognized by pyephem directly
+            result['observer'] = astrodata.process_location(location)
+
+            if result['observer'] != False:
+                months = row_months['percentsun']
+                monthly_daylight = astrodata.monthly_daylight(
+                    result['observer'], method = DAYLIGHT_METHOD)
+                daylight = [monthly_daylight[month - 1] for month in months]
+
+        if result['observer'] != False:
+            result['sun'] = units.convert_row(rows['percentsun'], 'percent',
+                'hours', digits = 1, months = months, daylight = daylight)
 
     return result
 
-def get_comparison_data(places, months, categories):
+def get_climate_data_async(place):
+    """ Start get_climate_data(place) in the shared fetch pool, returning
+    a workers.Job (see get_page_source_async). """
+
+    return get_fetch_pool().submit(lookup_climate_data, place)
+
+def lookup_climate_data(place):
+    # get_climate_data(), once fewer than FETCH_WORKERS lookups are
+    # running. only for lookups started concurrently: get_climate_data()
+    # mustn't take a slot itself, or a lookup from a job already holding
+    # one could wait for a slot forever.
+    with fetch_slots:
+        return get_climate_data(place)
+
+def convert_data(data, display_units):
+    """ Return a copy of climate data with rows converted into
+    display_units, a list of units like ['F', 'inch']. Each unit applies
+    to all rows of the same dimension (so 'inch' converts both
+    precipitation mm and snow cm). Row names are left unchanged, but the
+    copy's 'units' say which unit each converted row is in now. """
+
+    result = dict(data)
+    result['units'] = {}
+
+    for row_name in ROWS:
+        unit = display_unit(row_name, display_units)
+        if unit is None or len(data.get(row_name, [])) == 0:
+            continue
+
+        result[row_name] = units.convert_row(data[row_name],
+            units.row_unit(row_name), unit, digits = 1)
+        result['units'][row_name] = unit
+
+    return result
+
+def display_unit(row_name, display_units):
+    # the unit convert_data() converts row_name into, or None if it's
+    # left as it is
+    unit = units.row_unit(row_name)
+    result = None
+
+    for candidate in display_units or []:
+        if unit is not None and candidate != unit \
+                and units.dimension(candidate) == units.dimension(unit):
+            result = candidate
+
+    return result
+
+def row_title(row_name, unit = None):
+    """ row_name's printed title, saying which unit it's in if it has
+    been converted into unit, e.g. "high F" or "prep inch". """
+
+    title = PRINTED_ROW_TITLES[row_name]
+    if unit is None:
+        return title
+
+    original = units.row_unit(row_name)
+    if title.endswith(' ' + original):
+        title = title[:-len(original) - 1]
+
+    return title + ' ' + unit
+
+def get_comparison_data(places, months, categories, display_units = None,
+        records = None):
     """ Return data for a number of places, categories, and months.
      Takes a list of place names, list of 12 boolean values where True
     means the month is requested, and a dictionary of categoryname=boolean
     pairs (True means the category is requested) and returns the data as 
-    long as it exists. Return data format is
+    long as it exists. Optionally converts the data into display_units
+    (see convert_data). records: get_climate_data() results already at
+    hand, by place name (e.g. parse_text_query()'s result['data']), which
+    are used rather than getting them again. Return data format is
     dict(month: dict(city: dict(category: data))) """
 
+    if records is None:
+        records = {}
+
+    # look up all places at once, so that this takes about as long as
+    # the slowest of them rather than all of them together
+    records = dict(records)
+    missing = [place for place in places if records.get(place) is None]
+    for place,job in workers.imap(lookup_climate_data, missing,
+            workers = FETCH_WORKERS):
+        records[place] = job.result()
+
     data = {}
     for place in places:
-        place_data = get_climate_data(place)
+        place_data = records[place]
 
         if place_data['page_error'] is False:
+            if display_units:
+                place_data = convert_data(place_data, display_units)
             data[place_data['title']] = place_data
 
     result = {}
@@ -477,6 +824,14 @@ def get_comparison_data(places, months, categories):
 
     return result
 
+def get_comparison_data_async(places, months, categories,
+        display_units = None, records = None):
+    """ Start get_comparison_data() in the shared fetch pool, returning
+    a workers.Job (see get_page_source_async). """
+
+    return get_fetch_pool().submit(get_comparison_data, places, months,
+        categories, display_units, records)
+
 def has_printable_data(data):
     # This reflects the logic used in format_data_as_text(),
     # boiling it down to the minimum necessary to find out
@@ -496,18 +851,21 @@ def format_data_as_text(provided_data, print_all = False):
         # on page error, only print error message
         return provided_data['title']
 
-    row_titles = dict((row,PRINTED_ROW_TITLES[row]) 
+    row_units = provided_data.get('units', {})
+    row_titles = dict((row, row_title(row, row_units.get(row)))
         for row in PRINTED_ROW_TITLES if row in ROWS_TO_PRINT or print_all)
     max_row_title = 0
 
-    data = provided_data
+    # rows as strings, in a new dict: records are shared (see
+    # resolutions), so provided_data must be left as it is
+    data = dict(provided_data)
     max_lengths = [0]*NUM_MONTHS
 
     for category in ROWS:
         if len(data[category]) == NUM_MONTHS \
             and isinstance(data[category][0], float):
+            data[category] = [str(value) for value in data[category]]
             for i in range(NUM_MONTHS):
-                data[category][i] = str(data[category][i])
                 max_lengths[i] = max(max_lengths[i], len(data[category][i]))
 
             if category in row_titles:
@@ -563,49 +921,100 @@ def format_data_as_text(provided_data, print_all = False):
 
     return output
 
-def format_timer_info():
-    output = ''
+def data_as_json(data, query = None):
+    """ Return climate data as a one-line JSON string. If given, query
+    is included so results can be matched up with what was asked for. """
 
-    if len(timer) > 0:
-        output += '\n'.join(l[0] + ': ' + str(l[1]) for l in timer)
+    # observer is an ephem object used for percentsun, not data
+    output = dict((key, value) for key,value in data.items()
+        if key != 'observer')
 
-    if len(cache.timer) > 0:
-        output += '\n'.join(l[0] + ': ' + str(l[1]) for l in cache.timer)
+    if query is not None:
+        output['query'] = query
 
-    return output
+    return json.dumps(output, sort_keys = True)
+
+def format_timer_info(events = 50):
+    # counters, timings and the most recent events (see metrics.py)
+    return metrics.report(events)
+
+def name_tries(words, i):
+    """ (name, end) pairs for the page names parse_text_query() tries for
+    words[i:end], in the order it tries them: the word on its own, then
+    each run of words from it joined by spaces, each followed by the
+    names with a comma after each word of the run. """
+
+    yield words[i].title(), i + 1
+
+    for j in range(i, len(words) - 1):
+        yield ' '.join(words[i:j+2]).title(), j + 2
+
+        for k in range(j + 1, len(words)):
+            yield (' '.join(words[i:j+1]) + ', '
+                + ' '.join(words[j+1:k+1])).title(), k + 1
+
+def city_candidates(words):
+    """ Every page name parse_text_query() might try for a list of
+    words, in the order it would try them (see name_tries). """
+
+    candidates = [name for i in range(len(words))
+        for name,end in name_tries(words, i)]
+
+    # drop repeats, keeping the first
+    seen = set()
+    return [c for c in candidates if not (c in seen or seen.add(c))]
+
+def match_cities(words, has_data):
+    """ Names of places in words, for which has_data(name) is True: from
+    the first word on, the first name tried (see name_tries) that has
+    data, then the first from the word after the ones it used, and so
+    on. Words that start no name are skipped. """
+
+    found = []
+
+    i = 0
+    while i < len(words):
+        for name,end in name_tries(words, i):
+            if has_data(name):
+                found.append(name)
+                i = end  # skip words we've used this time
+                break
+        else:
+            i += 1
+
+    return found
 
 def parse_text_query(strings):
     """ Takes in an array of strings and extracts recognized months, 
     categories, and cities with climate data. Case- and order-insensitive,
     except city names must appear together.
-    The logic used to try to stitch together multi-word city 
-    Wikipedia article names (e.g. "Hamilton, New Zealand") is essentially 
-    brute-force testing everything (so "Hamilton", "Hamilton New", 
-    "Hamilton, New", "Hamilton New Zealand", "Hamilton New Zealand" until a 
-    match is found or combinations are exhausted. Because of this, 
-    the first lookup for a query with a long or unrecognized city name
-    might take a while as we're sending a number of HTTP queries to Wikipedia.
-    If caching is active, subsequent lookups should be near-instant. 
-    However, if caching is not active, each lookup might be particularly slow 
-    as the city-name-searching algorithm sends a number of queries and 
-    the actual data retrieval makes further queries.
-    So have caching on. (Or change the code.) """
+    Multi-word Wikipedia article names (e.g. "Hamilton, New Zealand")
+    are stitched together from the words: each word is tried on its own
+    first, then with the words after it (see match_cities).
+    To keep that fast, every combination is generated up front and
+    checked for existence in batched title queries (see
+    get_existing_pages). Names are matched against the pages that
+    exist, and only the pages matched are fetched, concurrently; if one
+    turns out to have no data, names are matched again without it.
+    With a gazetteer loaded (see use_gazetteer),
+    names it knows aren't checked over the network, and if it's complete,
+    names it doesn't know aren't either. What each name resolved to is
+    remembered (see resolutions), so later queries with the same names
+    don't even read the cache.
+    result['data'] has the get_climate_data() record of each city found,
+    for passing on to get_comparison_data() rather than parsing again. """
 
     KEYWORDS = ['in', 'vs', 'versus', 'and', 'for']
 
-    def city_has_data(city):
-        data = get_climate_data(city)
-        has_data = has_printable_data(data)
-
-        return has_data
-
-    result = {'cities': [], 'months': [], 'categories': []}
+    result = {'cities': [], 'months': [], 'categories': [], 'units': [],
+        'data': {}}
 
     result['months'] = [False]*12
     result['categories'] = dict((k,False) for k in ROWS)
     category_aliases = dict((v,k) for k,v in PRINTED_ROW_TITLES.iteritems())
     cities = []
 
+    previous = None
     for param in strings:
         # classify each param
         param = param.decode('utf-8')
@@ -635,47 +1044,95 @@ def parse_text_query(strings):
             result['categories']['location'] = True
             classified = True
 
+        # find units to display data in, e.g. "in F". short ones could
+        # be part of a place name, so need the "in".
+        if category_param in units.UNIT_ALIASES and (previous == 'in'
+                or category_param not in units.AMBIGUOUS_ALIASES):
+            result['units'].append(units.UNIT_ALIASES[category_param])
+            classified = True
+
         if classified is False and not param.lower() in KEYWORDS:
             cities.append(param)
 
-    # find cities that we can find climate data for
-    i = 0
-    while i < len(cities):
-        # first, try each string on its own
-        city = cities[i].title()
-        has_data = city_has_data(city)
-
-        j = i
-        while has_data == False and j < len(cities) - 1:
-            # Single string was not recognized.
-            # Try to build a page name we can recognize by adding in
-            # strings that follow this one in the array
-
-            # try using only spaces
-            new_city = ' '.join(cities[i:j+2]).title()
-            has_data = city_has_data(new_city)
-
-            k = j+1
-            while has_data == False and k < len(cities):
-                # if just spaces didn't result in anything recognizable,
-                # try using commas in any possible position
-                new_city = ' '.join(cities[i:j+1]) + ', ' \
-                    + ' '.join(cities[j+1:k+1])
-                new_city = new_city.title()
-                has_data = city_has_data(new_city)
-                k += 1
-
-            if has_data == True:
-                city = new_city
-                i = j + 1 # skip strings we've used this time
-            else:
-                j += 1 # look one more position further in the array
-
-        if has_data == True:
-            # we have a recognized city name, add it to the collection
-            result['cities'].append(city)
-
-        i += 1
+        previous = category_param
+
+    # find which possible city names have data. names resolved by earlier
+    # queries are looked up in memory. for the rest, check which pages
+    # exist (in the gazetteer, or in a few batched queries), then match
+    # names against those, and fetch only the pages that match.
+    candidates = city_candidates(cities)
+
+    known = {}
+    for city in candidates:
+        resolution = resolutions.get(city.lower())
+        if resolution is not None and resolution[0] is not None \
+                and page_mtimes(resolution[0], resolution[2]) \
+                    != resolution[3]:
+            # page or template has been downloaded again since
+            resolution = None
+        known[city] = resolution
+
+    unknown = [city for city in candidates if known[city] is None]
+
+    titles = {}
+    if GAZETTEER is not None:
+        for city in unknown:
+            title = GAZETTEER.lookup(city)
+            if title is not None:
+                titles[city] = title
+
+    if GAZETTEER is not None and GAZETTEER.complete:
+        existing = set(titles)
+    else:
+        existing = set(titles) | get_existing_pages(
+            [city for city in unknown if city not in titles])
+
+    for city in unknown:
+        if city not in existing:
+            known[city] = (None, False, None, None)
+            resolutions.set(city.lower(), known[city])
+
+    def might_have_data(city):
+        # pages that exist but haven't been fetched yet might
+        return known[city] is None or known[city][1]
+
+    # match names as if every page that exists had data, fetch the pages
+    # matched that haven't been, and match again if any turn out not to
+    # have data (e.g. disambiguation pages), going on to the names tried
+    # after them. this ends with the names that fetching every page in
+    # the order of tries would, as every name tried before one matched
+    # has no page or has been fetched and has no data, but the pages
+    # of one round are fetched concurrently.
+    while True:
+        unfetched = [city for city in match_cities(cities, might_have_data)
+            if known[city] is None]
+        if len(unfetched) == 0:
+            break
+
+        # names that lead to the same page only fetch it once
+        pages = dict((city, titles.get(city, city)) for city in unfetched)
+
+        records = {}
+        for page,job in workers.imap(lookup_climate_data,
+                sorted(set(pages.values())), workers = FETCH_WORKERS):
+            records[page] = job.result()
+
+        for city in unfetched:
+            record = records[pages[city]]
+            known[city] = (pages[city], has_printable_data(record), record,
+                page_mtimes(pages[city], record))
+
+            if record['page_error'] and \
+                    not record['title'].endswith(MSG_LOCATION_NOT_FOUND):
+                # e.g. Wikipedia couldn't be reached: might work next time
+                continue
+
+            resolutions.set(city.lower(), known[city])
+
+    for city in match_cities(cities, might_have_data):
+        page_name, has_data, record, mtime = known[city]
+        result['cities'].append(page_name)
+        result['data'][page_name] = record
 
     return result
 
@@ -684,24 +1141,62 @@ if __name__ == '__main__':
     cities = get_cities()
 
     print_all_rows = '-a' in cities
+    # how long each stage took, as a tree, and the metrics
     print_debug = '-t' in cities
+    # one JSON object per line rather than text tables
+    print_json = '--json' in cities
+    # print cities as they finish downloading, not in given order
+    print_unordered = '-u' in cities
+
+    for flag in ['-a', '-t', '--json', '-u']:
+        if flag in cities:
+            cities.remove(flag)
+
+    # --profile ms: save a cProfile profile of runs that take longer
+    if '--profile' in cities:
+        index = cities.index('--profile')
+        spans.PROFILE_THRESHOLD = float(cities[index + 1])
+        del cities[index:index + 2]
+
+    with spans.request('climate.py', ' '.join(cities)) as root:
+        query = parse_text_query(cities)
+        parsed_cities = query['cities']
+
+        if len(parsed_cities) > 0:
+            print_cities = parsed_cities
+        else:
+            print_cities = cities
+
+        def get_data(city):
+            # cities found by the query have already been looked up
+            data = query['data'].get(city)
+            if data is None:
+                data = get_climate_data(city)
+            if query['units']:
+                data = convert_data(data, query['units'])
+
+            return data
+
+        results = workers.imap(get_data, print_cities,
+            ordered = not print_unordered)
+
+        for city,job in results:
+            try:
+                data = job.result()
+            except Exception as e:
+                data = {'page_error': True, 'title': '%s: %s' % (city, e)}
 
-    if print_all_rows:
-        cities.remove('-a')
-    if print_debug:
-        cities.remove('-t')
-
-    parsed_cities = parse_text_query(cities)['cities']
-
-    if len(parsed_cities) > 0:
-        print_cities = parsed_cities
-    else:
-        print_cities = cities
+            if print_json:
+                print data_as_json(data, city)
+            else:
+                print format_data_as_text(data, print_all = print_all_rows)
 
-    for city in print_cities:
-        data = get_climate_data(city)
-        print format_data_as_text(data, print_all = print_all_rows)
+            # get each city out as soon as it's ready, even into a pipe
+            sys.stdout.flush()
 
     if print_debug:
+        print root.format()
         print format_timer_info()
 
+    if root.profile is not None:
+        print >> sys.stderr, 'profile saved to %s' % root.profile
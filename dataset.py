@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+""" Export and import parsed climate data as a memory-mapped dataset.
+
+A dataset is two files sharing a base name:
+- <name>.npy: float32 matrix of shape (places, len(ROWS), 12), one
+  layer per place, one row per climate.ROWS entry, NaN where no data
+- <name>.json: sidecar with the title index, the other names each title
+  was looked up by (e.g. redirects), per-place metadata (location string,
+  separate weatherbox template), plus the ROWS/MONTHS layout used to write the matrix
+
+Loading opens the matrix with mmap, so there is no parsing at startup and
+several processes reading the same file share the same memory pages. """
+
+from __future__ import unicode_literals
+from collections import OrderedDict
+import glob
+import json
+import os
+import sys
+
+import numpy
+
+import cache
+import climate
+
+FORMAT_VERSION = 2
+
+MATRIX_FILE = '%s.npy'
+META_FILE = '%s.json'
+
+def get_file_names(path):
+    return MATRIX_FILE % path, META_FILE % path
+
+def record_to_matrix(record):
+    layer = numpy.full((len(climate.ROWS), climate.NUM_MONTHS), numpy.nan,
+        dtype = numpy.float32)
+
+    for row_index,row_name in enumerate(climate.ROWS):
+        row = record.get(row_name, [])
+
+        # incomplete rows can't be reliably lined up with months
+        # (we don't know which ones are missing), so don't store them.
+        # they're not printed by format_data_as_text() either.
+        if len(row) != climate.NUM_MONTHS:
+            continue
+
+        for month,value in enumerate(row):
+            if value is not None:
+                layer[row_index][month] = value
+
+    return layer
+
+def export_dataset(records, path, names = None):
+    """ Write climate records, as returned by climate.get_climate_data(),
+    to a dataset at path (without extension). names, if given, are the
+    places the records were looked up by, in the same order; get_record()
+    finds each record by them as well as by its title. Records with a page
+    error are skipped. Returns list of titles written. """
+
+    if names is None:
+        names = [record.get('title') for record in records]
+
+    # one layer per title, however many names led to it
+    places = OrderedDict()
+    for name,record in zip(names, records):
+        if record['page_error'] is not False:
+            continue
+
+        record, aliases = places.setdefault(record['title'], (record, []))
+        if name.lower() != record['title'].lower() and \
+                name.lower() not in [alias.lower() for alias in aliases]:
+            aliases.append(name)
+
+    records = [record for record,aliases in places.values()]
+
+    matrix = numpy.full(
+        (len(records), len(climate.ROWS), climate.NUM_MONTHS), numpy.nan,
+        dtype = numpy.float32)
+    for i,record in enumerate(records):
+        matrix[i] = record_to_matrix(record)
+
+    meta = {
+        'version': FORMAT_VERSION,
+        'rows': climate.ROWS,
+        'months': climate.MONTHS,
+        'titles': [record['title'] for record in records],
+        'names': [aliases for record,aliases in places.values()],
+        'locations': [record.get('location', '') for record in records],
+        'templates': [record.get('template') for record in records]
+    }
+
+    matrix_file, meta_file = get_file_names(path)
+
+    # write to temporary names first and rename over, so a process
+    # that has the old dataset mapped keeps seeing consistent data
+    numpy.save(matrix_file + '.tmp', matrix)
+    os.rename(matrix_file + '.tmp.npy', matrix_file)
+
+    f = open(meta_file + '.tmp', 'w')
+    json.dump(meta, f)
+    f.close()
+    os.rename(meta_file + '.tmp', meta_file)
+
+    return meta['titles']
+
+def export_places(places, path):
+    records = [climate.get_climate_data(place) for place in places]
+    return export_dataset(records, path, places)
+
+def cached_page_names():
+    # recover page names from cache file names. templates (separate
+    # weatherboxes) are only ever used as part of their city's data.
+    prefix = cache.get_file_name('')
+    names = [file_name[len(prefix):]
+        for file_name in glob.glob(cache.get_file_name('*'))]
+
+    return sorted(name for name in names if not name.startswith('Template:'))
+
+def export_cache(path):
+    """ Build a dataset from every page in the cache directory. """
+
+    return export_places(cached_page_names(), path)
+
+def load_dataset(path):
+    """ Open a dataset written by export_dataset(). The matrix is
+    memory-mapped read-only rather than read into memory. """
+
+    matrix_file, meta_file = get_file_names(path)
+
+    f = open(meta_file, 'r')
+    meta = json.load(f)
+    f.close()
+
+    if meta['version'] != FORMAT_VERSION:
+        raise ValueError('unsupported dataset version %s' % meta['version'])
+
+    if meta['rows'] != climate.ROWS or meta['months'] != climate.MONTHS:
+        raise ValueError('dataset was written with a different row layout')
+
+    matrix = numpy.load(matrix_file, mmap_mode = 'r')
+
+    # case-insensitive, since queries usually aren't capitalized
+    # the same way as titles. titles win over other pages' names.
+    index = {}
+    for i,aliases in enumerate(meta['names']):
+        for name in aliases:
+            index[name.lower()] = i
+    for i,title in enumerate(meta['titles']):
+        index[title.lower()] = i
+
+    return {'matrix': matrix, 'index': index, 'titles': meta['titles'],
+        'locations': meta['locations'], 'templates': meta['templates']}
+
+def get_record(dataset, place):
+    """ Return a record in the same format as climate.get_climate_data(),
+    or None if place is not in the dataset. """
+
+    i = dataset['index'].get(place.lower())
+    if i is None:
+        return None
+
+    result = {'page_error': False, 'title': dataset['titles'][i]}
+
+    location = dataset['locations'][i]
+    if len(location) > 0:
+        result['location'] = location
+
+    # see climate.page_mtimes
+    template = dataset['templates'][i]
+    if template is not None:
+        result['template'] = template
+
+    layer = dataset['matrix'][i]
+    for row_index,row_name in enumerate(climate.ROWS):
+        row = layer[row_index]
+        if numpy.isnan(row).all():
+            result[row_name] = []
+        else:
+            # float32 can't hold e.g. 18.6 exactly; %g recovers the
+            # short decimal value that was parsed from the page
+            result[row_name] = [None if numpy.isnan(v)
+                else float('%.6g' % v) for v in row]
+
+    return result
+
+if __name__ == '__main__':
+    # usage: dataset.py <path> [places...]
+    # without places, every page in the cache directory is exported
+    if len(sys.argv) < 2:
+        print 'usage: dataset.py <path> [places...]'
+        sys.exit(1)
+
+    path = sys.argv[1]
+    places = [arg.decode('utf-8') for arg in sys.argv[2:]]
+
+    if len(places) > 0:
+        titles = export_places(places, path)
+    else:
+        titles = export_cache(path)
+
+    print 'exported %d places to %s' % (len(titles), ', '.join(get_file_names(path)))
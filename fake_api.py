@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+""" A stand-in for Wikipedia's API (en.wikipedia.org/w/api.php), for load
+testing without sending Wikipedia any requests.
+
+usage: fake_api.py [-p port] [--latency ms] [--jitter ms] [--errors fraction]
+    [--maxlag fraction] [--places n] [--page-kb kb] [--redirect from=to]...
+
+Answers the kinds of query climate makes: page contents (prop=revisions,
+optionally of one section with rvsection) and whether pages exist (no
+prop), for any number of titles separated by "|", and the list of a
+page's sections (action=parse&prop=sections). Titles are normalized and
+redirects followed as Wikipedia would, when asked to with redirects=true.
+Also the recent changes changefeed.py follows (list=recentchanges), which
+are those made with FakeAPI.change(), and the time of pages' latest
+revisions (rvprop=timestamp).
+
+Pages are those of the benchmark fixtures (see bench.py), and --places
+made-up places named by place_names(), each with a weatherbox and padded
+to about --page-kb of wikitext. Other titles are missing.
+
+Each response waits --latency ms, give or take up to --jitter ms. A
+fraction --errors of requests get an HTTP 503, and a fraction --maxlag a
+maxlag error, which throttle.fetch retries.
+
+Point climate at it with the CLIMATE_API_URL environment variable or
+climate.use_api(), e.g. CLIMATE_API_URL=http://localhost:8081/w/api.php
+(see also loadtest.py, which starts one itself). """
+
+from __future__ import unicode_literals
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import urlparse
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+import bench
+import climate
+import server
+
+DEFAULT_PORT = 8081
+
+# seconds a maxlag error asks to wait before retrying
+MAXLAG_RETRY_AFTER = 1
+
+# when pages were last edited, unless changed since
+CREATED = '2001-01-15T00:00:00Z'
+
+# a section heading line, like "== Climate =="
+HEADING = re.compile(r'^(={1,6})\s*(.+?)\s*\1\s*$', re.MULTILINE)
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ran', 'te', 'vo', 'su', 'del', 'pa', 'gor',
+    'bi', 'nu', 'shan', 'ti', 'wel', 'zo']
+
+def place_names(n):
+    """ n made-up place names, one word each, always the same ones. """
+
+    names = []
+    for i in range(n):
+        syllables = []
+        for j in range(3):
+            syllables.append(SYLLABLES[i % len(SYLLABLES)])
+            i //= len(SYLLABLES)
+        names.append(''.join(syllables).title() + 'ville')
+
+    return names
+
+def place_page(name, index, size = 50 * 1024):
+    # wikitext for a made-up place: an infobox, a history section of
+    # filler up to size characters, and a climate section with a
+    # weatherbox whose numbers depend on index
+    lat = (index * 37) % 140 - 70
+
+    rows = []
+    for month_index,month in enumerate(climate.MONTHS):
+        season = math.cos(2 * math.pi * month_index / 12) \
+            * (1 if lat >= 0 else -1)
+        high = 20 - abs(lat) / 3.0 - 10 * season
+        rows.append('|%s high C = %.1f\n|%s low C = %.1f\n'
+            '|%s precipitation mm = %.1f\n|%s sun = %.1f\n' % (month, high,
+            month, high - 8, month, 60 + 20 * season, month, 180 - 60 * season))
+
+    text = ('{{Infobox settlement\n|name = %s\n|coordinates = {{Coord|%d|N|%d|E'
+        '|display=inline,title}}\n}}\n\'\'\'%s\'\'\' is a made-up place.\n'
+        '\n== History ==\n' % (name, abs(lat), index % 180, name))
+
+    filler = 'It has streets, parks and a river.<ref>{{cite web ' \
+        '|url=http://example.org |title=Source}}</ref> '
+    text += filler * max(0, (size - len(text)) // len(filler))
+
+    return text + '\n== Climate ==\n{{Weather box\n|location = %s\n%s' \
+        '|source = made up\n}}\n' % (name, ''.join(rows))
+
+def split_sections(text):
+    """ The sections of wikitext as (level, heading, start, end) tuples,
+    the lead first, as level 0. A section runs up to the next heading of
+    its level or above, so it includes its subsections. """
+
+    headings = [(len(match.group(1)), match.group(2), match.start())
+        for match in HEADING.finditer(text)]
+
+    sections = [(0, '', 0, headings[0][2] if headings else len(text))]
+    for i,(level,line,start) in enumerate(headings):
+        end = len(text)
+        for later_level,later_line,later_start in headings[i + 1:]:
+            if later_level <= level:
+                end = later_start
+                break
+        sections.append((level, line, start, end))
+
+    return sections
+
+def list_sections(title, text):
+    # sections as action=parse&prop=sections lists them
+    result = []
+    levels = []
+    numbers = []
+
+    for index,(level,line,start,end) in enumerate(split_sections(text)):
+        if index == 0:
+            continue
+
+        while levels and levels[-1] > level:
+            levels.pop()
+            numbers.pop()
+        if levels and levels[-1] == level:
+            numbers[-1] += 1
+        else:
+            levels.append(level)
+            numbers.append(1)
+
+        result.append({'toclevel': len(levels), 'level': str(level),
+            'line': line, 'number': '.'.join(str(n) for n in numbers),
+            'index': str(index), 'fromtitle': title, 'byteoffset': start,
+            'anchor': line.replace(' ', '_')})
+
+    return result
+
+def normalize(title):
+    # as MediaWiki does: underscores are spaces, first letter capitalized
+    title = ' '.join(title.replace('_', ' ').split())
+    return title[:1].upper() + title[1:]
+
+class FakeAPI(object):
+    """ The fake API as a WSGI application. """
+
+    def __init__(self, pages = None, redirects = None, latency = 0,
+            jitter = 0, errors = 0, maxlag = 0, seed = None):
+        """ pages: wikitext by title. redirects: target title by title.
+        latency, jitter: ms. errors, maxlag: fractions of requests. """
+
+        self.pages = pages or {}
+        self.redirects = redirects or {}
+        self.latency = latency
+        self.jitter = jitter
+        self.errors = errors
+        self.maxlag = maxlag
+
+        # recent changes, oldest first, and when pages were last changed
+        self.changes = []
+        self.timestamps = {}
+
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def add_fixtures(self, fixtures):
+        # pages and redirects from bench.py's fixtures
+        for fixture in fixtures.values():
+            for response in fixture['pages'].values():
+                query = response['query']
+                for page in query['pages'].values():
+                    if 'revisions' in page:
+                        self.pages[page['title']] = page['revisions'][0]['*']
+                for redirect in query.get('redirects', []):
+                    self.redirects[redirect['from']] = redirect['to']
+
+    def add_places(self, n, size = 50 * 1024):
+        for index,name in enumerate(place_names(n)):
+            self.pages[name] = place_page(name, index, size)
+
+    def change(self, title, text = None):
+        """ Edit title now, replacing its text if given, so that the
+        change is listed in the recent changes. """
+
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+        with self.lock:
+            if text is not None:
+                self.pages[title] = text
+            self.timestamps[title] = timestamp
+            self.changes.append({'type': 'edit',
+                'ns': 10 if title.startswith('Template:') else 0,
+                'title': title, 'rcid': len(self.changes) + 1,
+                'timestamp': timestamp})
+
+    def recent_changes(self, start, limit, next_id):
+        """ The API's response to list=recentchanges&rcdir=newer, from
+        the time start (or the first change), up to limit of them,
+        starting with the change numbered next_id if continuing. """
+
+        with self.lock:
+            changes = [change for change in self.changes
+                if (start is None or change['timestamp'] >= start)
+                and change['rcid'] >= next_id]
+
+        result = {'batchcomplete': '',
+            'query': {'recentchanges': changes[:limit]}}
+        if len(changes) > limit:
+            result['continue'] = {'continue': '-||', 'rccontinue': '%s|%d' % (
+                changes[limit]['timestamp'], changes[limit]['rcid'])}
+
+        return result
+
+    def resolve(self, given, follow_redirects, normalized, redirects):
+        # the title given leads to, noting the changes made
+        title = normalize(given)
+        if title != given:
+            normalized.append({'from': given, 'to': title})
+
+        if follow_redirects and title in self.redirects:
+            redirects.append({'from': title, 'to': self.redirects[title]})
+            title = self.redirects[title]
+
+        return title
+
+    def page_id(self, title):
+        # stable made-up page ids
+        return abs(hash(title)) % 10000000 + 1
+
+    def query(self, titles, content, follow_redirects, section = None,
+            timestamps = False):
+        """ The API's response to a query for titles, with their
+        wikitext if content, or only that of section (an index), and the
+        time of their latest revision if timestamps. """
+
+        query = {'pages': {}}
+        normalized = []
+        redirects = []
+        missing_ids = 0
+
+        for given in titles:
+            title = self.resolve(given, follow_redirects, normalized,
+                redirects)
+
+            if title in self.pages:
+                page_id = self.page_id(title)
+                page = {'pageid': page_id, 'ns': 0, 'title': title}
+
+                text = self.pages[title]
+                if content and section is not None:
+                    sections = split_sections(text)
+                    if not section.isdigit() or int(section) >= len(sections):
+                        return {'error': {'code': 'rvnosuchsection',
+                            'info': 'There is no section %s.' % section}}
+                    level,line,start,end = sections[int(section)]
+                    text = text[start:end]
+
+                if content:
+                    page['revisions'] = [{'contentformat': 'text/x-wiki',
+                        'contentmodel': 'wikitext', '*': text}]
+                if timestamps:
+                    page.setdefault('revisions', [{}])[0]['timestamp'] = \
+                        self.timestamps.get(title, CREATED)
+            else:
+                missing_ids -= 1
+                page_id = missing_ids
+                page = {'ns': 0, 'title': title, 'missing': ''}
+
+            query['pages'][str(page_id)] = page
+
+        if normalized:
+            query['normalized'] = normalized
+        if redirects:
+            query['redirects'] = redirects
+
+        return {'batchcomplete': '', 'query': query}
+
+    def parse_sections(self, given, follow_redirects):
+        """ The API's response to action=parse&prop=sections. """
+
+        redirects = []
+        title = self.resolve(given, follow_redirects, [], redirects)
+
+        if title not in self.pages:
+            return {'error': {'code': 'missingtitle',
+                'info': 'The page you specified doesn\'t exist.'}}
+
+        parse = {'title': title, 'pageid': self.page_id(title),
+            'sections': list_sections(title, self.pages[title])}
+        if redirects:
+            parse['redirects'] = redirects
+
+        return {'parse': parse}
+
+    def __call__(self, environ, start_response):
+        params = urlparse.parse_qs(environ.get('QUERY_STRING', ''))
+
+        with self.lock:
+            self.requests += 1
+            wait = self.latency + self.random.uniform(-self.jitter,
+                self.jitter)
+            roll = self.random.random()
+
+        time.sleep(max(0, wait) / 1000.0)
+
+        headers = [(b'Content-Type', b'application/json; charset=utf-8')]
+
+        if roll < self.errors:
+            start_response(b'503 Service Unavailable',
+                [(b'Content-Type', b'text/plain')])
+            return [b'fake_api.py: made-up error']
+
+        if roll < self.errors + self.maxlag:
+            result = {'error': {'code': 'maxlag',
+                'info': 'Waiting for a database server: 6 seconds lagged'}}
+            headers.append((b'Retry-After', str(MAXLAG_RETRY_AFTER)))
+        elif params.get('action') == ['query'] and 'titles' in params:
+            titles = params['titles'][0].decode('utf-8').split('|')
+            revisions = 'revisions' in params.get('prop', [''])[0].split('|')
+            rvprop = params.get('rvprop', [''])[0].split('|')
+            result = self.query(titles, revisions and 'content' in rvprop,
+                'redirects' in params, params.get('rvsection', [None])[0],
+                revisions and 'timestamp' in rvprop)
+        elif params.get('action') == ['query'] \
+                and params.get('list') == ['recentchanges']:
+            next_id = params.get('rccontinue', ['|0'])[0].split('|')[1]
+            result = self.recent_changes(params.get('rcstart', [None])[0],
+                int(params.get('rclimit', ['10'])[0]), int(next_id))
+        elif params.get('action') == ['parse'] and 'page' in params \
+                and params.get('prop') == ['sections']:
+            result = self.parse_sections(params['page'][0].decode('utf-8'),
+                'redirects' in params)
+        else:
+            result = {'error': {'code': 'badquery',
+                'info': 'fake_api.py only answers action=query&titles=..., '
+                'action=query&list=recentchanges '
+                'and action=parse&page=...&prop=sections'}}
+
+        body = json.dumps(result).encode('utf-8')
+        with self.lock:
+            self.bytes += len(body)
+        headers.append((b'Content-Length', str(len(body))))
+        start_response(b'200 OK', headers)
+
+        return [body]
+
+class QuietHandler(WSGIRequestHandler):
+    # a line on stderr for every request would slow load tests down
+    def log_message(self, *args):
+        pass
+
+class FakeAPIServer(server.ThreadingWSGIServer):
+    # enough waiting connections for high concurrency levels
+    request_queue_size = 128
+
+def start(app, port = 0, host = '127.0.0.1'):
+    """ Serve app in a background thread, on port (or any free port if 0).
+    Returns the server, and the API URL to give climate.use_api(). """
+
+    httpd = make_server(host, port, app, server_class = FakeAPIServer,
+        handler_class = QuietHandler)
+
+    thread = threading.Thread(target = httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return httpd, 'http://%s:%d/w/api.php' % (host, httpd.server_port)
+
+def from_args(args):
+    """ A FakeAPI set up by command line arguments (see usage), which
+    are removed from args. """
+
+    def option(flag, default):
+        if flag not in args:
+            return default
+
+        index = args.index(flag)
+        value = args[index + 1]
+        del args[index:index + 2]
+        return value
+
+    app = FakeAPI(latency = float(option('--latency', 0)),
+        jitter = float(option('--jitter', 0)),
+        errors = float(option('--errors', 0)),
+        maxlag = float(option('--maxlag', 0)))
+
+    app.add_fixtures(bench.load_fixtures())
+    app.add_places(int(option('--places', 100)),
+        int(float(option('--page-kb', 50)) * 1024))
+
+    while '--redirect' in args:
+        source, target = option('--redirect', None).decode('utf-8').split('=')
+        app.redirects[source] = target
+
+    return app
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    port = DEFAULT_PORT
+    if '-p' in args:
+        index = args.index('-p')
+        port = int(args[index + 1])
+        del args[index:index + 2]
+
+    app = from_args(args)
+
+    httpd = make_server('', port, app, server_class = FakeAPIServer,
+        handler_class = QuietHandler)
+
+    print 'serving %d pages as http://localhost:%d/w/api.php' % (
+        len(app.pages), port)
+    httpd.serve_forever()
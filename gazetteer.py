@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+""" Local index of Wikipedia page titles, for resolving place names
+without asking Wikipedia whether a page exists.
+
+usage: gazetteer.py <index file> [titles dump]
+
+Without a dump, the index is built from the pages in the cache directory
+(their titles, and the names that were redirected or normalized to them).
+A dump is a list of titles, one per line, like Wikipedia's
+enwiki-latest-all-titles-in-ns0(.gz); an index built from one is complete,
+so names that aren't in it are known not to exist.
+
+Names are compared normalized: case, accents, commas and underscores
+don't matter, so "sao paulo" finds "São Paulo" and "Hamilton New Zealand"
+finds "Hamilton, New Zealand". Where titles differ only by case, the one
+written like the name looked up is preferred, then one that isn't all
+capitals, so "Nice" finds Nice rather than NICE.
+
+The index is a sorted file of names and titles, memory-mapped and
+searched by bisection, which also gives prefix lookups; a complete
+index of Wikipedia's titles is a few hundred MB on disk but takes next
+to nothing to load. """
+
+from __future__ import unicode_literals
+import glob
+import gzip
+import json
+import mmap
+import os
+import sys
+import tempfile
+import unicodedata
+
+import numpy
+
+import cache
+
+FORMAT_VERSION = 2
+
+# where the offsets of an index's lines are saved
+OFFSETS_FILE = '%s.offsets.npy'
+
+def normalize(name):
+    # decompose accented letters and drop the accents
+    name = unicodedata.normalize('NFKD', unicode(name))
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+
+    name = name.replace('_', ' ').replace(',', ' ')
+
+    return ' '.join(name.lower().split())
+
+def choose_title(name, titles):
+    # among titles with the same normalized name: the one written as
+    # name is, else the name capitalized the usual way, else one that
+    # isn't all capitals (Nice rather than NICE), else the first
+    written = ' '.join(unicode(name).replace('_', ' ').split())
+    if written in titles:
+        return written
+    if written.title() in titles:
+        return written.title()
+
+    ordinary = [title for title in titles if not title.isupper()]
+    return (ordinary or titles)[0]
+
+class Gazetteer(object):
+    """ Sorted "key<tab>title" lines, UTF-8 encoded and packed into one
+    string (or a memory-mapped file, see load()), with the offset of each
+    line in a numpy array. A key can have several titles, when titles
+    differ only by case or accents. """
+
+    def __init__(self, entries = (), complete = False):
+        """ entries: (name, title) pairs, where title is the page that
+        name leads to (e.g. the target of a redirect from name).
+        complete: whether entries cover every page, so that names not
+        found don't exist. """
+
+        # sorting the encoded lines sorts by key, then title: the tab
+        # sorts before any character a key can have
+        lines = sorted(set(('%s\t%s\n' % (normalize(name), title))
+            .encode('utf-8') for name,title in entries))
+
+        self.data = b''.join(lines)
+        self.base = 0
+        self.offsets = numpy.zeros(len(lines) + 1, dtype = numpy.int64)
+        self.offsets[1:] = numpy.cumsum(numpy.fromiter(
+            (len(line) for line in lines), numpy.int64, len(lines)))
+        self.complete = complete
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def entry(self, i):
+        # key and title of line i, as UTF-8
+        line = self.data[self.base + int(self.offsets[i]):
+            self.base + int(self.offsets[i + 1]) - 1]
+        return line.split(b'\t', 1)
+
+    def find(self, key):
+        # index of the first line with key, or where it would be
+        low = 0
+        high = len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.entry(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def lookup(self, name):
+        """ Return the page title for name, or None if not known. """
+
+        key = normalize(name).encode('utf-8')
+
+        titles = []
+        i = self.find(key)
+        while i < len(self):
+            entry_key, title = self.entry(i)
+            if entry_key != key:
+                break
+            titles.append(title.decode('utf-8'))
+            i += 1
+
+        if len(titles) == 0:
+            return None
+
+        return choose_title(name, titles)
+
+    def prefix(self, text, limit = 10):
+        """ Return up to limit page titles whose names start with text. """
+
+        key = normalize(text).encode('utf-8')
+
+        titles = []
+        i = self.find(key)
+        while i < len(self) and len(titles) < limit:
+            entry_key, title = self.entry(i)
+            if not entry_key.startswith(key):
+                break
+            if title.decode('utf-8') not in titles:
+                titles.append(title.decode('utf-8'))
+            i += 1
+
+        return titles
+
+    def save(self, path):
+        # a header line, then the lines; their offsets go in a numpy
+        # file alongside. each is written to a temporary file first,
+        # then renamed into place.
+        directory = os.path.dirname(os.path.abspath(path))
+
+        fd,temp_file_name = tempfile.mkstemp(dir = directory, suffix = '.npy')
+        f = os.fdopen(fd, 'wb')
+        numpy.save(f, numpy.asarray(self.offsets))
+        f.close()
+        os.chmod(temp_file_name, 0o644)
+        os.rename(temp_file_name, OFFSETS_FILE % path)
+
+        fd,temp_file_name = tempfile.mkstemp(dir = directory)
+        f = os.fdopen(fd, 'wb')
+        f.write(json.dumps({'version': FORMAT_VERSION,
+            'complete': self.complete, 'entries': len(self),
+            'size': int(self.offsets[-1])}).encode('utf-8') + b'\n')
+        f.write(self.data[self.base:self.base + int(self.offsets[-1])])
+        f.close()
+
+        os.chmod(temp_file_name, 0o644)
+        os.rename(temp_file_name, path)
+
+def load(path):
+    """ Open a saved gazetteer. Its lines are memory-mapped rather than
+    read, so loading takes no time or memory to speak of, and processes
+    sharing an index share its pages. """
+
+    f = open(path, 'rb')
+    header_line = f.readline()
+    header = json.loads(header_line.decode('utf-8'))
+    if header['version'] != FORMAT_VERSION:
+        f.close()
+        raise ValueError('unsupported gazetteer version %s' % header['version'])
+
+    gazetteer = Gazetteer(complete = header['complete'])
+
+    # an empty file can't be mapped, but always has its header
+    gazetteer.data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    gazetteer.base = len(header_line)
+    f.close()
+
+    gazetteer.offsets = numpy.load(OFFSETS_FILE % path, mmap_mode = 'r')
+
+    if len(gazetteer) != header['entries'] \
+            or int(gazetteer.offsets[-1]) != header['size']:
+        # e.g. replaced while we were opening it
+        raise ValueError('gazetteer %s doesn\'t match its offsets' % path)
+
+    return gazetteer
+
+def cache_entries():
+    # (name, title) pairs from the pages in the cache directory: each
+    # page's title, the name it was requested as, and any names the
+    # API normalized or redirected to it
+    prefix = cache.get_file_name('')
+
+    for file_name in glob.glob(cache.get_file_name('*')):
+        page_name = file_name[len(prefix):]
+        if page_name.startswith('Template:'):
+            continue
+
+        f = open(file_name, 'r')
+        try:
+            query = json.load(f).get('query', {})
+        except ValueError:
+            continue
+        finally:
+            f.close()
+
+        for page in query.get('pages', {}).itervalues():
+            if 'missing' in page or 'invalid' in page:
+                continue
+
+            title = page['title']
+            yield title, title
+            yield page_name, title
+
+            # only one page is asked for at a time, so every
+            # normalization and redirect leads to this one
+            for change in query.get('normalized', []) \
+                    + query.get('redirects', []):
+                yield change['from'], title
+
+def from_cache():
+    """ Build a gazetteer from the pages in the cache directory.
+    It only knows pages that have been looked up, so isn't complete. """
+
+    return Gazetteer(cache_entries(), complete = False)
+
+def from_titles_dump(path):
+    """ Build a complete gazetteer from a titles dump, optionally gzipped.
+    The first line is skipped if it's the dump's "page_title" header. """
+
+    if path.endswith('.gz'):
+        f = gzip.open(path, 'r')
+    else:
+        f = open(path, 'r')
+
+    def entries():
+        for line in f:
+            title = line.decode('utf-8').strip().replace('_', ' ')
+            if len(title) > 0 and title != 'page title':
+                yield title, title
+
+    gazetteer = Gazetteer(entries(), complete = True)
+    f.close()
+
+    return gazetteer
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+
+    if len(sys.argv) > 2:
+        gazetteer = from_titles_dump(sys.argv[2])
+    else:
+        gazetteer = from_cache()
+
+    gazetteer.save(sys.argv[1])
+
+    print 'saved %d names to %s' % (len(gazetteer), sys.argv[1])
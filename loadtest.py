@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+""" Load test: many concurrent lookups against a fake Wikipedia API,
+reporting latency percentiles and throughput at each concurrency level.
+
+usage: loadtest.py [-c 1,4,16] [-n requests] [--target name] [--warm]
+    [--sections] [--rate requests per second] [--api URL]
+    [fake_api.py options]
+
+Targets:
+    query    climate.parse_text_query() on queries like "Kalomiville
+             Teranville high July" (the default)
+    compare  climate.get_comparison_data() for two or three places
+    plugin   the supybot plugin's Climate.get, minus IRC: queries are
+             answered by the plugin's worker pool and reply cache. Only
+             available where supybot can be imported.
+
+Unless --api gives the URL of an API to use (e.g. a fake_api.py running
+elsewhere), a fake_api.py server is started in this process, taking the
+same options (--latency, --errors, --places, ...).
+
+Each concurrency level starts with empty caches, so pages are fetched
+from the API, unless --warm is given, in which case every level is run
+once first to fill them. The API is local, so throttle's rate limit is
+lifted, or set to --rate. With --sections, pages are fetched a section at
+a time (see climate.FETCH_SECTIONS). KB is how much the API sent, when
+it's started here. """
+
+from __future__ import unicode_literals
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import cache
+import climate
+import fake_api
+import throttle
+import workers
+
+DEFAULT_CONCURRENCY = [1, 4, 16]
+DEFAULT_REQUESTS = 200
+
+def percentile(sorted_values, fraction):
+    # nearest rank
+    rank = int(math.ceil(fraction * len(sorted_values)))
+    return sorted_values[max(0, min(rank, len(sorted_values)) - 1)]
+
+def make_queries(places, n, seed = 0):
+    """ n lists of query words, each naming one to three places, a month
+    and a category. """
+
+    chooser = random.Random(seed)
+    months = climate.MONTHS
+    categories = ['high', 'low', 'sun', 'r-high']
+
+    queries = []
+    for i in range(n):
+        words = []
+        for place in chooser.sample(places, chooser.randint(1, 3)):
+            words += place.encode('utf-8').split()
+        words += [chooser.choice(months).encode('utf-8'),
+            chooser.choice(categories).encode('utf-8')]
+        queries.append(words)
+
+    return queries
+
+def query_target():
+    def run(words):
+        result = climate.parse_text_query(words)
+        if not result['cities']:
+            raise ValueError('no cities found in %s' % ' '.join(words))
+        return result
+
+    return run
+
+def compare_target(places):
+    # the places of each query, as parse_text_query would have found them
+    by_words = dict((tuple(place.encode('utf-8').split()), place)
+        for place in places)
+
+    def run(words):
+        found = []
+        i = 0
+        while i < len(words):
+            for length in [3, 2, 1]:
+                if tuple(words[i:i + length]) in by_words:
+                    found.append(by_words[tuple(words[i:i + length])])
+                    i += length
+                    break
+            else:
+                i += 1
+
+        months = [False] * climate.NUM_MONTHS
+        months[climate.MONTHS.index(words[-2].decode('utf-8'))] = True
+        categories = dict((row, row == 'high C') for row in climate.ROWS)
+
+        return climate.get_comparison_data(found, months, categories)
+
+    return run
+
+def plugin_target():
+    """ A function answering a query like Climate.get does, or None if
+    supybot isn't available. """
+
+    try:
+        import supybot.conf
+    except ImportError:
+        return None
+
+    sys.path.insert(0, os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), 'supybotplugin'))
+
+    # registers the plugin's configuration
+    import Climate
+    from Climate import plugin
+
+    instance = plugin.Climate(None)
+
+    def run(words):
+        # as get() does, minus replying on IRC
+        job = workers.Job(instance._get_response, (words,))
+        instance.pool.put(job)
+        return job.result()
+
+    return run
+
+def run_level(target, queries, concurrency):
+    """ Run target on each of queries, concurrency at a time. Returns
+    the latencies in ms, the number of errors and the seconds taken. """
+
+    latencies = []
+    errors = [0]
+    pending = iter(queries)
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            with lock:
+                words = next(pending, None)
+            if words is None:
+                return
+
+            start = time.time()
+            try:
+                target(words)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+            latency = (time.time() - start) * 1000.0
+
+            with lock:
+                latencies.append(latency)
+
+    start = time.time()
+    threads = [threading.Thread(target = work) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, errors[0], time.time() - start
+
+def empty_caches():
+    cache.memory.clear()
+    climate.resolutions.clear()
+
+    shutil.rmtree(cache.CACHE_DIR)
+    os.makedirs(cache.CACHE_DIR)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    def option(flag, default = None):
+        if flag not in args:
+            return default
+
+        index = args.index(flag)
+        value = args[index + 1]
+        del args[index:index + 2]
+        return value
+
+    levels = [int(c) for c in option('-c', ','.join(
+        str(c) for c in DEFAULT_CONCURRENCY)).split(',')]
+    requests = int(option('-n', DEFAULT_REQUESTS))
+    target_name = option('--target', 'query')
+    api = option('--api')
+    rate = option('--rate')
+
+    warm = '--warm' in args
+    if warm:
+        args.remove('--warm')
+
+    if '--sections' in args:
+        args.remove('--sections')
+        climate.FETCH_SECTIONS = True
+
+    app = fake_api.from_args(args)
+    places = sorted(place for place in app.pages
+        if not place.startswith('Template:'))
+
+    if api is None:
+        httpd, api = fake_api.start(app)
+
+    climate.use_api(api)
+
+    if rate is None:
+        throttle.bucket = throttle.TokenBucket(1e9, 1e9)
+    else:
+        throttle.bucket = throttle.TokenBucket(float(rate), 1)
+
+    if target_name == 'query':
+        target = query_target()
+    elif target_name == 'compare':
+        target = compare_target(places)
+    elif target_name == 'plugin':
+        target = plugin_target()
+        if target is None:
+            print 'the plugin target needs supybot, which can\'t be imported'
+            sys.exit(1)
+    else:
+        print __doc__
+        sys.exit(1)
+
+    cache.CACHE_DIR = tempfile.mkdtemp()
+    queries = make_queries(places, requests)
+
+    print 'target %s, %d requests, %d places, API %s%s%s' % (target_name,
+        requests, len(places), api, ', warm caches' if warm else '',
+        ', sections' if climate.FETCH_SECTIONS else '')
+    print '%11s %8s %6s %8s %8s %8s %8s %8s' % ('concurrency', 'requests',
+        'errors', 'req/s', 'mean ms', 'p50 ms', 'p99 ms', 'KB')
+
+    try:
+        for concurrency in levels:
+            empty_caches()
+            if warm:
+                run_level(target, queries, concurrency)
+            app.bytes = 0
+
+            latencies, errors, seconds = run_level(target, queries,
+                concurrency)
+            latencies.sort()
+
+            print '%11d %8d %6d %8.1f %8.1f %8.1f %8.1f %8d' % (concurrency,
+                len(latencies), errors, len(latencies) / seconds,
+                sum(latencies) / len(latencies), percentile(latencies, 0.5),
+                percentile(latencies, 0.99), app.bytes // 1024)
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(cache.CACHE_DIR)
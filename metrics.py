@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+""" Counters, latency histograms and a log of recent events, for seeing
+where time goes (fetches, cache hits and misses, parsing, astronomy).
+
+Everything is bounded: counters and histograms are a fixed number of
+numbers each, and only the last EVENTS events are kept, so a
+long-running process can record forever.
+
+Recording goes to the aggregate registry, and also to the current
+request's, if one was started with request() in this thread (work
+handed to a workers pool counts towards the request that handed it
+over). Reports are plain text: report() for everything so far,
+request.report() for one request, export() to write to a file.
+
+Set ENABLED = False to turn recording off; the calls left in the code
+then return straight away. """
+
+from __future__ import unicode_literals
+import bisect
+import collections
+import os
+import tempfile
+import threading
+import time
+
+import workers
+
+ENABLED = True
+
+# upper bounds, in ms, of the histogram buckets
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000,
+    float('inf')]
+
+# recent events kept, in total and per request
+EVENTS = 1000
+REQUEST_EVENTS = 200
+
+class Histogram(object):
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, fraction):
+        # upper bound of the bucket the percentile falls in,
+        # or the maximum if that's lower
+        needed = fraction * self.count
+        seen = 0
+        for bound,count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= needed:
+                return min(bound, self.max)
+
+        return self.max
+
+    def format(self):
+        return 'n %d  mean %.1f  min %.1f  p50 <%.1f  p99 <%.1f  max %.1f' % (
+            self.count, self.total / self.count, self.min,
+            self.percentile(0.5), self.percentile(0.99), self.max)
+
+class Registry(object):
+    def __init__(self, events = EVENTS):
+        self.counters = collections.defaultdict(int)
+        self.histograms = collections.defaultdict(Histogram)
+        self.events = collections.deque(maxlen = events)
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def count(self, name, n, detail):
+        with self.lock:
+            self.counters[name] += n
+            self.events.append((time.time(), name, n, detail))
+
+    def observe(self, name, ms, detail):
+        with self.lock:
+            self.histograms[name].add(ms)
+            self.events.append((time.time(), name, ms, detail))
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.events.clear()
+            self.started = time.time()
+
+    def report(self, events = 0):
+        """ Counters and histograms as text, followed by up to events of
+        the most recent events. """
+
+        with self.lock:
+            lines = ['over %.1f s' % (time.time() - self.started)]
+
+            if self.counters:
+                lines.append('counters:')
+                lines += ['  %s: %d' % item
+                    for item in sorted(self.counters.items())]
+
+            if self.histograms:
+                lines.append('timings, ms:')
+                lines += ['  %s: %s' % (name, histogram.format())
+                    for name,histogram in sorted(self.histograms.items())]
+
+            recent = list(self.events)[-events:] if events > 0 else []
+
+        if recent:
+            lines.append('recent:')
+            lines += ['  %+.3f s %s %s%s' % (timestamp - self.started, name,
+                value if isinstance(value, int) else '%.1f ms' % value,
+                '' if detail is None else ' (%s)' % detail)
+                for timestamp,name,value,detail in recent]
+
+        return '\n'.join(lines)
+
+registry = Registry()
+
+# the request being recorded in this thread, if any
+local = threading.local()
+
+def current_request():
+    return getattr(local, 'request', None)
+
+def set_request(request):
+    local.request = request
+
+# jobs run by workers pools record into the request that created them
+workers.carry(current_request, set_request)
+
+class request(object):
+    """ Record a request's metrics separately too, as well as in the
+    aggregate registry:
+        with metrics.request() as r:
+            ...
+        print r.report(events = 50) """
+
+    def __enter__(self):
+        self.registry = Registry(REQUEST_EVENTS)
+        self.previous = current_request()
+        set_request(self.registry)
+        return self.registry
+
+    def __exit__(self, *exc_info):
+        set_request(self.previous)
+
+def count(name, n = 1, detail = None):
+    if not ENABLED:
+        return
+
+    registry.count(name, n, detail)
+    current = current_request()
+    if current is not None:
+        current.count(name, n, detail)
+
+def observe(name, ms, detail = None):
+    """ Record a time in ms in the histogram called name. """
+
+    if not ENABLED:
+        return
+
+    registry.observe(name, ms, detail)
+    current = current_request()
+    if current is not None:
+        current.observe(name, ms, detail)
+
+def report(events = 0):
+    return registry.report(events)
+
+def clear():
+    registry.clear()
+
+def export(path, events = EVENTS):
+    """ Write the aggregate report to path, replacing it whole, so that
+    something else can read it at any time. """
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd,temp_file_name = tempfile.mkstemp(dir = directory)
+
+    f = os.fdopen(fd, 'w')
+    f.write(report(events).encode('utf-8') + b'\n')
+    f.close()
+
+    os.chmod(temp_file_name, 0o644)
+    os.rename(temp_file_name, path)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+""" Serve climate data as JSON over HTTP.
+
+usage: server.py [-p port] [--offline cache_dir] [--profile ms] [--sections]
+    [--changefeed api|file] [--cache-days days]
+
+Runs as a long-lived process, so pages cached in memory stay warm between
+requests, and each request is handled in its own thread. The WSGI app
+(application) can also be run under any other WSGI server.
+
+Endpoints (GET):
+    /climate?place=Toronto[&units=F]
+        climate.get_climate_data() for one place
+    /compare?place=Toronto&place=Sydney&month=1&month=7&category=high C
+        [&units=F]
+        climate.get_comparison_data(); months are numbered 1-12, in the
+        result they're keyed 0-11 as in get_comparison_data()
+    /query?q=toronto sydney high march
+        climate.parse_text_query() on the words of q, including the
+        data of the cities found
+    /metrics[?events=20]
+        counters, timings (ms) and the most recent events since the
+        server started, as plain text (see metrics.py)
+
+With --offline, pages are served only from the given cache directory
+(e.g. one filled by earlier runs) and Wikipedia is never contacted,
+which is useful for load testing.
+
+With --sections, only the lead and climate sections of pages are
+downloaded (see climate.FETCH_SECTIONS).
+
+With --changefeed, cached pages are cleared as they change on Wikipedia,
+following its recent changes ("api") or a file of changes (see
+changefeed.py), so --cache-days can be set far longer than the default
+cache.CACHE_PERIOD_DAYS.
+
+With --profile, requests that take longer than the given number of ms
+have a cProfile profile saved, see spans.py; each is counted in
+server.slow_request, and listed with its file in /metrics?events=N. """
+
+from __future__ import unicode_literals
+import json
+import SocketServer
+import sys
+import traceback
+import urlparse
+from wsgiref.simple_server import make_server, WSGIServer
+
+import cache
+import changefeed
+import climate
+import metrics
+import spans
+import units
+
+DEFAULT_PORT = 8080
+
+class BadRequest(ValueError):
+    pass
+
+class ThreadingWSGIServer(SocketServer.ThreadingMixIn, WSGIServer):
+    # don't wait for requests in progress when shutting down
+    daemon_threads = True
+
+def get_params(params, name, required = True):
+    values = [value.decode('utf-8') for value in params.get(name, [])]
+
+    if required and len(values) == 0:
+        raise BadRequest('missing parameter: %s' % name)
+
+    return values
+
+def get_units(params):
+    display_units = []
+    for unit in get_params(params, 'units', False):
+        if unit.lower() not in units.UNIT_ALIASES:
+            raise BadRequest('unknown unit: %s' % unit)
+        display_units.append(units.UNIT_ALIASES[unit.lower()])
+
+    return display_units
+
+def climate_data(params):
+    data = climate.get_climate_data(get_params(params, 'place')[0])
+
+    display_units = get_units(params)
+    if display_units and data['page_error'] is False:
+        data = climate.convert_data(data, display_units)
+
+    return json.loads(climate.data_as_json(data))
+
+def comparison_data(params):
+    places = get_params(params, 'place')
+
+    months = [False] * climate.NUM_MONTHS
+    for month in get_params(params, 'month'):
+        try:
+            months[int(month) - 1] = True
+        except (ValueError, IndexError):
+            raise BadRequest('invalid month: %s' % month)
+
+    categories = dict((row_name, False) for row_name in climate.ROWS)
+    for category in get_params(params, 'category'):
+        if category not in categories:
+            raise BadRequest('unknown category: %s' % category)
+        categories[category] = True
+
+    return climate.get_comparison_data(places, months, categories,
+        get_units(params))
+
+def text_query(params):
+    strings = [s.encode('utf-8') for s in get_params(params, 'q')[0].split()]
+    result = climate.parse_text_query(strings)
+
+    # records may hold objects that aren't JSON (see data_as_json)
+    result['data'] = dict((city, json.loads(climate.data_as_json(record)))
+        for city,record in result['data'].items())
+
+    return result
+
+def metrics_report(params):
+    # plain text rather than JSON
+    try:
+        events = int(get_params(params, 'events', False)[0])
+    except IndexError:
+        events = 0
+    except ValueError:
+        raise BadRequest('events should be a number')
+
+    return metrics.report(events)
+
+ENDPOINTS = {
+    '/climate': climate_data,
+    '/compare': comparison_data,
+    '/query': text_query,
+    '/metrics': metrics_report
+}
+
+def application(environ, start_response):
+    path = environ.get('PATH_INFO', '/')
+    params = urlparse.parse_qs(environ.get('QUERY_STRING', ''))
+
+    if path not in ENDPOINTS:
+        status = b'404 Not Found'
+        result = {'error': 'unknown path, try one of: %s'
+            % ', '.join(sorted(ENDPOINTS))}
+    else:
+        try:
+            with spans.request('server' + path) as root:
+                result = ENDPOINTS[path](params)
+            status = b'200 OK'
+
+            if root.profile is not None:
+                metrics.count('server.slow_request', detail = '%s?%s, '
+                    'profile saved to %s' % (path,
+                    environ.get('QUERY_STRING', ''), root.profile))
+        except BadRequest as e:
+            status = b'400 Bad Request'
+            result = {'error': unicode(e)}
+        except Exception as e:
+            traceback.print_exc()
+            status = b'500 Internal Server Error'
+            result = {'error': '%s: %s' % (e.__class__.__name__, e)}
+
+    if isinstance(result, unicode):
+        content_type = b'text/plain; charset=utf-8'
+        body = result
+    else:
+        content_type = b'application/json'
+        body = json.dumps(result, sort_keys = True)
+
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+
+    start_response(status, [(b'Content-Type', content_type),
+        (b'Content-Length', str(len(body)))])
+
+    return [body]
+
+def serve(port = DEFAULT_PORT, host = ''):
+    server = make_server(host, port, application,
+        server_class = ThreadingWSGIServer)
+
+    print 'serving on port %d' % port
+    server.serve_forever()
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    port = DEFAULT_PORT
+    if '-p' in args:
+        port = int(args[args.index('-p') + 1])
+
+    if '--offline' in args:
+        cache.OFFLINE = True
+        cache.CACHE_DIR = args[args.index('--offline') + 1]
+
+    if '--sections' in args:
+        climate.FETCH_SECTIONS = True
+
+    if '--profile' in args:
+        spans.PROFILE_THRESHOLD = float(args[args.index('--profile') + 1])
+
+    if '--cache-days' in args:
+        cache.CACHE_PERIOD_DAYS = float(args[args.index('--cache-days') + 1])
+        climate.resolutions.ttl = cache.CACHE_PERIOD_DAYS * 24 * 3600
+
+    if '--changefeed' in args:
+        changefeed.from_setting(args[args.index('--changefeed') + 1]).start()
+
+    serve(port)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+""" Nested timing spans, for seeing which stage of a lookup was slow:
+the fetch, json.loads, find_template, remove_comments, the separate
+weatherbox template, or the percentsun astronomy.
+
+    with spans.span('parse', place):
+        ...
+
+Every span's (and trace's) time is recorded in the metrics histogram of
+its name (see metrics.py). With metrics.ENABLED = False, spans outside a
+trace do nothing at all, not even look at the clock. While a trace is being taken in the thread, started with
+spans.trace(), spans also make a tree that can be printed afterwards:
+
+    with spans.trace('query') as root:
+        ...
+    print root.format()
+
+Work handed to a workers pool is traced under the span that handed it
+over, so pages fetched concurrently show up side by side.
+
+Slow requests can also be profiled: with PROFILE_THRESHOLD set (in ms),
+request() runs cProfile over the request's thread and saves the profile
+to PROFILE_DIR if the request took longer than that. Open the files with
+pstats (python -m pstats file). Only the request's own thread is
+profiled, so time spent in pool workers shows up as waiting. """
+
+from __future__ import unicode_literals
+import os
+import re
+import tempfile
+import threading
+import time
+
+import metrics
+import workers
+
+# ms a request has to take for its profile to be saved, None to not profile
+PROFILE_THRESHOLD = None
+PROFILE_DIR = os.path.join('cache_data', 'profiles')
+
+class Span(object):
+    def __init__(self, name, detail = None):
+        self.name = name
+        self.detail = detail
+        self.children = []
+        self.start = None
+        self.end = None
+
+    def duration(self):
+        # in ms; for a span not ended yet, so far
+        end = self.end if self.end is not None else time.time()
+        return (end - self.start) * 1000.0
+
+    def format(self, start = None, indent = 0):
+        """ The span and its children as an indented tree of lines:
+        ms since the outermost span started, ms taken, name and detail. """
+
+        if start is None:
+            start = self.start
+
+        lines = ['%8.1f %8.1f  %s%s%s' % ((self.start - start) * 1000.0,
+            self.duration(), '  ' * indent, self.name,
+            '' if self.detail is None else ' (%s)' % self.detail)]
+
+        # children from several workers may have been added in any order
+        for child in sorted(self.children, key = lambda child: child.start):
+            lines.append(child.format(start, indent + 1))
+
+        return '\n'.join(lines)
+
+# the innermost span of the trace being taken in this thread, if any
+local = threading.local()
+
+def current_span():
+    return getattr(local, 'span', None)
+
+def set_span(span):
+    local.span = span
+
+workers.carry(current_span, set_span)
+
+class NullSpan(object):
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Timing(object):
+    # a block timed by span(), see there
+
+    def __init__(self, name, detail = None):
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.parent = current_span()
+
+        if self.parent is None:
+            self.span = None
+            self.start = time.time()
+        else:
+            self.span = Span(self.name, self.detail)
+            self.span.start = self.start = time.time()
+            # list.append is atomic, so workers can add children at once
+            self.parent.children.append(self.span)
+            set_span(self.span)
+
+        return self.span
+
+    def __exit__(self, *exc_info):
+        end = time.time()
+
+        if self.span is not None:
+            self.span.end = end
+            set_span(self.parent)
+
+        metrics.observe(self.name, (end - self.start) * 1000.0, self.detail)
+
+def span(name, detail = None):
+    """ Time a block, as a child of the current span if there is one. """
+
+    if not metrics.ENABLED and current_span() is None:
+        # nothing would be recorded
+        return NULL_SPAN
+
+    return Timing(name, detail)
+
+class trace(object):
+    """ Take a trace: spans inside the block make a tree under the
+    returned root span. Inside another trace, it's just a span. """
+
+    def __init__(self, name, detail = None):
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.previous = current_span()
+
+        self.root = Span(self.name, self.detail)
+        self.root.start = time.time()
+        if self.previous is not None:
+            self.previous.children.append(self.root)
+        set_span(self.root)
+
+        return self.root
+
+    def __exit__(self, *exc_info):
+        self.root.end = time.time()
+        set_span(self.previous)
+
+        metrics.observe(self.name, self.root.duration(), self.detail)
+
+class request(trace):
+    """ A trace of one request, which is also profiled if PROFILE_THRESHOLD
+    is set. root.profile is the saved profile's file name, if it was slow
+    enough to save one. """
+
+    def __enter__(self):
+        root = trace.__enter__(self)
+        root.profile = None
+
+        self.profiler = None
+        if PROFILE_THRESHOLD is not None:
+            # imported here, as only profiled requests need it
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        return root
+
+    def __exit__(self, *exc_info):
+        if self.profiler is not None:
+            self.profiler.disable()
+
+        trace.__exit__(self, *exc_info)
+
+        if self.profiler is not None \
+                and self.root.duration() > PROFILE_THRESHOLD:
+            self.root.profile = save_profile(self.profiler, self.name)
+
+def save_profile(profiler, name):
+    # name-time-random.prof in PROFILE_DIR; returns the file name
+    if not os.path.exists(PROFILE_DIR):
+        os.makedirs(PROFILE_DIR)
+
+    prefix = '%s-%s-' % (re.sub(r'[^\w.-]+', '_', name)[:50],
+        time.strftime('%Y%m%d-%H%M%S'))
+    fd,file_name = tempfile.mkstemp(suffix = '.prof', prefix = prefix,
+        dir = PROFILE_DIR)
+    os.close(fd)
+
+    profiler.dump_stats(file_name)
+    os.chmod(file_name, 0o644)
+
+    return file_name
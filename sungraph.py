@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+""" Graph sunrise and sunset times and the sun's height in the sky over
+a year, as SVG.
+
+usage: sungraph.py <place> [times|elevation] [utc offset] > graph.svg
+
+Graphs are cached on disk by location and parameters, so repeat requests
+are served from a file without computing or rendering anything. Cached
+graphs have no title, as every name for a place shares them; the title
+is put in as they're served. """
+
+from __future__ import unicode_literals
+import codecs
+import glob
+import math
+import os
+import sys
+import tempfile
+
+import numpy
+
+import astrodata
+import cache
+import climate
+
+GRAPH_DIR = 'graphs'
+GRAPH_FILE = 'sungraph_%s.svg'
+
+# bump when the output changes, so old cached graphs aren't used
+GRAPH_VERSION = 2
+
+KINDS = ['times', 'elevation']
+
+WIDTH = 760
+HEIGHT = 320
+MARGIN_LEFT = 40
+MARGIN_RIGHT = 10
+MARGIN_TOP = 30
+MARGIN_BOTTOM = 25
+
+DAYLIGHT_COLOUR = '#f6d55c'
+NOON_COLOUR = '#ed553b'
+ELEVATION_COLOUR = '#3caea3'
+GRID_COLOUR = '#cccccc'
+
+def get_file_name(key):
+    return os.path.join(cache.CACHE_DIR, GRAPH_DIR, GRAPH_FILE % key)
+
+def graph_key(lat, lon, kind, utc_offset):
+    # rounded to about 100 m, which doesn't change anything visible
+    return '%d_%.3f_%.3f_%s_%s' % (GRAPH_VERSION, lat, lon, kind,
+        'lmt' if utc_offset is None else '%g' % utc_offset)
+
+TITLE_ELEMENT = '<text x="%d" y="18" font-size="14">%%s</text>' % MARGIN_LEFT
+
+def svg_document(title, elements):
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" '
+        'font-family="sans-serif" font-size="11">\n'
+        '<rect width="100%%" height="100%%" fill="white"/>\n%s\n%s\n</svg>\n'
+        % (WIDTH, HEIGHT, TITLE_ELEMENT % escape(title), '\n'.join(elements)))
+
+def with_title(svg, title):
+    # an svg_document() rendered without a title, with title put in
+    return svg.replace(TITLE_ELEMENT % '', TITLE_ELEMENT % escape(title), 1)
+
+def escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def axes(days, y_min, y_max, y_ticks, y_label):
+    """ Return functions mapping day and y value to SVG coordinates, and
+    the grid, month and y axis label elements. """
+
+    plot_width = WIDTH - MARGIN_LEFT - MARGIN_RIGHT
+    plot_height = HEIGHT - MARGIN_TOP - MARGIN_BOTTOM
+
+    def x(day):
+        return MARGIN_LEFT + plot_width * day / float(days)
+
+    def y(value):
+        return MARGIN_TOP + plot_height * (y_max - value) / float(y_max - y_min)
+
+    elements = []
+    for tick in y_ticks:
+        elements.append('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" '
+            'stroke="%s"/>' % (x(0), y(tick), x(days), y(tick), GRID_COLOUR))
+        elements.append('<text x="%.1f" y="%.1f" text-anchor="end">%s</text>'
+            % (x(0) - 4, y(tick) + 4, y_label(tick)))
+
+    for month,first_day in enumerate(astrodata.month_start_days()):
+        elements.append('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" '
+            'stroke="%s"/>' % (x(first_day), y(y_min), x(first_day),
+            y(y_max), GRID_COLOUR))
+        elements.append('<text x="%.1f" y="%.1f">%s</text>' % (
+            x(first_day) + 3, HEIGHT - 8, climate.MONTHS[month]))
+
+    return x, y, elements
+
+def polyline(points, colour):
+    # split into separate lines where there's no value (NaN)
+    lines = []
+    current = []
+    for point in points + [(None, float('nan'))]:
+        if math.isnan(point[1]):
+            if len(current) > 1:
+                lines.append(current)
+            current = []
+        else:
+            current.append(point)
+
+    return ['<polyline fill="none" stroke="%s" stroke-width="1.5" '
+        'points="%s"/>' % (colour, ' '.join('%.1f,%.1f' % p for p in line))
+        for line in lines]
+
+def render_times(sun, title):
+    """ Sunrise and sunset times as a band of daylight over the year,
+    with solar noon marked. """
+
+    days = len(sun['daylight'])
+    x, y, elements = axes(days, 0, 24, range(0, 25, 3),
+        lambda hour: '%02d:00' % hour)
+
+    for day in range(days):
+        sunrise = sun['sunrise'][day]
+        sunset = sun['sunset'][day]
+
+        if numpy.isnan(sunrise) or numpy.isnan(sunset):
+            if sun['daylight'][day] < 24:
+                continue  # polar night
+            sunrise, sunset = 0, 24  # polar day
+
+        # clock times can spill into the previous or next day
+        sunrise = max(0, sunrise)
+        sunset = min(24, sunset)
+
+        elements.append('<rect x="%.1f" y="%.1f" width="%.2f" height="%.1f" '
+            'fill="%s"/>' % (x(day), y(sunset), x(day + 1) - x(day),
+            y(sunrise) - y(sunset), DAYLIGHT_COLOUR))
+
+    elements += polyline([(x(day + 0.5), y(hour))
+        for day,hour in enumerate(sun['solar_noon'])], NOON_COLOUR)
+
+    return svg_document(title, elements)
+
+def render_elevation(sun, title):
+    """ The sun's elevation above the horizon at solar noon. """
+
+    days = len(sun['max_elevation'])
+    x, y, elements = axes(days, -30, 90, range(-30, 91, 15),
+        lambda degrees: '%d°' % degrees)
+
+    elements.append('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" '
+        'stroke="black"/>' % (x(0), y(0), x(days), y(0)))
+
+    # sun can be up to 23.5° below the horizon at noon in polar night
+    elements += polyline([(x(day + 0.5), y(max(-30, elevation)))
+        for day,elevation in enumerate(sun['max_elevation'])],
+        ELEVATION_COLOUR)
+
+    return svg_document(title, elements)
+
+def render(lat, lon, kind = 'times', utc_offset = None, title = ''):
+    if kind not in KINDS:
+        raise ValueError('unknown graph: %s' % kind)
+
+    sun = astrodata.analytic_year_sun(lat, lon, utc_offset = utc_offset)
+
+    if kind == 'times':
+        return render_times(sun, title)
+    else:
+        return render_elevation(sun, title)
+
+def get_graph(place, kind = 'times', utc_offset = None):
+    """ Return an SVG graph for place (anything astrodata.process_location
+    understands), rendering it only if it isn't cached yet. Raises
+    ValueError if place can't be found. """
+
+    lat_lon = astrodata.location_lat_lon(place)
+    if lat_lon is None:
+        raise ValueError('unknown place: %s' % place)
+
+    lat, lon = lat_lon
+    lat = round(lat, 3)
+    lon = round(lon, 3)
+
+    file_name = get_file_name(graph_key(lat, lon, kind, utc_offset))
+
+    if kind == 'times':
+        title = 'Sunrise and sunset'
+    else:
+        title = 'Height of the sun at noon'
+    if isinstance(place, basestring):
+        title += ' in ' + place
+
+    if os.path.exists(file_name):
+        f = codecs.open(file_name, 'r', 'utf-8')
+        svg = f.read()
+        f.close()
+        return with_title(svg, title)
+
+    # without the title: the same graph is used for any name of the place
+    svg = render(lat, lon, kind, utc_offset)
+
+    if not os.path.exists(os.path.dirname(file_name)):
+        os.makedirs(os.path.dirname(file_name))
+
+    # write to a temporary name first so concurrent readers
+    # never see a partial file
+    fd,temp_file_name = tempfile.mkstemp(dir = os.path.dirname(file_name))
+    f = codecs.getwriter('utf-8')(os.fdopen(fd, 'w'))
+    f.write(svg)
+    f.close()
+    # mkstemp makes files only we can read
+    os.chmod(temp_file_name, 0o644)
+    os.rename(temp_file_name, file_name)
+
+    return with_title(svg, title)
+
+def clear_all():
+    graphs = glob.glob(get_file_name('*'))
+
+    for graph in graphs:
+        os.remove(graph)
+
+    return graphs
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+
+    place = sys.argv[1].decode('utf-8')
+
+    kind = 'times'
+    if len(sys.argv) > 2:
+        kind = sys.argv[2]
+
+    utc_offset = None
+    if len(sys.argv) > 3:
+        utc_offset = float(sys.argv[3])
+
+    try:
+        svg = get_graph(place, kind, utc_offset)
+    except ValueError as e:
+        print >> sys.stderr, e
+        sys.exit(1)
+
+    sys.stdout.write(svg.encode('utf-8'))
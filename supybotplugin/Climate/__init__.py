@@ -17,6 +17,8 @@ __contributors__ = {}
 __url__ = 'https://github.com/qviri/climate-graph'
 
 import config
+import climate
+reload(climate) # plugin.py only imports it once, so reload it here too
 import plugin
 reload(plugin) # In case we're being reloaded.
 # Add more reloads here if you add third-party modules and want them to be
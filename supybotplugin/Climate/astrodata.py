@@ -0,0 +1 @@
+../../astrodata.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../changefeed.py
\ No newline at end of file
@@ -11,3 +11,76 @@ def configure(advanced):
 
 Climate = conf.registerPlugin('Climate')
 
+conf.registerGlobalValue(Climate, 'datasetPath',
+    registry.String('', """Path (without extension) of a climate dataset
+    written by dataset.py. If set, it is memory-mapped at load and used
+    to answer queries for the places it contains without fetching or
+    parsing their pages."""))
+
+conf.registerGlobalValue(Climate, 'gazetteerPath',
+    registry.String('', """Path of a page title index written by
+    gazetteer.py. If set, it is loaded at startup and place names in
+    queries are resolved with it, asking Wikipedia only about names it
+    doesn't know."""))
+
+conf.registerGlobalValue(Climate, 'workers',
+    registry.PositiveInteger(4, """Number of requests worked on at once.
+    Requests are handled outside the bot's main thread, so a slow one
+    doesn't hold up the bot. Takes effect when the plugin is reloaded."""))
+
+conf.registerGlobalValue(Climate, 'queueSize',
+    registry.NonNegativeInteger(10, """Number of requests that can wait
+    for a free worker. Further requests get a busy reply rather than
+    waiting. 0 means no limit. Takes effect when the plugin is reloaded."""))
+
+conf.registerGlobalValue(Climate, 'timeout',
+    registry.PositiveInteger(30, """Seconds to wait for a request's answer
+    before replying that it took too long. The request is still finished
+    in the background, so pages it fetched are cached for next time."""))
+
+conf.registerGlobalValue(Climate, 'replyCacheSize',
+    registry.NonNegativeInteger(500, """Number of replies to `get` kept in
+    memory, so repeated queries are answered without working them out
+    again. 0 turns this off. Takes effect when the plugin is reloaded."""))
+
+conf.registerGlobalValue(Climate, 'replyCacheTime',
+    registry.PositiveInteger(3600, """Seconds a remembered reply is used
+    for. Replies are also dropped as soon as a page they were made from is
+    downloaded again. Takes effect when the plugin is reloaded."""))
+
+conf.registerGlobalValue(Climate, 'metricsFile',
+    registry.String('', """File to write counters and timings to after
+    each request (see metrics.py), e.g. for watching where time goes.
+    Empty means don't write one."""))
+
+conf.registerGlobalValue(Climate, 'profileThreshold',
+    registry.NonNegativeInteger(0, """Requests taking longer than this many
+    ms have a cProfile profile saved in cache_data/profiles (see spans.py).
+    0 turns profiling off. Takes effect when the plugin is reloaded."""))
+
+conf.registerGlobalValue(Climate, 'fetchSections',
+    registry.Boolean(False, """Download only the lead and climate sections
+    of Wikipedia articles rather than whole articles: less to download and
+    parse, but three requests a page rather than one. Takes effect when the
+    plugin is reloaded."""))
+
+conf.registerGlobalValue(Climate, 'changeFeed',
+    registry.String('', """Follow changes to Wikipedia pages, clearing
+    cached pages as they change (see changefeed.py): "api" for Wikipedia's
+    recent changes, or the path of a file of changes. Empty turns this off.
+    Takes effect when the plugin is reloaded."""))
+
+conf.registerGlobalValue(Climate, 'changeFeedInterval',
+    registry.PositiveInteger(60, """Seconds between reading the changes
+    followed with changeFeed. Takes effect when the plugin is reloaded."""))
+
+conf.registerGlobalValue(Climate, 'changeFeedRefresh',
+    registry.Boolean(False, """Download changed pages again straight away,
+    rather than when they're next asked for. Takes effect when the plugin
+    is reloaded."""))
+
+conf.registerGlobalValue(Climate, 'cachePeriodDays',
+    registry.PositiveInteger(7, """Days that downloaded pages are used for
+    before being downloaded again. Can be far longer with changeFeed set,
+    as changed pages are then cleared as soon as they change. Takes effect
+    when the plugin is reloaded."""))
@@ -0,0 +1 @@
+../../dataset.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../gazetteer.py
\ No newline at end of file
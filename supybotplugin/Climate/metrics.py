@@ -0,0 +1 @@
+../../metrics.py
\ No newline at end of file
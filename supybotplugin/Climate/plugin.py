@@ -8,6 +8,43 @@ import supybot.ircutils as ircutils
 import supybot.callbacks as callbacks
 
 import calendar
+import threading
+
+import cache
+import changefeed
+import climate
+import metrics
+import spans
+import workers
+
+MSG_BUSY = 'Busy with other requests, try again in a bit.'
+MSG_TIMEOUT = 'That is taking too long, sorry. Try again in a bit: ' \
+    'some of the data may be ready by then.'
+MSG_ERROR = 'An error occurred getting that data, sorry.'
+
+class OneReply(object):
+    """ Replies to a request exactly once: with the answer if it comes
+    within timeout seconds, otherwise with MSG_TIMEOUT. """
+
+    def __init__(self, irc, timeout):
+        self.irc = irc
+        self.lock = threading.Lock()
+        self.replied = False
+
+        self.timer = threading.Timer(timeout, self.reply, [MSG_TIMEOUT])
+        self.timer.daemon = True
+        self.timer.start()
+
+    def reply(self, response):
+        with self.lock:
+            if self.replied:
+                return False
+            self.replied = True
+
+        self.timer.cancel()
+        self.irc.reply(response.encode('utf-8'), prefixNick = False)
+
+        return True
 
 class Climate(callbacks.Plugin):
     """ Supybot -> climate.py interface. `get` is the main function. """
@@ -16,6 +53,8 @@ class Climate(callbacks.Plugin):
     - climate missing: copy or create a link to climate.py in the Climate 
     plugin directory (where plugin.py, __init.py__, config.py also live)
     - cache missing: same as above, only for cache.py
+    - astrodata missing: same again; only loaded for pages that give
+    sunshine as percent of daylight, and needs pyephem and numpy
 
     - unicode blargs in callbacks.py in irc.reply():
     older versions of supybot don't like unicode replies.
@@ -30,6 +69,50 @@ class Climate(callbacks.Plugin):
             s = str(s) # Allow non-string esses.
     """
 
+    def __init__(self, irc):
+        self.__parent = super(Climate, self)
+        self.__parent.__init__(irc)
+
+        dataset_path = self.registryValue('datasetPath')
+        if dataset_path:
+            climate.use_dataset(dataset_path)
+
+        gazetteer_path = self.registryValue('gazetteerPath')
+        if gazetteer_path:
+            climate.use_gazetteer(gazetteer_path)
+
+        climate.FETCH_SECTIONS = self.registryValue('fetchSections')
+
+        cache.CACHE_PERIOD_DAYS = self.registryValue('cachePeriodDays')
+        climate.resolutions.ttl = cache.CACHE_PERIOD_DAYS * 24 * 3600
+
+        profile_threshold = self.registryValue('profileThreshold')
+        spans.PROFILE_THRESHOLD = profile_threshold or None
+
+        # requests are worked on here rather than in the bot's main thread
+        self.pool = workers.Pool(self.registryValue('workers'),
+            self.registryValue('queueSize'))
+
+        # replies by query, see _get_response
+        self.replies = cache.LRUCache(self.registryValue('replyCacheSize'),
+            self.registryValue('replyCacheTime'))
+
+        # clears cached pages as they change on Wikipedia
+        self.poller = None
+        change_feed = self.registryValue('changeFeed')
+        if change_feed:
+            self.poller = changefeed.from_setting(change_feed,
+                self.registryValue('changeFeedInterval'),
+                self.registryValue('changeFeedRefresh'))
+            self.poller.start()
+
+    def die(self):
+        # workers finish what they're doing, then exit
+        self.pool.shutdown()
+        if self.poller is not None:
+            self.poller.stop()
+        self.__parent.die()
+
     def get(self, irc, msg, args, strings):
         """ <text> (including <places>, <months>, <categories>)
         Gets climate data for <places> during <months> for <categories>.
@@ -39,15 +122,85 @@ class Climate(callbacks.Plugin):
         Get the list of recognized <categories> with `@climate categories`.
         Places, months, and categories can be mixed within <text> in any order.
         Unrecognized words will be silently ignored (this means you can write
-        e.g. "Toronto and Sydney high for December"). """
-
-        import climate
+        e.g. "Toronto and Sydney high for December").
+        Units such as F or inch can be given to convert data for display
+        (e.g. "Toronto high July in F"). """
+
+        reply = OneReply(irc, self.registryValue('timeout'))
+
+        def finished(job):
+            try:
+                response = job.result()
+            except Exception:
+                self.log.exception('Climate: error answering %r', strings)
+                response = MSG_ERROR
+
+            # an exception here would take the worker thread down with it
+            try:
+                reply.reply(response)
+            except Exception:
+                self.log.exception('Climate: error replying to %r', strings)
+
+        try:
+            self.pool.put(workers.Job(self._get_response, (strings,), finished),
+                block = False)
+        except workers.Full:
+            reply.reply(MSG_BUSY)
+
+    def _get_response(self, strings):
+        # the reply to `get`, run in a pool worker, with what it took
+        # logged at debug level and written to metricsFile if set
+        with metrics.request() as request:
+            with spans.request('get', ' '.join(strings)) as root:
+                response = self._remembered_response(strings)
+
+        self.log.debug('Climate: %r\n%s\n%s', strings, root.format(),
+            request.report(events = 50))
+
+        if root.profile is not None:
+            self.log.info('Climate: %r took %.0f ms, profile saved to %s',
+                strings, root.duration(), root.profile)
+
+        metrics_file = self.registryValue('metricsFile')
+        if metrics_file:
+            try:
+                metrics.export(metrics_file)
+            except EnvironmentError:
+                self.log.exception('Climate: could not write %s', metrics_file)
+
+        return response
+
+    def _remembered_response(self, strings):
+        # replies are remembered by what the query asks for, along with
+        # the times the cities' pages and their weatherbox templates were
+        # downloaded, so they're worked out again once any of those pages
+        # are downloaded again.
 
         query = climate.parse_text_query(strings)
 
+        key = (tuple(query['cities']), tuple(query['months']),
+            tuple(sorted(category for category,include
+                in query['categories'].items() if include)),
+            tuple(query['units']))
+        mtimes = [climate.page_mtimes(city, query['data'].get(city))
+            for city in query['cities']]
+
+        remembered = self.replies.get(key)
+        if remembered is not None and remembered[1] == mtimes:
+            metrics.count('reply.remembered')
+            return remembered[0]
+
+        response = self._make_response(query)
+
+        self.replies.set(key, (response, mtimes))
+
+        return response
+
+    def _make_response(self, query):
         cities = query['cities']
         months = query['months']
         categories = query['categories']
+        display_units = query['units']
 
         has_category = False
         has_month = False
@@ -64,7 +217,8 @@ class Climate(callbacks.Plugin):
             has_category = True
 
         if has_month is True:
-            data = climate.get_comparison_data(cities, months, categories)
+            data = climate.get_comparison_data(cities, months, categories,
+                display_units, query['data'])
         elif len(cities) == 2:
             # get data for all, and pick most interesting one automagically
             # criterion is biggest difference between the numerical values
@@ -77,7 +231,8 @@ class Climate(callbacks.Plugin):
             for i in range(len(months)):
                 months[i] = True
 
-            data = climate.get_comparison_data(cities, months, categories)
+            data = climate.get_comparison_data(cities, months, categories,
+                display_units, query['data'])
 
             # get cities' names directly from data - they are likely 
             # different than in request (capitalization, redirects, etc)
@@ -157,8 +312,8 @@ October: Toronto high 10, low 5, Melbourne high 20, low 12; April: Toronto high
                 category_lines = []
                 for category,category_data in city_data.items():
                     if category in climate.PRINTED_ROW_TITLES:
-                        category_lines.append(
-                            climate.PRINTED_ROW_TITLES[category]
+                        category_lines.append(climate.row_title(category,
+                            climate.display_unit(category, display_units))
                             + ' ' + str(int(round(category_data, 0))))
 
                 city_line += ', '.join(category_lines)
@@ -174,21 +329,19 @@ October: Toronto high 10, low 5, Melbourne high 20, low 12; April: Toronto high
             response = output
         elif len(cities) == 1 and 'location' in categories \
             and categories['location'] == True:
-            data = climate.get_climate_data(cities[0])
+            data = query['data'][cities[0]]
             if 'location' in data and len(data['location']) > 0:
                 response = data['title'] + ': ' + data['location']
         
         if len(response) == 0:
             response = 'No data found or invalid query. Try @help climate get.'
 
-        irc.reply(response.encode('utf-8'), prefixNick = False)
+        return response
 
     def categories(self, irc, msg, args):
         """ <none>
         Prints the climate categories recognized by `@climate get` """
 
-        import climate
-
         result = 'Supported categories: '
         cats = []
 
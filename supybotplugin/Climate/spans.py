@@ -0,0 +1 @@
+../../spans.py
\ No newline at end of file
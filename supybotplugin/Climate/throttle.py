@@ -0,0 +1 @@
+../../throttle.py
\ No newline at end of file
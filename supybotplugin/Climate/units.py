@@ -0,0 +1 @@
+../../units.py
\ No newline at end of file
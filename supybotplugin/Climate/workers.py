@@ -0,0 +1 @@
+../../workers.py
\ No newline at end of file
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import unicode_literals
+import math
+import time
+import unittest
+import datetime
+
+import ephem
+import numpy
+
+import astrodata
+
+# latitude, longitude pairs: Singapore, Sydney, Toronto, Helsinki, Reykjavik
+TEST_LOCATIONS = [[1.35, 103.8], [-33.87, 151.2], [43.7, -79.4],
+    [60.17, 24.94], [64.1, -21.9]]
+
+def ephem_day_hours(lat, lon, day_of_year):
+    # daylight for the local day, from ephem rise and set searches
+    # on either side of local noon
+    observer = ephem.Observer()
+    observer.lat = str(lat)
+    observer.lon = str(lon)
+    sun = ephem.Sun()
+
+    noon = ephem.Date(datetime.datetime(astrodata.YEAR, 1, 1, 12)) \
+        + day_of_year - lon / 360.0
+
+    return (observer.next_setting(sun, noon)
+        - observer.previous_rising(sun, noon)) * 24
+
+class analytic_daylight(unittest.TestCase):
+    def test_daily_against_ephem(self):
+        """ analytic day lengths should be within 3 minutes of ephem's
+        for every 5th day of the year """
+
+        for lat,lon in TEST_LOCATIONS:
+            daylight = astrodata.analytic_year_daylight(lat, lon)
+
+            for day in range(0, 365, 5):
+                self.assertAlmostEqual(daylight[day],
+                    ephem_day_hours(lat, lon, day), delta = 3 / 60.0)
+
+    def test_monthly_against_ephem(self):
+        """ month_daylight with the analytic method should be within
+        1% of the exact ephem method """
+
+        for location in TEST_LOCATIONS[1:3]:
+            for month in range(1, 13):
+                exact = astrodata.month_daylight(location, month,
+                    exact = True).total_seconds()
+                analytic = astrodata.month_daylight(location, month,
+                    method = 'analytic').total_seconds()
+
+                self.assertTrue(abs(exact - analytic) / exact < 0.01)
+
+    def test_table_against_ephem(self):
+        """ month_daylight with the table method should be within
+        the documented 1% of the exact ephem method """
+
+        for location in TEST_LOCATIONS:
+            for month in range(1, 13):
+                exact = astrodata.month_daylight(location, month,
+                    exact = True).total_seconds()
+                table = astrodata.month_daylight(location, month,
+                    method = 'table').total_seconds()
+
+                self.assertTrue(abs(exact - table) / exact < 0.01)
+
+    def test_polar(self):
+        """ polar day and polar night should give 24 and 0 hours """
+
+        # Longyearbyen, Svalbard
+        daylight = astrodata.analytic_year_daylight(78.2, 15.6)
+        self.assertEqual(daylight[0], 0)  # january 1
+        self.assertEqual(daylight[171], 24)  # june 21
+
+        for method in ['analytic', 'table']:
+            june = astrodata.month_daylight([78.2, 15.6], 6, method = method)
+            self.assertEqual(june, datetime.timedelta(days = 30))
+
+        # and at the poles themselves
+        self.assertEqual(astrodata.analytic_year_daylight(90)[171], 24)
+        self.assertEqual(astrodata.analytic_year_daylight(-90)[171], 0)
+
+    def test_sun_times(self):
+        """ analytic sunrise and sunset should agree with ephem's to
+        within a few minutes, and be missing in polar day and night """
+
+        lat, lon = TEST_LOCATIONS[2]
+        sun = astrodata.analytic_year_sun(lat, lon)
+        year = astrodata.year_daylight([lat, lon])
+
+        for day in range(0, 365, 5):
+            self.assertTrue(abs(sun['sunrise'][day] - year['sunrise'][day])
+                < 3 / 60.0)
+            self.assertTrue(abs(sun['sunset'][day] - year['sunset'][day])
+                < 3 / 60.0)
+
+        # noon is highest in june in the north
+        self.assertEqual(sun['max_elevation'].argmax() // 30, 5)
+
+        polar = astrodata.analytic_year_sun(78.2, 15.6)
+        self.assertTrue(numpy.isnan(polar['sunrise'][0]))
+        self.assertTrue(numpy.isnan(polar['sunset'][171]))
+        self.assertTrue(polar['max_elevation'][0] < 0)
+
+class ephem_daylight(unittest.TestCase):
+    def test_year_daylight(self):
+        """ whole-year daylight should agree with ephem searches around
+        local noon, and with its own sunrise and sunset times """
+
+        lat, lon = TEST_LOCATIONS[2]
+        year = astrodata.year_daylight([lat, lon])
+
+        self.assertEqual(len(year['daylight']), 365)
+
+        for day in range(0, 365, 5):
+            self.assertAlmostEqual(year['daylight'][day],
+                ephem_day_hours(lat, lon, day), places = 4)
+            self.assertAlmostEqual(year['daylight'][day],
+                year['sunset'][day] - year['sunrise'][day], places = 6)
+
+        monthly = astrodata.monthly_daylight([lat, lon])
+        self.assertAlmostEqual(monthly[6] * 3600, astrodata.month_daylight(
+            [lat, lon], 7, exact = True).total_seconds(), places = 3)
+
+    def test_polar_ephem(self):
+        """ the ephem method should handle days without sunrise or sunset """
+
+        # Tromsø
+        self.assertEqual(astrodata.month_daylight([69.65, 18.96], 6,
+            exact = True), datetime.timedelta(days = 30))
+        self.assertEqual(astrodata.month_daylight([69.65, 18.96], 12,
+            exact = True), datetime.timedelta(0))
+
+        self.assertEqual(astrodata.day_duration([69.65, 18.96],
+            datetime.date(astrodata.YEAR, 6, 21)), datetime.timedelta(1))
+
+    def test_memoized(self):
+        """ repeated month_daylight calls should be answered from memory,
+        and observers resolved from place names should be reused """
+
+        astrodata.month_daylights.clear()
+
+        first = astrodata.month_daylight([43.7, -79.4], 3, exact = True)
+        self.assertEqual(len(astrodata.month_daylights), 1)
+
+        second = astrodata.month_daylight([43.7001, -79.4001], 3, exact = True)
+        self.assertEqual(first, second)
+        self.assertEqual(len(astrodata.month_daylights), 1)
+
+        toronto = astrodata.process_location('Toronto')
+        self.assertTrue(astrodata.observers.get('Toronto') is not None)
+
+        # changing the returned observer should not change the cached one
+        toronto.date = datetime.datetime(2000, 1, 1)
+        self.assertNotEqual(astrodata.process_location('Toronto').date,
+            toronto.date)
+
+    def test_failed_lookup(self):
+        """ places that couldn't be looked up should be tried again
+        after a while, as the failure may have been temporary """
+
+        get_location_from_wikipedia = astrodata.get_location_from_wikipedia
+        ttl = astrodata.FAILED_LOOKUP_TTL
+
+        def unreachable(name):
+            raise IOError('Wikipedia is down')
+
+        astrodata.get_location_from_wikipedia = unreachable
+        astrodata.FAILED_LOOKUP_TTL = 0.05
+        try:
+            self.assertEqual(astrodata.process_location('Elmira, Ontario'),
+                False)
+
+            astrodata.get_location_from_wikipedia = \
+                lambda name: astrodata.process_location([43.6, -80.6])
+            self.assertEqual(astrodata.process_location('Elmira, Ontario'),
+                False)
+
+            time.sleep(0.1)
+            location = astrodata.process_location('Elmira, Ontario')
+            self.assertAlmostEqual(math.degrees(location.lat), 43.6, 5)
+        finally:
+            astrodata.get_location_from_wikipedia = get_location_from_wikipedia
+            astrodata.FAILED_LOOKUP_TTL = ttl
+            astrodata.observers.pop('Elmira, Ontario')
+
+    def test_parallel(self):
+        """ process pool results should match month_daylight, in order """
+
+        astrodata.month_daylights.clear()
+        locations = [TEST_LOCATIONS[0], 'no such place, surely', [69.65, 18.96]]
+
+        parallel = astrodata.parallel_month_daylight(locations, [6, 12],
+            processes = 2)
+
+        self.assertEqual(parallel[1], None)
+        self.assertEqual(parallel[2][0], datetime.timedelta(days = 30))
+        self.assertEqual(parallel[2][1], datetime.timedelta(0))
+
+        # results should now be cached
+        self.assertEqual(len(astrodata.month_daylights), 4)
+        self.assertEqual(parallel[0][1], astrodata.month_daylight(
+            TEST_LOCATIONS[0], 12, exact = True))
+
+    def test_unknown_method(self):
+        """ unknown methods should be refused """
+
+        self.assertRaises(ValueError, astrodata.month_daylight,
+            [43.7, -79.4], 1, False, 'guess')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+# times exact monthly daylight for many locations computed one after
+# another, then over a process pool with parallel_month_daylight().
+# usage: test_astrodata_parallel.py [number of processes]
+
+from __future__ import unicode_literals
+import multiprocessing
+import sys
+import time
+
+import astrodata
+
+if __name__ == '__main__':
+    processes = multiprocessing.cpu_count()
+    if len(sys.argv) > 1:
+        processes = int(sys.argv[1])
+
+    # a spread of latitudes and longitudes; polar ones are the slowest
+    locations = [[lat, lon] for lat in range(-60, 75, 5)
+        for lon in [-120, 0, 120]]
+
+    time1 = time.time()
+    serial = []
+    for location in locations:
+        serial.append([astrodata.month_daylight(location, i+1, True)
+            for i in range(12)])
+    serial_time = time.time() - time1
+    print "serial: " + str(serial_time)
+
+    # otherwise everything would come from the cache
+    astrodata.month_daylights.clear()
+    astrodata.year_daylights.clear()
+
+    time2 = time.time()
+    parallel = astrodata.parallel_month_daylight(locations,
+        processes = processes)
+    parallel_time = time.time() - time2
+    print "parallel (" + str(processes) + " processes): " + str(parallel_time)
+
+    print "speedup: " + str(round(serial_time / parallel_time, 2)) + "x"
+    print "same results: " + str(serial == parallel)
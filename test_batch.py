@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import unicode_literals
+import io
+import json
+import time
+import unittest
+
+import batch
+import climate
+from test_climate import offline_test
+
+class batch_test(offline_test):
+    def setUp(self):
+        offline_test.setUp(self)
+        self.write_pages(['Toronto', 'Sydney', 'Oslo'])
+
+    def run_batch(self, places, ordered = True):
+        out = io.StringIO()
+        errors = batch.run(iter(places), out, 4, ordered)
+        return errors, [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_order(self):
+        """ records should come in input order, however long each takes """
+
+        get_climate_data = climate.get_climate_data
+        def slow_get_climate_data(place):
+            # the first place takes longest
+            time.sleep({'Toronto': 0.2, 'Sydney': 0.1}.get(place, 0))
+            return get_climate_data(place)
+
+        climate.get_climate_data = slow_get_climate_data
+        try:
+            errors, records = self.run_batch(['Toronto', 'Sydney', 'Oslo'])
+            self.assertEqual([record['query'] for record in records],
+                ['Toronto', 'Sydney', 'Oslo'])
+
+            errors, records = self.run_batch(['Toronto', 'Sydney', 'Oslo'],
+                ordered = False)
+            self.assertEqual([record['query'] for record in records],
+                ['Oslo', 'Sydney', 'Toronto'])
+        finally:
+            climate.get_climate_data = get_climate_data
+
+        self.assertEqual(errors, 0)
+        self.assertEqual(records[0]['high C'][0], 0)
+
+    def test_errors(self):
+        """ failing places should get an error record and count as errors """
+
+        get_climate_data = climate.get_climate_data
+        def failing_get_climate_data(place):
+            if place == 'Sydney':
+                raise ValueError('bad weatherbox')
+            return get_climate_data(place)
+
+        climate.get_climate_data = failing_get_climate_data
+        try:
+            errors, records = self.run_batch(['Toronto', 'Sydney', 'Oslo'])
+        finally:
+            climate.get_climate_data = get_climate_data
+
+        self.assertEqual(errors, 1)
+        self.assertEqual(records[1], {'query': 'Sydney', 'page_error': True,
+            'error': 'ValueError: bad weatherbox'})
+        self.assertFalse('error' in records[2])
+
+    def test_missing(self):
+        """ places without a page should count as errors too """
+
+        errors, records = self.run_batch(['Nowhere', 'Toronto', 'Elsewhere'])
+
+        self.assertEqual(errors, 2)
+        self.assertEqual([record['page_error'] for record in records],
+            [True, False, True])
+
+    def test_read_places(self):
+        """ blank lines and comments should be skipped """
+
+        f = io.BytesIO('Toronto\n\n# a comment\n  Zürich \n'.encode('utf-8'))
+        self.assertEqual(list(batch.read_places(f)), ['Toronto', 'Zürich'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import unicode_literals
+import codecs
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import cache
+import changefeed
+import climate
+import fake_api
+
+class changefeed_test(unittest.TestCase):
+    def setUp(self):
+        self.app = fake_api.FakeAPI()
+        self.app.add_places(3, 1024)
+        self.places = fake_api.place_names(3)
+
+        # a place whose weatherbox is in a template of its own
+        weatherbox = climate.find_template(fake_api.place_page('Sepville', 4),
+            'Weather box')
+        self.app.pages['Sepville'] = '{{Infobox settlement\n|name = ' \
+            'Sepville\n}}\n== Climate ==\n{{Sepville weatherbox}}\n'
+        self.app.pages['Template:Sepville weatherbox'] = weatherbox
+
+        self.httpd, url = fake_api.start(self.app)
+
+        self.api = climate.API
+        climate.use_api(url)
+
+        self.cache_dir = cache.CACHE_DIR
+        cache.CACHE_DIR = tempfile.mkdtemp()
+        cache.memory.clear()
+        climate.resolutions.clear()
+
+        for place in self.places + ['Sepville']:
+            climate.get_climate_data(place)
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        climate.use_api(self.api)
+
+        shutil.rmtree(cache.CACHE_DIR)
+        cache.CACHE_DIR = self.cache_dir
+        cache.memory.clear()
+        climate.resolutions.clear()
+
+    def cached(self):
+        return set(page_name for page_name in self.places
+            + ['Sepville', 'Template:Sepville weatherbox']
+            if cache.get_mtime(page_name) is not None)
+
+    def write_changes(self, path, titles):
+        f = codecs.open(path, 'a', 'utf-8')
+        for title in titles:
+            f.write(json.dumps({'title': title,
+                'timestamp': changefeed.format_timestamp(time.time())}) + '\n')
+        f.close()
+
+    def test_file_feed(self):
+        """ only cached pages that changed should be cleared, once """
+
+        path = os.path.join(cache.CACHE_DIR, 'changes.jsonl')
+        self.write_changes(path, [self.places[0], 'Somewhere else'])
+
+        poller = changefeed.Poller(changefeed.FileFeed(path))
+        self.assertEqual(poller.poll(), set([self.places[0]]))
+        self.assertEqual(self.cached(), set(self.places[1:]
+            + ['Sepville', 'Template:Sepville weatherbox']))
+
+        self.assertEqual(poller.poll(), set())
+
+        # a new poller carries on where the last one got to
+        self.write_changes(path, [self.places[1]])
+        poller = changefeed.Poller(changefeed.FileFeed(path))
+        self.assertEqual(poller.poll(), set([self.places[1]]))
+
+    def test_template(self):
+        """ a weatherbox template's change should clear the pages using it """
+
+        path = os.path.join(cache.CACHE_DIR, 'changes.jsonl')
+        self.write_changes(path, ['Template:Sepville weatherbox'])
+
+        poller = changefeed.Poller(changefeed.FileFeed(path))
+        self.assertEqual(poller.poll(),
+            set(['Sepville', 'Template:Sepville weatherbox']))
+        self.assertEqual(self.cached(), set(self.places))
+
+    def test_api_feed(self):
+        """ changes should be read from the API, a page of them at a time """
+
+        limit = changefeed.RECENT_CHANGES_LIMIT
+        changefeed.RECENT_CHANGES_LIMIT = 1
+        try:
+            poller = changefeed.Poller(changefeed.APIFeed())
+            # caught up: nothing has changed since the pages were fetched
+            self.assertEqual(poller.poll(), set())
+
+            self.app.change(self.places[0])
+            self.app.change('Somewhere else')
+            self.app.change(self.places[2])
+
+            self.assertEqual(poller.poll(),
+                set([self.places[0], self.places[2]]))
+            self.assertEqual(poller.poll(), set())
+        finally:
+            changefeed.RECENT_CHANGES_LIMIT = limit
+
+    def test_catch_up(self):
+        """ after too long away, cached pages changed since should be found """
+
+        # as if saved long ago
+        state_file = os.path.join(cache.CACHE_DIR, changefeed.STATE_FILE)
+        f = open(state_file, 'w')
+        f.write(json.dumps({'timestamp': '2001-01-15T00:00:00Z', 'id': 1,
+            'saved': 0}))
+        f.close()
+
+        self.app.change(self.places[1])
+
+        poller = changefeed.Poller(changefeed.APIFeed())
+        poller.poll()
+        self.assertEqual(self.cached(), set([self.places[0], self.places[2],
+            'Sepville', 'Template:Sepville weatherbox']))
+
+    def test_refresh(self):
+        """ with refresh, changed pages should be downloaded again """
+
+        text = fake_api.place_page(self.places[0], 50, 1024)
+        expected = float(climate.parse_infobox(climate.find_template(text,
+            'Weather box'))['Jan high C'])
+        self.app.change(self.places[0], text)
+        self.assertNotEqual(
+            climate.get_climate_data(self.places[0])['high C'][0], expected)
+
+        path = os.path.join(cache.CACHE_DIR, 'changes.jsonl')
+        self.write_changes(path, [self.places[0]])
+        requests = self.app.requests
+
+        poller = changefeed.Poller(changefeed.FileFeed(path), refresh = True)
+        poller.poll()
+
+        self.assertTrue(self.app.requests > requests)
+        self.assertEqual(self.cached(), set(self.places
+            + ['Sepville', 'Template:Sepville weatherbox']))
+
+        self.assertEqual(
+            climate.get_climate_data(self.places[0])['high C'][0], expected)
+
+    def test_background(self):
+        """ a started poller should keep polling until stopped """
+
+        path = os.path.join(cache.CACHE_DIR, 'changes.jsonl')
+        self.write_changes(path, [self.places[2]])
+
+        poller = changefeed.Poller(changefeed.FileFeed(path), interval = 0.01)
+        poller.start()
+        try:
+            for i in range(500):
+                if self.places[2] not in self.cached():
+                    break
+                time.sleep(0.01)
+        finally:
+            poller.stop()
+
+        self.assertFalse(self.places[2] in self.cached())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,14 +2,27 @@
 # coding=utf-8
 
 from __future__ import unicode_literals
+import json
 import unittest
 import os
+import shutil
+import tempfile
+import threading
 import time
 from datetime import datetime
 from datetime import timedelta
 
 import climate
 import cache
+import throttle
+
+def fake_page(title):
+    # API response for a page with a minimal weatherbox
+    text = '{{Weather box\n%s\n|source = test\n}}' % '\n'.join(
+        '|%s high C = %d' % (month, i) for i,month in enumerate(climate.MONTHS))
+
+    return json.dumps({'query': {'pages': {'1': {'title': title,
+        'revisions': [{'*': text}]}}}})
 
 class known_values(unittest.TestCase):
     def test_nonexistent_page(self):
@@ -155,6 +168,22 @@ class known_values(unittest.TestCase):
                 for month,expected_value in key_data.items():
                     self.assertEqual(actual_data[key][month], expected_value)
                     
+    def test_display_units(self):
+        """ Test units given in a query, which convert data for display.
+        Based on Seattle data as in test_unit_conversion. """
+
+        result = climate.parse_text_query('seattle april high in F'.split())
+        self.assertEqual(result['cities'], ['Seattle'])
+        self.assertEqual(result['units'], ['F'])
+
+        data = climate.get_comparison_data(result['cities'],
+            result['months'], result['categories'], result['units'])
+        self.assertEqual(data[3]['Seattle']['high C'], 58.5)
+
+        data = climate.convert_data(climate.get_climate_data('Seattle'),
+            ['inch'])
+        self.assertEqual(data['precipitation mm'][0], 5.6)
+
     def test_percent_sun(self):
         """ Test for "percent possible sunshine" conversion to sun hours.
         TODO: find a city that has "percent possible sunshine" but not
@@ -332,6 +361,419 @@ class climate_cache_test(unittest.TestCase):
         for path in paths:
             self.assertFalse(os.path.exists(path))
 
+    def test_memory_cache(self):
+        """ Pages should be kept in memory after first use, and
+        clearing the cache should drop them from memory too. """
+
+        climate.get_climate_data('Melbourne')
+        self.assertTrue(cache.memory.get('Melbourne') is not None)
+
+        cache.clear('Melbourne')
+        self.assertEqual(cache.memory.get('Melbourne'), None)
+
+class lru_cache_test(unittest.TestCase):
+    def test_size_limit(self):
+        """ least recently used entries should be dropped when full """
+
+        lru = cache.LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual(lru.get('c'), 3)
+        self.assertEqual(len(lru), 2)
+
+    def test_ttl(self):
+        """ entries should expire after their time to live """
+
+        lru = cache.LRUCache(10, ttl = 0.05)
+        lru.set('a', 1)
+        lru.set('b', 2, ttl = 10)
+        time.sleep(0.1)
+
+        self.assertEqual(lru.get('a'), None)
+        self.assertEqual(lru.get('b'), 2)
+
+class offline_test(unittest.TestCase):
+    # tests with their own cache directory and no network
+    def setUp(self):
+        self.cache_dir = cache.CACHE_DIR
+        cache.CACHE_DIR = tempfile.mkdtemp()
+        cache.OFFLINE = True
+        cache.memory.clear()
+        climate.resolutions.clear()
+
+    def tearDown(self):
+        shutil.rmtree(cache.CACHE_DIR)
+        cache.CACHE_DIR = self.cache_dir
+        cache.OFFLINE = False
+        cache.memory.clear()
+        climate.resolutions.clear()
+
+    def write_pages(self, titles):
+        for title in titles:
+            f = open(cache.get_file_name(title), 'w')
+            f.write(fake_page(title))
+            f.close()
+
+class cache_file_offline(offline_test):
+    def test_permissions(self):
+        """ cached pages should be readable by everyone, like open() makes
+        them, not only by us as mkstemp does """
+
+        cache.OFFLINE = False
+        cache.get_page('Toronto', lambda: fake_page('Toronto'))
+
+        mode = os.stat(cache.get_file_name('Toronto')).st_mode & 0o777
+        self.assertEqual(mode, 0o644)
+
+class page_source_offline(offline_test):
+    def test_fetch_errors(self):
+        """ pages that can't be fetched should give an error title, but
+        bugs should be raised rather than taken for fetch errors """
+
+        fetch = throttle.fetch
+        def unreachable(url):
+            raise throttle.CircuitOpen('too many failed requests')
+        def broken(url):
+            raise TypeError('a bug')
+
+        cache.OFFLINE = False
+        try:
+            throttle.fetch = unreachable
+            title, text = climate.get_page_source('Toronto')
+            self.assertEqual(text, False)
+            self.assertEqual(title, 'Toronto' + climate.MSG_FETCH_ERROR
+                % 'too many failed requests')
+
+            throttle.fetch = broken
+            self.assertRaises(TypeError, climate.get_page_source, 'Toronto')
+        finally:
+            throttle.fetch = fetch
+
+    def test_broken_page(self):
+        """ a cached page that isn't JSON should give an error title too """
+
+        f = open(cache.get_file_name('Toronto'), 'w')
+        f.write(b'<html>Wikimedia Error</html>')
+        f.close()
+
+        title, text = climate.get_page_source('Toronto')
+        self.assertEqual(text, False)
+        self.assertTrue(title.startswith('Toronto: could not get page'))
+
+        data = climate.get_climate_data('Toronto')
+        self.assertEqual(data['page_error'], True)
+
+class text_query_offline(offline_test):
+    def test_candidates(self):
+        """ candidates should come in the order the query parser tries them """
+
+        self.assertEqual(climate.city_candidates(['hamilton', 'new', 'zealand']),
+            ['Hamilton', 'Hamilton New', 'Hamilton, New',
+            'Hamilton, New Zealand', 'Hamilton New Zealand',
+            'Hamilton New, Zealand', 'New', 'New Zealand', 'New, Zealand',
+            'Zealand'])
+
+    def test_existing_pages(self):
+        """ titles query responses should be followed through
+        normalization and redirects """
+
+        response = {'query': {
+            'normalized': [{'from': 'toronto', 'to': 'Toronto'}],
+            'redirects': [{'from': 'Toronto', 'to': 'Toronto, Ontario'}],
+            'pages': {
+                '1': {'title': 'Toronto, Ontario'},
+                '-1': {'title': 'Elmira, New Zealand', 'missing': ''}}}}
+
+        self.assertEqual(climate.parse_existing_pages(['toronto',
+            'Elmira, New Zealand', 'Nowhere'], response), set(['toronto']))
+
+    def test_query(self):
+        """ multi-word names should be found from pages in the cache """
+
+        self.write_pages(['Hamilton, New Zealand', 'Toronto'])
+
+        result = climate.parse_text_query(
+            'Toronto and Hamilton New Zealand july'.split())
+        self.assertEqual(result['cities'], ['Toronto', 'Hamilton, New Zealand'])
+        self.assertEqual(result['months'][6], True)
+
+        result = climate.parse_text_query('Hamilton Ontario Toronto'.split())
+        self.assertEqual(result['cities'], ['Toronto'])
+
+    def test_match_cities(self):
+        """ each word should be tried on its own first, then with the
+        words after it, spaces before commas """
+
+        names = set(['Hamilton', 'Hamilton, New Zealand', 'New Zealand',
+            'Zealand', 'Toronto', 'Toronto, Ontario', 'Seattle',
+            'Seattle, Washington'])
+        match = lambda words, names = names: climate.match_cities(
+            words.split(), lambda name: name in names)
+
+        self.assertEqual(match('hamilton new zealand'),
+            ['Hamilton', 'New Zealand'])
+        self.assertEqual(match('toronto ontario'), ['Toronto'])
+        self.assertEqual(match('seattle washington toronto'),
+            ['Seattle', 'Toronto'])
+        self.assertEqual(match('hamilton toronto nowhere new zealand'),
+            ['Hamilton', 'Toronto', 'New Zealand'])
+
+        # without Hamilton itself, the words used aren't tried again
+        names.remove('Hamilton')
+        self.assertEqual(match('hamilton new zealand'),
+            ['Hamilton, New Zealand'])
+        self.assertEqual(match('hamilton new zealand', set([
+            'Hamilton New Zealand', 'Hamilton, New Zealand'])),
+            ['Hamilton, New Zealand'])
+
+    def test_word_alone_first(self):
+        """ a word that names a place with data on its own shouldn't be
+        joined to the words after it """
+
+        self.write_pages(['Washington Dc', 'Albuquerque',
+            'Albuquerque, New Mexico', 'Seattle', 'Seattle, Washington'])
+
+        result = climate.parse_text_query(('washington dc march albuquerque '
+            'new mexico high low seattle washington').split())
+        self.assertEqual(result['cities'],
+            ['Washington Dc', 'Albuquerque', 'Seattle'])
+
+    def test_fetch_matched(self):
+        """ only pages of names that would be tried before a match should
+        be fetched, and names matched again if one has no data """
+
+        self.write_pages(['Hamilton, New Zealand', 'New Zealand', 'Zealand'])
+
+        # as if it were a disambiguation page
+        f = open(cache.get_file_name('Hamilton'), 'w')
+        f.write(json.dumps({'query': {'pages': {'1': {'title': 'Hamilton',
+            'revisions': [{'*': 'Hamilton may refer to...'}]}}}}))
+        f.close()
+
+        lookups = []
+        get_climate_data = climate.get_climate_data
+        def counted_get_climate_data(place):
+            lookups.append(place)
+            return get_climate_data(place)
+
+        climate.get_climate_data = counted_get_climate_data
+        try:
+            result = climate.parse_text_query('hamilton new zealand'.split())
+            self.assertEqual(result['cities'], ['Hamilton, New Zealand'])
+            self.assertEqual(sorted(lookups), ['Hamilton',
+                'Hamilton, New Zealand', 'New Zealand'])
+
+            self.write_pages(['Hamilton'])
+            cache.memory.clear()
+            climate.resolutions.clear()
+            del lookups[:]
+
+            result = climate.parse_text_query('hamilton new zealand'.split())
+            self.assertEqual(result['cities'], ['Hamilton', 'New Zealand'])
+            self.assertEqual(sorted(lookups), ['Hamilton', 'New Zealand'])
+        finally:
+            climate.get_climate_data = get_climate_data
+
+    def test_resolutions(self):
+        """ names should be resolved once, and their records handed on """
+
+        self.write_pages(['Toronto'])
+
+        lookups = []
+        get_climate_data = climate.get_climate_data
+        def counted_get_climate_data(place):
+            lookups.append(place)
+            return get_climate_data(place)
+
+        climate.get_climate_data = counted_get_climate_data
+        try:
+            result = climate.parse_text_query('toronto july'.split())
+            self.assertEqual(result['data']['Toronto']['high C'][6], 6)
+            self.assertEqual(lookups, ['Toronto'])
+
+            # the name should now resolve from memory
+            result = climate.parse_text_query('toronto july'.split())
+            self.assertEqual(result['cities'], ['Toronto'])
+            self.assertEqual(lookups, ['Toronto'])
+
+            data = climate.get_comparison_data(result['cities'],
+                result['months'], {'high C': True}, records = result['data'])
+            self.assertEqual(data[6]['Toronto']['high C'], 6)
+            self.assertEqual(lookups, ['Toronto'])
+
+            # until the page is downloaded again
+            mtime = cache.get_mtime('Toronto')
+            os.utime(cache.get_file_name('Toronto'), (mtime + 1, mtime + 1))
+
+            climate.parse_text_query('toronto july'.split())
+            self.assertEqual(lookups, ['Toronto', 'Toronto'])
+        finally:
+            climate.get_climate_data = get_climate_data
+
+    def test_template_refresh(self):
+        """ names should be resolved again when the page's separate
+        weatherbox template is downloaded again """
+
+        template = 'Template:Sepville weatherbox'
+        self.write_pages([template])
+        f = open(cache.get_file_name('Sepville'), 'w')
+        f.write(json.dumps({'query': {'pages': {'1': {'title': 'Sepville',
+            'revisions': [{'*': '== Climate ==\n{{Sepville weatherbox}}'}]}}}}))
+        f.close()
+
+        lookups = []
+        get_climate_data = climate.get_climate_data
+        def counted_get_climate_data(place):
+            lookups.append(place)
+            return get_climate_data(place)
+
+        climate.get_climate_data = counted_get_climate_data
+        try:
+            result = climate.parse_text_query('sepville'.split())
+            self.assertEqual(result['cities'], ['Sepville'])
+            record = result['data']['Sepville']
+            self.assertEqual(record['template'], template)
+            self.assertEqual(len(climate.page_mtimes('Sepville', record)), 2)
+
+            climate.parse_text_query('sepville'.split())
+            self.assertEqual(lookups, ['Sepville'])
+
+            mtime = cache.get_mtime(template)
+            os.utime(cache.get_file_name(template), (mtime + 1, mtime + 1))
+
+            climate.parse_text_query('sepville'.split())
+            self.assertEqual(lookups, ['Sepville', 'Sepville'])
+        finally:
+            climate.get_climate_data = get_climate_data
+
+    def test_unit_words(self):
+        """ short unit names should only be units after "in" """
+
+        self.write_pages(['Washington D C'])
+
+        result = climate.parse_text_query('washington d c july'.split())
+        self.assertEqual(result['cities'], ['Washington D C'])
+        self.assertEqual(result['units'], [])
+
+        result = climate.parse_text_query('washington d c in f'.split())
+        self.assertEqual(result['cities'], ['Washington D C'])
+        self.assertEqual(result['units'], ['F'])
+
+        result = climate.parse_text_query('washington d c fahrenheit'.split())
+        self.assertEqual(result['units'], ['F'])
+
+    def test_converted_titles(self):
+        """ converted rows should say which unit they're in """
+
+        self.write_pages(['Toronto'])
+
+        data = climate.convert_data(climate.get_climate_data('Toronto'), ['F'])
+        self.assertEqual(data['units'], {'high C': 'F'})
+        self.assertEqual(data['high C'][0], 32.0)
+        self.assertTrue('\nhigh F|' in climate.format_data_as_text(data))
+
+        self.assertEqual(climate.row_title('precipitation mm', 'inch'),
+            'prep inch')
+        self.assertEqual(climate.row_title('high C'), 'high')
+
+    def test_format_twice(self):
+        """ formatting should leave the record as it was, so that
+        formatting it again gives the same table """
+
+        self.write_pages(['Toronto'])
+
+        data = climate.get_climate_data('Toronto')
+        data['high C'][3] = 12.5
+        first = climate.format_data_as_text(data)
+
+        self.assertEqual(climate.format_data_as_text(data), first)
+        self.assertEqual(data['high C'][3], 12.5)
+        self.assertTrue(all(isinstance(value, float)
+            for value in data['high C']))
+
+class async_offline(offline_test):
+    def test_async(self):
+        """ async lookups should give the same results as sync ones """
+
+        self.write_pages(['Toronto', 'Sydney'])
+
+        job = climate.get_climate_data_async('Toronto')
+        self.assertEqual(job.result(), climate.get_climate_data('Toronto'))
+
+        title, text = climate.get_page_source_async('Sydney').result()
+        self.assertEqual(title, 'Sydney')
+
+        months = [True] + [False] * 11
+        job = climate.get_comparison_data_async(['Toronto', 'Sydney'], months,
+            {'high C': True})
+        self.assertEqual(job.result(), {0: {'Toronto': {'high C': 0},
+            'Sydney': {'high C': 0}}})
+
+    def test_concurrent_comparison(self):
+        """ comparing places should take about as long as one lookup """
+
+        places = ['Toronto', 'Sydney', 'Oslo', 'Lima']
+        self.write_pages(places)
+
+        get_URL = cache.get_URL
+        def slow_get_URL(url, page_name, force_download = False):
+            time.sleep(0.2)
+            return get_URL(url, page_name, force_download)
+
+        cache.get_URL = slow_get_URL
+        try:
+            start = time.time()
+            data = climate.get_comparison_data(places, [True] * 12,
+                {'low C': True})
+            seconds = time.time() - start
+        finally:
+            cache.get_URL = get_URL
+
+        self.assertEqual(sorted(data[0]), sorted(places))
+        self.assertTrue(seconds < 0.6)
+
+    def test_bounded_lookups(self):
+        """ concurrent comparisons shouldn't look up more pages at once,
+        between them, than there are fetch slots """
+
+        places = ['Toronto', 'Sydney', 'Oslo', 'Lima', 'Cairo', 'Perth']
+        self.write_pages(places)
+
+        running = []
+        most = []
+        lock = threading.Lock()
+        get_climate_data = climate.get_climate_data
+        def counted_get_climate_data(place):
+            with lock:
+                running.append(place)
+                most.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(place)
+            return get_climate_data(place)
+
+        fetch_slots = climate.fetch_slots
+        climate.fetch_slots = threading.BoundedSemaphore(2)
+        climate.get_climate_data = counted_get_climate_data
+        try:
+            threads = [threading.Thread(target = climate.get_comparison_data,
+                args = (places[i:i + 3], [True] * 12, {'low C': True}))
+                for i in [0, 3]]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            climate.fetch_slots = fetch_slots
+            climate.get_climate_data = get_climate_data
+
+        self.assertEqual(len(most), 6)
+        self.assertEqual(max(most), 2)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import unicode_literals
+import unittest
+import os
+import shutil
+import tempfile
+
+import cache
+import climate
+import dataset
+from test_climate import fake_page, offline_test
+
+def make_record(title):
+    record = {'page_error': False, 'title': title, 'location': 'Airport'}
+    for row_name in climate.ROWS:
+        record[row_name] = []
+
+    record['high C'] = [-1.2, 0.4, 4.9, 12.3, 18.6, 23.9,
+        26.8, 25.6, 21.1, 14.1, 7.1, 1.3]
+    record['sun'] = [85.9, 111.3, 161.0, 180.6, 227.7, 259.6,
+        279.6, 245.6, 194.4, 154.3, 88.8, 78.3]
+    record['snow cm'] = [37.2, 27.0, 19.8, 5.0, 0.0, 0.0,
+        0.0, 0.0, 0.0, 0.1, 8.3, None]
+    # incomplete rows are not stored
+    record['rain mm'] = [30.0, 25.0]
+
+    return record
+
+class dataset_round_trip(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'climates')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        """ records read back from a dataset should match what was
+        written, apart from incomplete rows """
+
+        original = make_record('Toronto')
+        error = {'page_error': True, 'title': 'Nowhere: location not found'}
+
+        titles = dataset.export_dataset([original, error], self.path)
+        self.assertEqual(titles, ['Toronto'])
+
+        loaded = dataset.load_dataset(self.path)
+        record = dataset.get_record(loaded, 'toronto')
+
+        self.assertEqual(record['title'], 'Toronto')
+        self.assertEqual(record['location'], 'Airport')
+        self.assertEqual(record['high C'], original['high C'])
+        self.assertEqual(record['sun'], original['sun'])
+        self.assertEqual(record['snow cm'], original['snow cm'])
+        self.assertEqual(record['rain mm'], [])
+        self.assertEqual(record['low C'], [])
+
+        self.assertEqual(dataset.get_record(loaded, 'Nowhere'), None)
+
+    def test_memory_mapped(self):
+        """ dataset matrix should be mapped, not read into memory """
+
+        dataset.export_dataset([make_record('Toronto')], self.path)
+        loaded = dataset.load_dataset(self.path)
+
+        self.assertTrue(loaded['matrix'].filename is not None)
+
+    def test_climate_uses_dataset(self):
+        """ climate.get_climate_data should answer from a loaded dataset """
+
+        dataset.export_dataset([make_record('Toronto')], self.path)
+
+        climate.use_dataset(self.path)
+        try:
+            record = climate.get_climate_data('Toronto')
+        finally:
+            climate.DATASET = None
+
+        self.assertEqual(record['high C'][4], 18.6)
+        self.assertTrue(climate.has_printable_data(record))
+
+    def test_names(self):
+        """ records should be found by the names they were looked up by,
+        and keep their weatherbox template """
+
+        original = make_record('New York City')
+        original['template'] = 'Template:New York City weatherbox'
+
+        titles = dataset.export_dataset([original, original,
+            make_record('Toronto')], self.path, ['NYC', 'new york city',
+            'Toronto'])
+        self.assertEqual(titles, ['New York City', 'Toronto'])
+
+        loaded = dataset.load_dataset(self.path)
+        record = dataset.get_record(loaded, 'nyc')
+
+        self.assertEqual(record['title'], 'New York City')
+        self.assertEqual(record['template'], original['template'])
+        self.assertEqual(record['high C'], original['high C'])
+        self.assertFalse('template' in dataset.get_record(loaded, 'Toronto'))
+
+class dataset_offline(offline_test):
+    def test_export_cache(self):
+        """ pages cached under a redirect's name should be found by it """
+
+        self.write_pages(['Toronto'])
+        f = open(cache.get_file_name('Hogtown'), 'w')
+        f.write(fake_page('Toronto'))
+        f.close()
+
+        path = os.path.join(cache.CACHE_DIR, 'climates')
+        self.assertEqual(dataset.export_cache(path), ['Toronto'])
+
+        loaded = dataset.load_dataset(path)
+        self.assertEqual(dataset.get_record(loaded, 'hogtown'),
+            climate.get_climate_data('Toronto'))
+
+if __name__ == '__main__':
+    unittest.main()
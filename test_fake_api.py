@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import unicode_literals
+import shutil
+import tempfile
+import unittest
+
+import cache
+import climate
+import fake_api
+import throttle
+
+class fake_api_test(unittest.TestCase):
+    def setUp(self):
+        self.app = fake_api.FakeAPI(redirects = {'Nyc': 'New York City'})
+        self.app.add_places(3, 1024)
+        self.app.pages['New York City'] = fake_api.place_page(
+            'New York City', 3)
+        self.httpd, url = fake_api.start(self.app)
+
+        self.api = climate.API
+        climate.use_api(url)
+
+        self.cache_dir = cache.CACHE_DIR
+        cache.CACHE_DIR = tempfile.mkdtemp()
+        cache.memory.clear()
+        climate.resolutions.clear()
+
+        self.backoff_base = throttle.BACKOFF_BASE
+        throttle.BACKOFF_BASE = 0.001
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        climate.use_api(self.api)
+
+        shutil.rmtree(cache.CACHE_DIR)
+        cache.CACHE_DIR = self.cache_dir
+        cache.memory.clear()
+        climate.resolutions.clear()
+
+        throttle.BACKOFF_BASE = self.backoff_base
+        throttle.breaker = throttle.CircuitBreaker(throttle.FAILURE_THRESHOLD,
+            throttle.COOLDOWN)
+
+    def test_page(self):
+        """ pages should be fetched from the fake API, following redirects """
+
+        place = fake_api.place_names(3)[1]
+        data = climate.get_climate_data(place)
+        self.assertEqual(data['title'], place)
+        self.assertEqual(len(data['high C']), 12)
+
+        data = climate.get_climate_data('nyc')
+        self.assertEqual(data['title'], 'New York City')
+
+    def test_existing_pages(self):
+        """ titles queries should find normalized and redirected names """
+
+        place = fake_api.place_names(1)[0]
+        self.assertEqual(climate.get_existing_pages([place.lower(), 'Nyc',
+            'Nowhere']), set([place.lower(), 'Nyc']))
+
+    def test_query(self):
+        """ a text query should find places on the fake API """
+
+        names = fake_api.place_names(2)
+        result = climate.parse_text_query([names[0].encode('utf-8'),
+            b'new', b'york', b'city', b'high', b'july'])
+        self.assertEqual(result['cities'], [names[0], 'New York City'])
+
+    def test_sections(self):
+        """ with FETCH_SECTIONS, only the lead and climate sections should
+        be downloaded, or the whole page if there's no climate section """
+
+        climate.FETCH_SECTIONS = True
+        try:
+            place = fake_api.place_names(1)[0]
+            self.app.pages[place] = fake_api.place_page(place, 0, 20 * 1024)
+            data = climate.get_climate_data(place)
+            self.assertEqual(len(data['high C']), 12)
+            self.assertTrue(self.app.bytes < 10 * 1024)
+
+            self.app.pages['Elsewhere'] = self.app.pages[place].replace(
+                '== Climate ==', '')
+            self.app.bytes = 0
+            data = climate.get_climate_data('Elsewhere')
+            self.assertEqual(len(data['high C']), 12)
+            self.assertTrue(self.app.bytes > 20 * 1024)
+        finally:
+            climate.FETCH_SECTIONS = False
+
+    def test_errors(self):
+        """ errors should be retried, then reported in the record """
+
+        self.app.errors = 1
+
+        data = climate.get_climate_data(fake_api.place_names(1)[0])
+        self.assertEqual(data['page_error'], True)
+        self.assertEqual(self.app.requests, throttle.RETRIES + 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import unicode_literals
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import cache
+import climate
+import gazetteer
+from test_climate import fake_page
+
+class gazetteer_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_normalize(self):
+        """ case, accents, commas and underscores should not matter """
+
+        self.assertEqual(gazetteer.normalize('São_Paulo'), 'sao paulo')
+        self.assertEqual(gazetteer.normalize('Hamilton, New  Zealand'),
+            'hamilton new zealand')
+
+    def test_lookup(self):
+        """ names should resolve to titles, and prefixes to several """
+
+        index = gazetteer.Gazetteer([('São Paulo', 'São Paulo'),
+            ('Sao Paulo, Brazil', 'São Paulo'),
+            ('Hamilton, New Zealand', 'Hamilton, New Zealand'),
+            ('Hamilton, Ontario', 'Hamilton, Ontario')])
+
+        self.assertEqual(index.lookup('sao paulo'), 'São Paulo')
+        self.assertEqual(index.lookup('SAO PAULO BRAZIL'), 'São Paulo')
+        self.assertEqual(index.lookup('Hamilton New Zealand'),
+            'Hamilton, New Zealand')
+        self.assertEqual(index.lookup('Hamilton'), None)
+
+        self.assertEqual(index.prefix('hamilton'),
+            ['Hamilton, New Zealand', 'Hamilton, Ontario'])
+        self.assertEqual(index.prefix('são'), ['São Paulo'])
+
+    def test_case_collisions(self):
+        """ among titles differing by case, the one written like the name
+        should win, then the usual capitalization, not all capitals """
+
+        index = gazetteer.Gazetteer([('NICE', 'NICE'), ('Nice', 'Nice'),
+            ('READING', 'READING'), ('Reading', 'Reading'),
+            ('Reading, Berkshire', 'Reading, Berkshire'), ('UCLA', 'UCLA')])
+
+        self.assertEqual(index.lookup('Nice'), 'Nice')
+        self.assertEqual(index.lookup('nice'), 'Nice')
+        self.assertEqual(index.lookup('NICE'), 'NICE')
+        self.assertEqual(index.lookup('reading'), 'Reading')
+        self.assertEqual(index.lookup('ucla'), 'UCLA')
+
+        self.assertEqual(index.prefix('reading'),
+            ['READING', 'Reading', 'Reading, Berkshire'])
+
+    def test_save_load(self):
+        """ a saved index should load back the same """
+
+        index = gazetteer.Gazetteer([('Zürich', 'Zürich'), ('Nice', 'Nice'),
+            ('NICE', 'NICE'), ('Zug', 'Zug')], complete = True)
+        path = os.path.join(self.directory, 'titles')
+        index.save(path)
+
+        loaded = gazetteer.load(path)
+        self.assertEqual(len(loaded), 4)
+        self.assertEqual(loaded.lookup('zurich'), 'Zürich')
+        self.assertEqual(loaded.lookup('nice'), 'Nice')
+        self.assertEqual(loaded.lookup('zurigo'), None)
+        self.assertEqual(loaded.prefix('zu'), ['Zug', 'Zürich'])
+        self.assertEqual(loaded.complete, True)
+
+        # an empty index too
+        gazetteer.Gazetteer().save(path)
+        self.assertEqual(gazetteer.load(path).lookup('nice'), None)
+
+    def test_titles_dump(self):
+        """ dump titles use underscores, and the index is complete """
+
+        path = os.path.join(self.directory, 'dump')
+        f = open(path, 'w')
+        f.write(b'page_title\nS\xc3\xa3o_Paulo\nToronto\n')
+        f.close()
+
+        index = gazetteer.from_titles_dump(path)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.lookup('sao paulo'), 'São Paulo')
+        self.assertEqual(index.complete, True)
+
+class cached_gazetteer_test(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = cache.CACHE_DIR
+        cache.CACHE_DIR = tempfile.mkdtemp()
+        cache.OFFLINE = True
+        cache.memory.clear()
+        climate.resolutions.clear()
+
+    def tearDown(self):
+        shutil.rmtree(cache.CACHE_DIR)
+        cache.CACHE_DIR = self.cache_dir
+        cache.OFFLINE = False
+        cache.memory.clear()
+        climate.resolutions.clear()
+        climate.GAZETTEER = None
+
+    def test_from_cache(self):
+        """ cached pages should be found by title and by redirects """
+
+        page = json.loads(fake_page('São Paulo'))
+        page['query']['redirects'] = [{'from': 'Sao Paulo', 'to': 'São Paulo'}]
+
+        f = open(cache.get_file_name('Sao Paulo'), 'w')
+        f.write(json.dumps(page))
+        f.close()
+
+        index = gazetteer.from_cache()
+        self.assertEqual(index.lookup('são paulo'), 'São Paulo')
+        self.assertEqual(index.lookup('sao paulo'), 'São Paulo')
+        self.assertEqual(index.complete, False)
+
+    def test_query(self):
+        """ queries should resolve names to titles with the gazetteer """
+
+        # an ASCII page name, so that the cache file name doesn't depend
+        # on the file system encoding; the page's own title has the accent
+        f = open(cache.get_file_name('Sao Paulo'), 'w')
+        f.write(fake_page('São Paulo'))
+        f.close()
+
+        climate.GAZETTEER = gazetteer.Gazetteer([('São Paulo', 'Sao Paulo')],
+            complete = True)
+
+        result = climate.parse_text_query('são paulo high'.encode('utf-8')
+            .split())
+        self.assertEqual(result['cities'], ['Sao Paulo'])
+        self.assertEqual(result['data']['Sao Paulo']['title'], 'São Paulo')
+
+if __name__ == '__main__':
+    unittest.main()
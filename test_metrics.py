@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+
+import metrics
+import workers
+
+class metrics_test(unittest.TestCase):
+    def setUp(self):
+        metrics.clear()
+
+    def tearDown(self):
+        metrics.ENABLED = True
+        metrics.clear()
+
+    def test_counters(self):
+        """ counts should add up by name """
+
+        metrics.count('cache.miss')
+        metrics.count('cache.miss', 2)
+        metrics.count('cache.memory_hit')
+
+        self.assertEqual(metrics.registry.counters['cache.miss'], 3)
+        self.assertEqual(metrics.registry.counters['cache.memory_hit'], 1)
+
+    def test_histogram(self):
+        """ percentiles should be the upper bound of their bucket """
+
+        for ms in range(1, 101):
+            metrics.observe('fetch', ms)
+
+        histogram = metrics.registry.histograms['fetch']
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.min, 1)
+        self.assertEqual(histogram.max, 100)
+        self.assertEqual(histogram.percentile(0.5), 50)
+        self.assertEqual(histogram.percentile(0.99), 100)
+
+        self.assertTrue('fetch: n 100' in metrics.report())
+
+    def test_bounded(self):
+        """ only the most recent events should be kept """
+
+        for i in range(metrics.EVENTS * 2):
+            metrics.count('cache.miss', detail = i)
+
+        events = metrics.registry.events
+        self.assertEqual(len(events), metrics.EVENTS)
+        self.assertEqual(events[-1][3], metrics.EVENTS * 2 - 1)
+
+        self.assertEqual(len(metrics.report(10).split('recent:')[1]
+            .strip().split('\n')), 10)
+
+    def test_request(self):
+        """ a request should get its own metrics, including from workers """
+
+        metrics.count('parse')
+
+        with metrics.request() as request:
+            metrics.observe('parse', 1.0)
+            for i,job in workers.imap(lambda i: metrics.count('cache.miss'),
+                    range(4)):
+                job.result()
+
+        self.assertEqual(request.counters['cache.miss'], 4)
+        self.assertEqual(request.histograms['parse'].count, 1)
+        self.assertFalse('parse' in request.counters)
+
+        self.assertEqual(metrics.registry.counters['cache.miss'], 4)
+        self.assertEqual(metrics.current_request(), None)
+
+    def test_disabled(self):
+        """ nothing should be recorded when turned off """
+
+        metrics.ENABLED = False
+
+        metrics.count('cache.miss')
+        metrics.observe('fetch', 1.0)
+
+        self.assertEqual(len(metrics.registry.counters), 0)
+        self.assertEqual(len(metrics.registry.histograms), 0)
+
+    def test_export(self):
+        """ the report should be written to the file """
+
+        directory = tempfile.mkdtemp()
+        try:
+            metrics.count('cache.miss', detail = 'Zürich')
+            path = os.path.join(directory, 'metrics.txt')
+            metrics.export(path)
+
+            f = open(path, 'r')
+            text = f.read().decode('utf-8')
+            f.close()
+
+            self.assertTrue('cache.miss: 1' in text)
+            self.assertTrue('(Zürich)' in text)
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
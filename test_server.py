@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import unicode_literals
+import json
+import os
+import unittest
+from wsgiref.util import setup_testing_defaults
+
+import cache
+import metrics
+import server
+import spans
+from test_climate import offline_test
+
+class server_test(offline_test):
+    def setUp(self):
+        offline_test.setUp(self)
+        self.write_pages(['Toronto', 'Sydney'])
+
+    def get(self, path, query = ''):
+        """ The status, content type and body of a GET request. """
+
+        environ = {'PATH_INFO': path, 'QUERY_STRING': query}
+        setup_testing_defaults(environ)
+
+        response = {}
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+
+        body = b''.join(server.application(environ, start_response))
+        self.assertEqual(int(response['headers']['Content-Length']), len(body))
+
+        return response['status'], response['headers']['Content-Type'], body
+
+    def get_json(self, path, query = ''):
+        status, content_type, body = self.get(path, query)
+        self.assertEqual(content_type, 'application/json')
+        return status, json.loads(body)
+
+    def test_climate(self):
+        """ a place's data should be served as JSON """
+
+        status, result = self.get_json('/climate', 'place=Toronto')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(result['title'], 'Toronto')
+        self.assertEqual(result['high C'][11], 11)
+
+        status, result = self.get_json('/climate', 'place=Toronto&units=F')
+        self.assertEqual(result['high C'][0], 32.0)
+        self.assertEqual(result['units'], {'high C': 'F'})
+
+    def test_compare(self):
+        """ months should be numbered from 1 in requests, 0 in results """
+
+        status, result = self.get_json('/compare',
+            'place=Toronto&place=Sydney&month=2&category=high+C')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(result, {'1': {'Toronto': {'high C': 1},
+            'Sydney': {'high C': 1}}})
+
+    def test_query(self):
+        """ the query's records should be included as JSON """
+
+        status, result = self.get_json('/query', 'q=toronto+high+march')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(result['cities'], ['Toronto'])
+        self.assertEqual(result['data']['Toronto']['high C'][2], 2)
+
+    def test_bad_requests(self):
+        """ bad parameters should get a 400 with the reason """
+
+        for path,query,reason in [
+                ('/climate', '', 'missing parameter: place'),
+                ('/climate', 'place=Toronto&units=furlongs',
+                    'unknown unit: furlongs'),
+                ('/compare', 'place=Toronto&month=13&category=high+C',
+                    'invalid month: 13'),
+                ('/compare', 'place=Toronto&month=1&category=warmth',
+                    'unknown category: warmth'),
+                ('/metrics', 'events=many', 'events should be a number')]:
+            status, result = self.get_json(path, query)
+            self.assertEqual(status, '400 Bad Request')
+            self.assertEqual(result, {'error': reason})
+
+        status, result = self.get_json('/weather', 'place=Toronto')
+        self.assertEqual(status, '404 Not Found')
+        self.assertTrue('/climate' in result['error'])
+
+    def test_server_error(self):
+        """ unexpected errors should get a 500 rather than no response """
+
+        climate_data = server.ENDPOINTS['/climate']
+        def broken(params):
+            raise KeyError('title')
+
+        server.ENDPOINTS['/climate'] = broken
+        try:
+            status, result = self.get_json('/climate', 'place=Toronto')
+        finally:
+            server.ENDPOINTS['/climate'] = climate_data
+
+        self.assertEqual(status, '500 Internal Server Error')
+        self.assertTrue(result['error'].startswith('KeyError'))
+
+    def test_metrics(self):
+        """ metrics should be plain text """
+
+        status, content_type, body = self.get('/metrics')
+        self.assertEqual(status, '200 OK')
+        self.assertTrue(content_type.startswith('text/plain'))
+
+    def test_slow_request(self):
+        """ slow requests should be listed in the metrics with their
+        profile's file name """
+
+        metrics.clear()
+        profile_dir = spans.PROFILE_DIR
+        spans.PROFILE_DIR = os.path.join(cache.CACHE_DIR, 'profiles')
+        spans.PROFILE_THRESHOLD = 0
+        try:
+            self.get_json('/climate', 'place=Toronto')
+        finally:
+            spans.PROFILE_DIR = profile_dir
+            spans.PROFILE_THRESHOLD = None
+
+        self.assertEqual(metrics.registry.counters['server.slow_request'], 1)
+        status, content_type, body = self.get('/metrics', 'events=50')
+        self.assertTrue('server.slow_request 1 (/climate?place=Toronto, '
+            'profile saved to ' in body.decode('utf-8'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+
+import metrics
+import spans
+import workers
+
+class spans_test(unittest.TestCase):
+    def setUp(self):
+        metrics.clear()
+
+    def tearDown(self):
+        spans.PROFILE_THRESHOLD = None
+        metrics.ENABLED = True
+        metrics.clear()
+
+    def test_tree(self):
+        """ spans inside a trace should nest """
+
+        with spans.trace('query') as root:
+            with spans.span('page', 'Toronto'):
+                with spans.span('fetch', 'Toronto'):
+                    pass
+            with spans.span('parse_infobox'):
+                pass
+
+        self.assertEqual([child.name for child in root.children],
+            ['page', 'parse_infobox'])
+        self.assertEqual(root.children[0].children[0].detail, 'Toronto')
+        self.assertEqual(spans.current_span(), None)
+
+        lines = root.format().split('\n')
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[2].endswith('    fetch (Toronto)'))
+
+    def test_metrics(self):
+        """ span times should be recorded, with or without a trace """
+
+        with spans.span('find_template') as span:
+            pass
+
+        self.assertEqual(span, None)
+        self.assertEqual(metrics.registry.histograms['find_template'].count, 1)
+
+    def test_disabled(self):
+        """ with metrics off, spans outside a trace should do nothing,
+        and spans in a trace should still make the tree """
+
+        metrics.ENABLED = False
+
+        self.assertTrue(spans.span('fetch') is spans.span('parse'))
+        with spans.span('fetch', 'Toronto') as span:
+            pass
+        self.assertEqual(span, None)
+
+        with spans.trace('query') as root:
+            with spans.span('fetch', 'Toronto'):
+                pass
+        self.assertEqual([child.name for child in root.children], ['fetch'])
+        self.assertEqual(len(metrics.registry.histograms), 0)
+
+    def test_workers(self):
+        """ spans in pool workers should nest under the submitting span """
+
+        def fetch(page_name):
+            with spans.span('fetch', page_name):
+                pass
+
+        with spans.trace('query') as root:
+            for page_name,job in workers.imap(fetch, ['Toronto', 'Sydney']):
+                job.result()
+
+        self.assertEqual(sorted(child.detail for child in root.children),
+            ['Sydney', 'Toronto'])
+
+    def test_profile(self):
+        """ requests over the threshold should have a profile saved """
+
+        profile_dir = spans.PROFILE_DIR
+        spans.PROFILE_DIR = tempfile.mkdtemp()
+        try:
+            spans.PROFILE_THRESHOLD = 1000
+            with spans.request('fast') as root:
+                pass
+            self.assertEqual(root.profile, None)
+
+            spans.PROFILE_THRESHOLD = 0
+            with spans.request('slow/query') as root:
+                sum(range(1000))
+            self.assertTrue(os.path.exists(root.profile))
+            self.assertTrue(os.path.basename(root.profile)
+                .startswith('slow_query-'))
+        finally:
+            shutil.rmtree(spans.PROFILE_DIR)
+            spans.PROFILE_DIR = profile_dir
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+# times importing each module in a fresh interpreter, as a CLI run or
+# plugin reload would, and lists which heavy dependencies it loaded.
+# usage: test_startup_time.py [runs]
+
+from __future__ import unicode_literals
+import subprocess
+import sys
+
+MODULES = ['cache', 'units', 'workers', 'climate', 'astrodata', 'server',
+    'batch']
+
+HEAVY = ['ephem', 'numpy', 'astrodata', 'cProfile']
+
+CODE = '''
+import sys, time
+start = time.time()
+import %s
+print time.time() - start
+print ' '.join(m for m in %r if m in sys.modules)
+'''
+
+if __name__ == '__main__':
+    runs = 10
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+
+    for module in MODULES:
+        times = []
+        for i in range(runs):
+            output = subprocess.check_output([sys.executable, '-c',
+                CODE % (module, [str(m) for m in HEAVY])])
+            seconds, loaded = output.split('\n')[:2]
+            times.append(float(seconds) * 1000)
+
+        print '%-10s min %6.1f ms  mean %6.1f ms  loads: %s' % (module,
+            min(times), sum(times) / len(times), loaded or '-')
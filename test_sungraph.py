@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+from xml.dom import minidom
+
+import astrodata
+import cache
+import sungraph
+
+# Toronto
+LOCATION = [43.7, -79.4]
+
+class sungraph_test(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = cache.CACHE_DIR
+        cache.CACHE_DIR = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(cache.CACHE_DIR)
+        cache.CACHE_DIR = self.cache_dir
+
+    def test_render(self):
+        """ each kind of graph should be a well-formed SVG document """
+
+        for kind in sungraph.KINDS:
+            svg = sungraph.render(43.7, -79.4, kind, -5, 'Toronto & around')
+            document = minidom.parseString(svg.encode('utf-8'))
+
+            root = document.documentElement
+            self.assertEqual(root.tagName, 'svg')
+            self.assertEqual(root.getAttribute('width'), str(sungraph.WIDTH))
+            self.assertTrue(len(document.getElementsByTagName('polyline')) > 0)
+            self.assertTrue('Toronto &amp; around' in svg)
+
+        self.assertRaises(ValueError, sungraph.render, 43.7, -79.4, 'moon')
+
+    def test_polar(self):
+        """ days without sunrise or sunset should still render """
+
+        svg = sungraph.render(78.2, 15.6, 'times')
+        minidom.parseString(svg.encode('utf-8'))
+        self.assertFalse('nan' in svg.lower())
+
+    def test_cache(self):
+        """ graphs should be rendered once, then read from disk """
+
+        svg = sungraph.get_graph(LOCATION, 'elevation')
+
+        graphs = os.listdir(os.path.join(cache.CACHE_DIR, sungraph.GRAPH_DIR))
+        self.assertEqual(len(graphs), 1)
+        file_name = os.path.join(cache.CACHE_DIR, sungraph.GRAPH_DIR, graphs[0])
+        self.assertEqual(os.stat(file_name).st_mode & 0o777, 0o644)
+
+        render = sungraph.render
+        def no_render(*args):
+            raise AssertionError('rendered again')
+
+        sungraph.render = no_render
+        try:
+            self.assertEqual(sungraph.get_graph(LOCATION, 'elevation'), svg)
+            # about 100 m away is the same graph
+            self.assertEqual(sungraph.get_graph([43.7001, -79.4001],
+                'elevation'), svg)
+        finally:
+            sungraph.render = render
+
+        # other parameters are other graphs
+        sungraph.get_graph(LOCATION, 'times')
+        sungraph.get_graph(LOCATION, 'times', -5)
+        self.assertEqual(len(sungraph.clear_all()), 3)
+
+    def test_place_titles(self):
+        """ names of the same place should share a cached graph, each
+        served with its own title """
+
+        location_lat_lon = astrodata.location_lat_lon
+        astrodata.location_lat_lon = lambda place: LOCATION
+        try:
+            toronto = sungraph.get_graph('Toronto')
+            york = sungraph.get_graph('York & around')
+            # and the other way around, from the file
+            self.assertEqual(sungraph.get_graph('Toronto'), toronto)
+            bare = sungraph.get_graph(LOCATION)
+        finally:
+            astrodata.location_lat_lon = location_lat_lon
+
+        self.assertTrue('>Sunrise and sunset in Toronto<' in toronto)
+        self.assertTrue('>Sunrise and sunset in York &amp; around<' in york)
+        self.assertFalse('Toronto' in york or 'Toronto' in bare)
+        self.assertTrue('>Sunrise and sunset<' in bare)
+        self.assertEqual(len(sungraph.clear_all()), 1)
+
+    def test_unknown_place(self):
+        """ places that can't be found should raise ValueError """
+
+        get_location_from_wikipedia = astrodata.get_location_from_wikipedia
+        def not_found(name):
+            raise KeyError('lat')
+
+        astrodata.get_location_from_wikipedia = not_found
+        try:
+            self.assertRaises(ValueError, sungraph.get_graph,
+                'No such place, surely')
+        finally:
+            astrodata.get_location_from_wikipedia = get_location_from_wikipedia
+            astrodata.observers.pop('No such place, surely')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import unicode_literals
+import json
+import time
+import unittest
+import urllib2
+
+import throttle
+
+class FakeResponse(object):
+    def __init__(self, text, headers = None):
+        self.text = text
+        self.headers = headers or {}
+
+    def read(self):
+        return self.text
+
+    def info(self):
+        return self.headers
+
+    def close(self):
+        pass
+
+def http_error(code, headers = None):
+    return urllib2.HTTPError('http://example.com', code, 'error',
+        headers or {}, None)
+
+class throttle_test(unittest.TestCase):
+    def setUp(self):
+        self.open_URL = throttle.open_URL
+        self.backoff_base = throttle.BACKOFF_BASE
+        throttle.BACKOFF_BASE = 0.001
+
+        throttle.bucket = throttle.TokenBucket(1000, 1000)
+        throttle.breaker = throttle.CircuitBreaker(throttle.FAILURE_THRESHOLD,
+            throttle.COOLDOWN)
+
+        self.requests = 0
+
+    def tearDown(self):
+        throttle.open_URL = self.open_URL
+        throttle.BACKOFF_BASE = self.backoff_base
+        throttle.bucket = throttle.TokenBucket(throttle.RATE, throttle.BURST)
+        throttle.breaker = throttle.CircuitBreaker(throttle.FAILURE_THRESHOLD,
+            throttle.COOLDOWN)
+
+    def respond_with(self, responses):
+        # each request gets the next response, or raises it if an error
+        def open_URL(url):
+            response = responses[self.requests]
+            self.requests += 1
+
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        throttle.open_URL = open_URL
+
+    def test_token_bucket(self):
+        """ requests past the burst should be spread out at the rate """
+
+        bucket = throttle.TokenBucket(50, 5)
+
+        start = time.time()
+        for i in range(10):
+            bucket.acquire()
+
+        # 5 at once, then 5 more at 50 a second
+        self.assertTrue(0.08 < time.time() - start < 0.3)
+
+    def test_retry(self):
+        """ transient errors should be retried """
+
+        self.respond_with([http_error(503), urllib2.URLError('down'),
+            FakeResponse(b'ok')])
+
+        self.assertEqual(throttle.fetch('url'), b'ok')
+        self.assertEqual(self.requests, 3)
+
+    def test_no_retry(self):
+        """ client errors should be raised straight away """
+
+        self.respond_with([http_error(404), FakeResponse(b'ok')])
+
+        self.assertRaises(urllib2.HTTPError, throttle.fetch, 'url')
+        self.assertEqual(self.requests, 1)
+
+    def test_give_up(self):
+        """ the last error should be raised once retries run out """
+
+        self.respond_with([http_error(500)] * (throttle.RETRIES + 1))
+
+        self.assertRaises(urllib2.HTTPError, throttle.fetch, 'url')
+        self.assertEqual(self.requests, throttle.RETRIES + 1)
+
+    def test_retry_after(self):
+        """ Retry-After should be waited for, on 429s and maxlag errors """
+
+        maxlag = json.dumps({'error': {'code': 'maxlag'}}).encode('utf-8')
+        self.respond_with([http_error(429, {'Retry-After': '0.1'}),
+            FakeResponse(maxlag, {'Retry-After': '0.1'}), FakeResponse(b'ok')])
+
+        start = time.time()
+        self.assertEqual(throttle.fetch('url'), b'ok')
+        self.assertTrue(time.time() - start >= 0.2)
+
+    def test_circuit_breaker(self):
+        """ after enough failures, requests should fail without trying """
+
+        throttle.breaker = throttle.CircuitBreaker(2, 0.1)
+        self.respond_with([http_error(503)] * 2 + [FakeResponse(b'ok')] * 2)
+
+        self.assertRaises(urllib2.HTTPError, throttle.fetch, 'url')
+        self.assertRaises(throttle.CircuitOpen, throttle.fetch, 'url')
+        self.assertEqual(self.requests, 2)
+
+        # after the cooldown, requests should be tried again
+        time.sleep(0.1)
+        self.assertEqual(throttle.fetch('url'), b'ok')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import unicode_literals
+import unittest
+
+import units
+
+class unit_conversion(unittest.TestCase):
+    def test_known_values(self):
+        """ conversions of known values, rounded as during parsing """
+
+        self.assertEqual(units.convert_row([32, 212, -40, None], 'F', 'C'),
+            [0, 100, -40, None])
+        self.assertEqual(units.convert(58.5, 'F', 'C', 1), 14.7)
+        self.assertEqual(units.convert(5.57, 'inch', 'mm', 1), 141.5)
+        self.assertEqual(units.convert(1.7, 'inch', 'cm', 1), 4.3)
+        self.assertEqual(units.convert(123, 'mm', 'cm', 1), 12.3)
+        self.assertEqual(units.convert(12.3, 'cm', 'mm', 1), 123)
+        self.assertEqual(units.convert(101.3, 'kPa', 'hPa', 1), 1013)
+        self.assertEqual(units.convert(0, 'C', 'K', 2), 273.15)
+
+    def test_round_trip(self):
+        """ converting a row to another unit and back should give
+        the original values """
+
+        row = [-40.0, -17.8, 0.0, 0.1, 12.3, 25.4, 37.5, 100.0, None]
+
+        for unit in units.UNITS:
+            for other_unit in units.UNITS:
+                if units.dimension(unit) != units.dimension(other_unit):
+                    continue
+
+                converted = units.convert_row(row, unit, other_unit)
+                back = units.convert_row(converted, other_unit, unit)
+
+                for value,expected in zip(back, row):
+                    if expected is None:
+                        self.assertEqual(value, None)
+                    else:
+                        self.assertAlmostEqual(value, expected, places = 9)
+
+    def test_sunshine(self):
+        """ daily hours and percent of possible sunshine are converted
+        per month """
+
+        self.assertEqual(units.convert_row([7.6, 5.5], 'daily hours', 'hours',
+            1, months = [12, 6]), [235.6, 165])
+
+        daylight = [300.0, 400.0]
+        self.assertEqual(units.convert_row([50, 25], 'percent', 'hours',
+            daylight = daylight), [150, 100])
+        self.assertEqual(units.convert_row([150, 100], 'hours', 'percent',
+            daylight = daylight), [50, 25])
+
+        self.assertRaises(ValueError, units.convert_row, [50], 'percent',
+            'hours')
+
+    def test_incompatible(self):
+        """ conversions between dimensions or unknown units should fail """
+
+        self.assertRaises(ValueError, units.convert_row, [1], 'C', 'mm')
+        self.assertRaises(ValueError, units.convert_row, [1], 'C', 'furlong')
+
+    def test_row_unit(self):
+        """ unit should be found from the climate category name """
+
+        self.assertEqual(units.row_unit('record high C'), 'C')
+        self.assertEqual(units.row_unit('precipitation inch'), 'inch')
+        self.assertEqual(units.row_unit('rain days'), None)
+        self.assertEqual(units.row_unit('sun'), None)
+
+if __name__ == '__main__':
+    unittest.main()
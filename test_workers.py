@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import unicode_literals
+import unittest
+import threading
+import time
+
+import workers
+
+class thread_pool(unittest.TestCase):
+    def test_ordered(self):
+        """ ordered imap should yield results in the order of items,
+        even when later items finish first """
+
+        def work(delay):
+            time.sleep(delay)
+            return delay * 2
+
+        delays = [0.2, 0.0, 0.1, 0.0]
+        results = [(item, job.result())
+            for item,job in workers.imap(work, delays, workers = 4)]
+
+        self.assertEqual(results, [(d, d * 2) for d in delays])
+
+    def test_unordered(self):
+        """ unordered imap should yield results as they finish """
+
+        def work(delay):
+            time.sleep(delay)
+            return delay
+
+        results = [job.result() for item,job in
+            workers.imap(work, [0.3, 0.0], workers = 2, ordered = False)]
+
+        self.assertEqual(results, [0.0, 0.3])
+
+    def test_concurrent(self):
+        """ items should be worked on at the same time """
+
+        time1 = time.time()
+        list(workers.imap(time.sleep, [0.2] * 8, workers = 8))
+
+        self.assertTrue(time.time() - time1 < 0.2 * 4)
+
+    def test_exception(self):
+        """ exceptions should be re-raised by job.result() only """
+
+        def work(item):
+            if item == 'bad':
+                raise ValueError(item)
+            return item
+
+        jobs = list(workers.imap(work, ['good', 'bad']))
+
+        self.assertEqual(jobs[0][1].result(), 'good')
+        self.assertRaises(ValueError, jobs[1][1].result)
+
+    def test_lazy_input(self):
+        """ imap should only take a bounded number of items ahead """
+
+        taken = []
+        def items():
+            for i in range(100):
+                taken.append(i)
+                yield i
+
+        results = workers.imap(lambda i: i, items(), workers = 2)
+        next(results)
+        self.assertTrue(len(taken) <= 5)
+        results.close()
+
+    def test_pool_size(self):
+        """ imap shouldn't start more workers than there are items, and
+        none at all for one item or none """
+
+        sizes = []
+        Pool = workers.Pool
+        class CountedPool(Pool):
+            def __init__(self, size = 8, queue_size = 0):
+                sizes.append(size)
+                Pool.__init__(self, size, queue_size)
+
+        workers.Pool = CountedPool
+        try:
+            self.assertEqual(list(workers.imap(lambda i: i, [])), [])
+
+            results = list(workers.imap(lambda i: threading.current_thread(),
+                ['only']))
+            self.assertEqual(results[0][1].result(),
+                threading.current_thread())
+            self.assertEqual(sizes, [])
+
+            list(workers.imap(lambda i: i, [1, 2, 3], workers = 8))
+            self.assertEqual(sizes, [3])
+
+            # without a length, as many as asked for
+            list(workers.imap(lambda i: i, iter([1, 2, 3]), workers = 4))
+            self.assertEqual(sizes, [3, 4])
+        finally:
+            workers.Pool = Pool
+
+    def test_full_and_timeout(self):
+        """ a full pool should refuse new work when asked not to wait,
+        and result() should time out on unfinished jobs """
+
+        pool = workers.Pool(1, queue_size = 1)
+        event = threading.Event()
+
+        running = pool.submit(event.wait)
+        time.sleep(0.05)
+        pool.submit(event.wait)
+        self.assertRaises(workers.Full, pool.submit_nowait, event.wait)
+        self.assertRaises(workers.Timeout, running.result, 0.05)
+
+        event.set()
+        self.assertTrue(running.result(1.0))
+        pool.shutdown(wait = True)
+
+if __name__ == '__main__':
+    unittest.main()
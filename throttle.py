@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+""" Polite, fault-tolerant HTTP fetching for Wikipedia API requests.
+
+All requests go through fetch(), which:
+- waits for a token from a shared token bucket, so bursts (query
+  candidate checks, cache warm-ups, many users at once) are spread out
+  to at most RATE requests a second after an initial BURST
+- retries transient errors (network errors, HTTP 429 and 5xx, and the
+  API's maxlag errors) up to RETRIES times, waiting as long as a
+  Retry-After header asks, or otherwise with jittered exponential backoff
+- stops trying for COOLDOWN seconds once FAILURE_THRESHOLD requests in
+  a row have failed (a circuit breaker), failing fast with CircuitOpen
+  rather than piling more requests onto a service that is down """
+
+from __future__ import unicode_literals
+import httplib
+import json
+import random
+import threading
+import time
+import urllib2
+
+import metrics
+
+# requests a second, and how many can be sent at once before that applies
+RATE = 10.0
+BURST = 20
+
+# retries after the first try, and backoff before retry n (counting
+# from 0): a random time up to BACKOFF_BASE * 2^n, at most BACKOFF_MAX
+RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+# consecutive failures before giving up for COOLDOWN seconds
+FAILURE_THRESHOLD = 5
+COOLDOWN = 60.0
+
+# maxlag parameter for API URLs: the API refuses requests while its
+# database replicas are more than this many seconds behind
+MAXLAG = 5
+
+# seconds to wait for a response
+TIMEOUT = 20
+
+# https://meta.wikimedia.org/wiki/User-Agent_policy
+USER_AGENT = 'climate-graph/0.1 (https://github.com/qviri/climate-graph)'
+
+class CircuitOpen(IOError):
+    """ Raised without trying when recent requests have all failed. """
+    pass
+
+class MaxLag(IOError):
+    """ The API refused the request because its database replicas are
+    lagging; see https://www.mediawiki.org/wiki/Manual:Maxlag_parameter """
+
+    def __init__(self, retry_after = None):
+        IOError.__init__(self, 'maxlag')
+        self.retry_after = retry_after
+
+# what fetch() raises when a page can't be had: network errors, timeouts,
+# broken responses, HTTP errors (urllib2.HTTPError is an IOError too),
+# CircuitOpen and MaxLag
+ERRORS = (IOError, httplib.HTTPException)
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = burst
+
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Take a token, waiting until one is available. """
+
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst,
+                    self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+class CircuitBreaker(object):
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+        self.failures = 0
+        self.opened = None
+        self.lock = threading.Lock()
+
+    def check(self):
+        """ Raise CircuitOpen if requests shouldn't be tried now. After
+        the cooldown, requests are let through again; one more failure
+        then opens the circuit again straight away. """
+
+        if self.is_open():
+            raise CircuitOpen('too many failed requests, not trying '
+                'again for up to %d seconds' % self.cooldown)
+
+    def is_open(self):
+        with self.lock:
+            return self.opened is not None \
+                and time.time() - self.opened < self.cooldown
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened = time.time()
+
+bucket = TokenBucket(RATE, BURST)
+breaker = CircuitBreaker(FAILURE_THRESHOLD, COOLDOWN)
+
+def open_URL(url):
+    request = urllib2.Request(url, headers = {'User-Agent': USER_AGENT})
+    return urllib2.urlopen(request, timeout = TIMEOUT)
+
+def retry_after(headers):
+    # seconds asked for by a Retry-After header. it can also be a date,
+    # which is rare enough to just use the usual backoff instead.
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+def check_maxlag(text, headers):
+    # maxlag errors come back as HTTP 200 with an error in the JSON
+    if b'"maxlag"' not in text:
+        return
+
+    try:
+        code = json.loads(text).get('error', {}).get('code')
+    except (ValueError, AttributeError):
+        return
+
+    if code == 'maxlag':
+        raise MaxLag(retry_after(headers))
+
+def backoff(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def fetch(url):
+    """ Return the body of url, retrying transient errors. Raises the
+    last error if every try fails, or CircuitOpen without trying if the
+    circuit breaker is open. HTTP errors other than 429 and 5xx (e.g. 404)
+    are raised straight away. """
+
+    attempt = 0
+    while True:
+        try:
+            breaker.check()
+        except CircuitOpen:
+            metrics.count('fetch.circuit_open')
+            raise
+        bucket.acquire()
+
+        wait = None
+        try:
+            response = open_URL(url)
+            try:
+                text = response.read()
+                check_maxlag(text, response.info())
+            finally:
+                response.close()
+
+            breaker.success()
+            return text
+        except urllib2.HTTPError as e:
+            if e.code != 429 and e.code < 500:
+                # our fault, retrying won't help
+                raise
+            error = e
+            wait = retry_after(e.info())
+        except MaxLag as e:
+            error = e
+            wait = e.retry_after
+        except ERRORS as e:
+            # network errors, timeouts, broken responses
+            error = e
+
+        breaker.failure()
+        metrics.count('fetch.error', detail = repr(error))
+
+        # no use retrying if this was the failure that opened the circuit
+        if attempt >= RETRIES or breaker.is_open():
+            raise error
+
+        if wait is None:
+            wait = backoff(attempt)
+        time.sleep(min(wait, BACKOFF_MAX))
+
+        attempt += 1
+        metrics.count('fetch.retry')
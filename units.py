@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+""" Unit conversions for weatherbox data.
+
+Conversions work on whole rows (a list of monthly values) at once: the
+conversion factors are looked up once per row rather than once per value.
+None values (no data) are passed through unchanged.
+
+Most units are linear within a dimension: value_in_base = value * scale
++ offset. Sunshine is the exception: converting between percent of
+possible sunshine and hours needs each month's daylight hours, and
+between daily and monthly hours needs the number of days in each month. """
+
+from __future__ import unicode_literals
+import calendar
+
+# unit: (dimension, scale, offset) relative to the dimension's base unit
+# (C, mm, hPa, km/h). offsets are only used for temperatures.
+UNITS = {
+    'C': ('temperature', 1.0, 0.0),
+    'F': ('temperature', 5.0/9.0, -32.0*5.0/9.0),
+    'K': ('temperature', 1.0, -273.15),
+
+    'mm': ('length', 1.0, 0.0),
+    'cm': ('length', 10.0, 0.0),
+    'inch': ('length', 25.4, 0.0),
+
+    'hPa': ('pressure', 1.0, 0.0),
+    'mb': ('pressure', 1.0, 0.0),
+    'kPa': ('pressure', 10.0, 0.0),
+    'inHg': ('pressure', 33.8638866667, 0.0),
+    'mmHg': ('pressure', 1.33322387415, 0.0),
+
+    'km/h': ('speed', 1.0, 0.0),
+    'm/s': ('speed', 3.6, 0.0),
+    'mph': ('speed', 1.609344, 0.0),
+    'kn': ('speed', 1.852, 0.0),
+}
+
+# sunshine units, converted per month rather than by a single factor
+SUN_UNITS = ['hours', 'daily hours', 'percent']
+
+# units as they may be typed in a query, e.g. "@climate get Toronto in F"
+UNIT_ALIASES = {
+    'c': 'C', 'celsius': 'C',
+    'f': 'F', 'fahrenheit': 'F',
+    'mm': 'mm', 'cm': 'cm',
+    'inch': 'inch', 'inches': 'inch',
+    'hpa': 'hPa', 'mb': 'mb', 'kpa': 'kPa', 'inhg': 'inHg', 'mmhg': 'mmHg',
+    'km/h': 'km/h', 'm/s': 'm/s', 'mph': 'mph', 'kn': 'kn', 'knots': 'kn'
+}
+
+# aliases that can also be words of place names ("Washington D C"), so
+# only count as units in a query right after "in", as in "Toronto in F"
+AMBIGUOUS_ALIASES = set(['c', 'f', 'mm', 'cm'])
+
+def dimension(unit):
+    if unit in UNITS:
+        return UNITS[unit][0]
+    if unit in SUN_UNITS:
+        return 'sunshine'
+
+    return None
+
+def days_in_months(months = range(1, 13)):
+    # use a non-leap year since I suspect monthly numbers are given
+    # for non-leap Februarys
+    return [calendar.monthrange(2013, month)[1] for month in months]
+
+def convert_row(values, from_unit, to_unit, digits = None,
+        months = range(1, 13), daylight = None):
+    """ Convert a row of values from from_unit to to_unit, rounding
+    to digits decimal places if given.
+    months: month numbers (1-12) the values are for, needed for
+    conversions between daily and monthly sunshine hours.
+    daylight: hours of daylight for each value's month, needed for
+    conversions between percent of possible sunshine and hours. """
+
+    if dimension(from_unit) is None or dimension(to_unit) is None:
+        raise ValueError('unknown unit: %s' % (from_unit
+            if dimension(from_unit) is None else to_unit))
+    if dimension(from_unit) != dimension(to_unit):
+        raise ValueError('cannot convert %s to %s' % (from_unit, to_unit))
+
+    if from_unit in SUN_UNITS:
+        factors = sun_factors(from_unit, to_unit, months, daylight)
+        converted = [value if value is None else value * factor
+            for value,factor in zip(values, factors)]
+    else:
+        # fold both steps (into base unit, out of base unit)
+        # into one multiplication and one addition per value
+        dummy,from_scale,from_offset = UNITS[from_unit]
+        dummy,to_scale,to_offset = UNITS[to_unit]
+
+        scale = from_scale / to_scale
+        offset = (from_offset - to_offset) / to_scale
+
+        if offset == 0:
+            converted = [value if value is None else value * scale
+                for value in values]
+        else:
+            converted = [value if value is None else value * scale + offset
+                for value in values]
+
+    if digits is not None:
+        converted = [value if value is None else round(value, digits)
+            for value in converted]
+
+    return converted
+
+def sun_factors(from_unit, to_unit, months, daylight):
+    # per-month factors for converting from_unit into hours,
+    # then hours into to_unit
+    def hour_factors(unit):
+        if unit == 'hours':
+            return [1.0] * len(months)
+        if unit == 'daily hours':
+            return [float(days) for days in days_in_months(months)]
+
+        if daylight is None:
+            raise ValueError('daylight hours are needed to convert %s'
+                % unit)
+        return [hours / 100.0 for hours in daylight]
+
+    return [a / b for a,b in
+        zip(hour_factors(from_unit), hour_factors(to_unit))]
+
+def convert(value, from_unit, to_unit, digits = None):
+    """ Convert a single value. """
+
+    return convert_row([value], from_unit, to_unit, digits)[0]
+
+def row_unit(category):
+    # last token of a category name is usually the unit
+    # (high C, precipitation mm, snow cm, ...)
+    unit = category.rsplit(None, 1)[-1]
+
+    if dimension(unit) is None:
+        return None
+
+    return unit
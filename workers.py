@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+""" Small thread pool for running blocking work (mostly HTTP fetches
+and parsing) concurrently. Python 2 has no concurrent.futures, and this
+is all we need of it. """
+
+from __future__ import unicode_literals
+import collections
+import itertools
+import Queue
+import sys
+import threading
+
+class Timeout(Exception):
+    pass
+
+# raised by Pool.submit_nowait when the pool's queue is full
+Full = Queue.Full
+
+# (get, set) function pairs for per-thread state (e.g. which request
+# metrics are recorded for) that jobs take along from the thread that
+# created them to the worker that runs them. see carry().
+carriers = []
+
+def carry(get, set):
+    carriers.append((get, set))
+
+class Job(object):
+    """ A function call that will be run by a pool worker. """
+
+    def __init__(self, func, args = (), callback = None):
+        self.func = func
+        self.args = args
+        self.callback = callback
+
+        self.context = [(set, get()) for get,set in carriers]
+
+        self.value = None
+        self.exc_info = None
+        self.finished = threading.Event()
+
+    def run(self):
+        previous = [(set, get()) for get,set in carriers]
+        for set,value in self.context:
+            set(value)
+
+        try:
+            self.value = self.func(*self.args)
+        except:
+            self.exc_info = sys.exc_info()
+        finally:
+            for set,value in previous:
+                set(value)
+
+        self.finished.set()
+
+        if self.callback is not None:
+            self.callback(self)
+
+    def done(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout = None):
+        if timeout is None:
+            # wait in short steps: a plain wait() can't be
+            # interrupted with ctrl-c in python 2
+            while not self.finished.wait(1.0):
+                pass
+        else:
+            self.finished.wait(timeout)
+
+        return self.done()
+
+    def result(self, timeout = None):
+        """ Return the function's return value, or re-raise the
+        exception it raised. Raises Timeout if it hasn't finished
+        within timeout seconds. """
+
+        if not self.wait(timeout):
+            raise Timeout()
+
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+
+        return self.value
+
+class Pool(object):
+    def __init__(self, workers = 8, queue_size = 0):
+        """ Start workers threads. queue_size limits the number of jobs
+        waiting to be run (0 means no limit). """
+
+        self.queue = Queue.Queue(queue_size)
+        self.threads = []
+
+        for i in range(workers):
+            thread = threading.Thread(target = self.work)
+            # don't keep the process alive just for idle workers
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+
+            job.run()
+
+    def put(self, job, block = True):
+        self.queue.put(job, block)
+        return job
+
+    def submit(self, func, *args):
+        """ Schedule func(*args), waiting for room in the queue if
+        it is full. Returns a Job. """
+
+        return self.put(Job(func, args))
+
+    def submit_nowait(self, func, *args):
+        """ As submit(), but raise Full rather than wait. """
+
+        return self.put(Job(func, args), block = False)
+
+    def shutdown(self, wait = False):
+        # workers finish the jobs already queued, then exit
+        for thread in self.threads:
+            self.queue.put(None)
+
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+def imap(func, items, workers = 8, ordered = True, pool = None):
+    """ Run func on each item concurrently, yielding (item, job) pairs
+    as jobs finish; job.result() gives the return value or raises.
+    With ordered = True, pairs are yielded in the order of items,
+    otherwise in the order they finish.
+    items is consumed lazily, with at most twice the number of workers
+    in flight, so long or endless inputs are fine. A pool can be given
+    to share its workers; otherwise one is started for this call, with
+    no more workers than items, and none at all for a single item, which
+    is run in this thread. """
+
+    own_pool = pool is None
+    if hasattr(items, '__len__'):
+        workers = max(1, min(workers, len(items)))
+
+    items = iter(items)
+    first = list(itertools.islice(items, 2))
+    if own_pool and len(first) < 2:
+        for item in first:
+            job = Job(func, (item,))
+            job.run()
+            yield item, job
+        return
+
+    items = itertools.chain(first, items)
+    if own_pool:
+        pool = Pool(workers)
+
+    completed = Queue.Queue()
+    pending = collections.deque()
+    exhausted = False
+
+    try:
+        while True:
+            while not exhausted and len(pending) < workers * 2:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+
+                job = Job(func, (item,),
+                    None if ordered else completed.put)
+                pending.append((item, job))
+                pool.put(job)
+
+            if len(pending) == 0:
+                break
+
+            if ordered:
+                item,job = pending.popleft()
+                job.wait()
+            else:
+                # timeout only so that ctrl-c works
+                while True:
+                    try:
+                        job = completed.get(True, 1.0)
+                        break
+                    except Queue.Empty:
+                        pass
+
+                item = [i for i,j in pending if j is job][0]
+                pending.remove((item, job))
+
+            yield item, job
+    finally:
+        if own_pool:
+            pool.shutdown(wait = True)